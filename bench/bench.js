@@ -0,0 +1,249 @@
+#!/usr/bin/env node
+/**
+ * Benchmark of ZygotePool throughput and latency.
+ *
+ * Usage: node bench/bench.js [options]
+ *      --zygotes N         pool size (default 4)
+ *      --concurrency N     requests in flight (default 8)
+ *      --requests N        requests to run (default 200)
+ *      --calls N           calls per request (default 1)
+ *      --warmup N          requests run before measuring (default 10)
+ *      --mix SPEC          call mix as fn:weight,... of add, echo, spin and
+ *                          file (default add:1)
+ *      --payload BYTES     size of echo arguments and file results (default 1000)
+ *      --spin MS           CPU time of spin calls (default 5)
+ *      --import WEIGHT     light or heavy question module (default light)
+ *      --pool-options JSON extra options for ZygotePool, e.g. '{"standbyWorker": true}'
+ *      --seed N            seed of the call mix (default 1)
+ *      --json FILE         also write the results as JSON to FILE ('-' for stdout only)
+ *
+ * Reports calls/sec and requests/sec, request latency percentiles and the
+ * latency of each phase (allocate, startWorker, call, killWorker, ...) taken
+ * from the metrics of the pool.
+ */
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const util = require('util');
+const { ZygotePool } = require('../zygote-pool');
+
+// pool metric => phase reported
+const PHASES = {
+	zyspawn_queue_wait_seconds: 'allocate',
+	zyspawn_worker_start_seconds: 'startWorker',
+	zyspawn_call_seconds: 'call',
+	zyspawn_call_import_seconds: 'import',
+	zyspawn_call_exec_seconds: 'exec',
+	zyspawn_worker_reset_seconds: 'resetWorker',
+	zyspawn_worker_kill_seconds: 'killWorker',
+};
+
+const DEFAULTS = {
+	zygotes: 4,
+	concurrency: 8,
+	requests: 200,
+	calls: 1,
+	warmup: 10,
+	mix: 'add:1',
+	payload: 1000,
+	spin: 5,
+	import: 'light',
+	poolOptions: '{}',
+	seed: 1,
+	json: null,
+};
+
+function parseArgs(argv) {
+	const config = Object.assign({}, DEFAULTS);
+	for (let i = 0; i < argv.length; i += 2) {
+		const name = argv[i].replace(/^--/, '').replace(/-(\w)/g, (m, c) => c.toUpperCase());
+		if (!(name in DEFAULTS) || i + 1 >= argv.length) {
+			throw new Error('Bad argument: ' + argv[i]);
+		}
+		config[name] = typeof DEFAULTS[name] === 'number' ? Number(argv[i + 1]) : argv[i + 1];
+	}
+	config.mix = config.mix.split(',').map((entry) => {
+		const [fn, weight] = entry.split(':');
+		return {fn: fn, weight: weight === undefined ? 1 : Number(weight)};
+	});
+	config.poolOptions = JSON.parse(config.poolOptions);
+	return config;
+}
+
+/**
+ * Small seeded PRNG (mulberry32), so that runs use the same call sequence.
+ */
+function random(seed) {
+	return () => {
+		seed = (seed + 0x6D2B79F5) | 0;
+		let t = Math.imul(seed ^ (seed >>> 15), 1 | seed);
+		t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+		return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+	};
+}
+
+function callArgs(fn, config) {
+	switch (fn) {
+		case 'add': return [1, 2];
+		case 'echo': return ['x'.repeat(config.payload)];
+		case 'spin': return [config.spin];
+		case 'file': return [config.payload];
+		default: throw new Error('Unknown function in mix: ' + fn);
+	}
+}
+
+function percentiles(values) {
+	if (values.length == 0) {
+		return {count: 0};
+	}
+	const sorted = values.slice().sort((a, b) => a - b);
+	const at = (p) => sorted[Math.min(sorted.length - 1, Math.ceil(p * sorted.length) - 1)];
+	const sum = sorted.reduce((a, b) => a + b, 0);
+	return {
+		count: sorted.length,
+		mean: sum / sorted.length,
+		p50: at(0.50),
+		p95: at(0.95),
+		p99: at(0.99),
+		max: sorted[sorted.length - 1],
+	};
+}
+
+/**
+ * Run one request of config.calls calls.
+ * @return {Promise} Resolved with the latency (ms) of the request
+ */
+function runRequest(zygotePool, config, next) {
+	const options = {cwd: path.join(__dirname, 'python-scripts')};
+	const moduleName = config.import === 'heavy' ? 'bench_heavy' : 'bench';
+	return new Promise((resolve, reject) => {
+		const start = process.hrtime();
+		const zygoteInterface = zygotePool.request();
+		let left = config.calls;
+		const callNext = () => {
+			if (left-- == 0) {
+				zygoteInterface.done((err) => {
+					if (err) return reject(err);
+					const [s, ns] = process.hrtime(start);
+					resolve(s * 1000 + ns / 1e6);
+				});
+				return;
+			}
+			const fn = next();
+			zygoteInterface.call(moduleName, fn, callArgs(fn, config), Object.assign({}, options), (err) => {
+				if (err) {
+					zygoteInterface.done(() => reject(err));
+					return;
+				}
+				callNext();
+			});
+		};
+		callNext();
+	});
+}
+
+/**
+ * Run count requests with config.concurrency of them in flight.
+ * @return {Promise} Resolved with {latencies, errors}
+ */
+function runRequests(zygotePool, config, count, next) {
+	const latencies = [];
+	const errors = [];
+	let started = 0;
+	const loop = () => {
+		if (started >= count) {
+			return Promise.resolve();
+		}
+		started++;
+		return runRequest(zygotePool, config, next)
+			.then((latency) => { latencies.push(latency); }, (err) => { errors.push(String(err)); })
+			.then(loop);
+	};
+	const loops = [];
+	for (let i = 0; i < Math.min(config.concurrency, count); i++) {
+		loops.push(loop());
+	}
+	return Promise.all(loops).then(() => ({latencies, errors}));
+}
+
+function main() {
+	const config = parseArgs(process.argv.slice(2));
+	const rand = random(config.seed);
+	const totalWeight = config.mix.reduce((sum, entry) => sum + entry.weight, 0);
+	const next = () => {
+		let r = rand() * totalWeight;
+		for (const entry of config.mix) {
+			r -= entry.weight;
+			if (r < 0) return entry.fn;
+		}
+		return config.mix[config.mix.length - 1].fn;
+	};
+
+	let zygotePool;
+	const phaseValues = {};
+	new Promise((resolve, reject) => {
+		zygotePool = new ZygotePool(config.zygotes, (err) => err ? reject(err) : resolve(), config.poolOptions);
+	}).then(() => runRequests(zygotePool, config, config.warmup, next)).then(() => {
+		zygotePool.metrics.on('metric', (name, value) => {
+			if (name in PHASES) {
+				(phaseValues[PHASES[name]] = phaseValues[PHASES[name]] || []).push(value * 1000);
+			}
+		});
+		const start = process.hrtime();
+		return runRequests(zygotePool, config, config.requests, next).then((outcome) => {
+			const [s, ns] = process.hrtime(start);
+			return Object.assign({elapsed: s + ns / 1e9}, outcome);
+		});
+	}).then((outcome) => {
+		const phases = {};
+		Object.keys(phaseValues).forEach((phase) => { phases[phase] = percentiles(phaseValues[phase]); });
+		const succeeded = outcome.latencies.length;
+		const results = {
+			config: Object.assign({}, config, {mix: config.mix}),
+			environment: {node: process.version, platform: process.platform, cpus: os.cpus().length},
+			elapsed: outcome.elapsed,
+			requests: succeeded,
+			errors: outcome.errors,
+			requestsPerSec: succeeded / outcome.elapsed,
+			callsPerSec: succeeded * config.calls / outcome.elapsed,
+			latency: percentiles(outcome.latencies), // ms per request
+			phases: phases, // ms per phase
+		};
+		report(results, config);
+		return new Promise((resolve) => zygotePool.shutdown(() => resolve()));
+	}).catch((err) => {
+		console.error(err);
+		process.exitCode = 1;
+		if (zygotePool) zygotePool.shutdown(() => {});
+	});
+}
+
+function report(results, config) {
+	if (config.json === '-') {
+		console.log(JSON.stringify(results, null, 2));
+		return;
+	}
+	const row = (name, stats) => util.format('%s%s %s %s %s %s %s',
+		name, ' '.repeat(Math.max(1, 12 - name.length)), pad(stats.count),
+		pad(stats.p50), pad(stats.p95), pad(stats.p99), pad(stats.max));
+	console.log(util.format('%d requests in %s s: %s requests/s, %s calls/s, %d errors',
+		results.requests, results.elapsed.toFixed(2), results.requestsPerSec.toFixed(1),
+		results.callsPerSec.toFixed(1), results.errors.length));
+	console.log('latency (ms)      count      p50      p95      p99      max');
+	console.log(row('request', results.latency));
+	Object.keys(results.phases).forEach((phase) => console.log(row(phase, results.phases[phase])));
+	if (config.json) {
+		fs.writeFileSync(config.json, JSON.stringify(results, null, 2) + '\n');
+	}
+}
+
+function pad(value) {
+	const str = value === undefined ? '-' : Number.isInteger(value) ? String(value) : value.toFixed(2);
+	return ' '.repeat(Math.max(0, 8 - str.length)) + str;
+}
+
+if (require.main === module) {
+	main();
+}
+
+module.exports.percentiles = percentiles;
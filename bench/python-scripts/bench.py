@@ -0,0 +1,16 @@
+import time
+
+def add(x, y):
+    return x + y
+
+def echo(s):
+    return s
+
+def spin(ms):
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+    return ms
+
+def file(n):
+    return bytes(n)
@@ -0,0 +1,8 @@
+# Same functions as bench.py, with an import that costs CPU time and memory
+# like a question module pulling in a few libraries.
+import json, decimal, fractions, statistics, random, re
+
+from bench import add, echo, spin, file
+
+TABLE = {i: str(i) * 4 for i in range(50000)}
+PATTERNS = [re.compile(r'x{%d}y' % i) for i in range(100)]
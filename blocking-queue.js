@@ -2,14 +2,20 @@
  * @fileoverview
  * This module defines BlockingQueue (see below).
  */
+const _ = require('lodash');
+const { TimeoutError } = require('./error');
 
 /**
  * A blocking queue which pends get request utill an item becomes available.
+ * Blocked get requests are served by priority (higher first) and in FIFO
+ * order among the same priority. A get request can have a deadline after
+ * which it fails with a TimeoutError instead of receiving an item.
  */
 class BlockingQueue {
 	constructor() {
 		this._items = [];
-		this._blockedJobs = [];
+		this._blockedJobs = []; // sorted by priority, then by time
+		this._waitStats = {};
 	}
 
 	/**
@@ -28,17 +34,68 @@ class BlockingQueue {
 		return this._blockedJobs.length;
 	}
 
+	/**
+	 * Get how long the oldest blocked job has been waiting.
+	 * @return {number} Waiting time in ms (0 if no job is blocked)
+	 */
+	longestWaitTime() {
+		if (this._blockedJobs.length == 0) {
+			return 0;
+		}
+		return Date.now() - this._blockedJobs.reduce((oldest, job) => Math.min(oldest, job.time), Infinity);
+	}
+
+	/**
+	 * Get waiting statistics of get requests for each priority.
+	 * @return {Object} Maps priority to {served, expired, totalWaitTime,
+	 *                  maxWaitTime} where times are in ms
+	 */
+	waitStats() {
+		return this._waitStats;
+	}
+
 	/**
 	 * Get an item from the queue. The callback will be called when an item
 	 * is available.
-	 * @param {function(Error, any)} callback Called when item is avaible or
-	 *                                        clearWaiting() is called.
+	 * @param {function(Error, any)} callback Called when item is avaible,
+	 *      the deadline has passed or clearWaiting() is called.
+	 * @param {Object} options Include optional priority (number, higher is
+	 *      served first, defaults to 0), deadline (Date or ms since epoch) and
+	 *      prefer (function(any): boolean, if several items are available the
+	 *      first one it accepts is taken)
 	 */
-	get(callback) {
-		if (this._items.length == 0) {
-			this._blockedJobs.push(callback);
+	get(callback, options={}) {
+		const job = {
+			callback: callback,
+			time: Date.now(),
+			priority: options.priority || 0,
+			deadline: options.deadline == null ? null : Number(options.deadline),
+			timer: null,
+		};
+		if (job.deadline !== null && job.deadline <= job.time) {
+			this._expire(job);
+		} else if (this._items.length == 0) {
+			const last = this._blockedJobs[this._blockedJobs.length - 1];
+			let index = (last === undefined || last.priority >= job.priority) ? -1 :
+				this._blockedJobs.findIndex((other) => other.priority < job.priority);
+			if (index == -1) {
+				this._blockedJobs.push(job);
+			} else {
+				this._blockedJobs.splice(index, 0, job);
+			}
+			if (job.deadline !== null) {
+				job.timer = setTimeout(() => {
+					_.pull(this._blockedJobs, job);
+					this._expire(job);
+				}, job.deadline - job.time);
+			}
 		} else {
-			callback(null, this._items.shift());
+			let index = options.prefer ? this._items.findIndex(options.prefer) : -1;
+			if (index == -1) {
+				this._serve(job, this._items.shift());
+			} else {
+				this._serve(job, this._items.splice(index, 1)[0]);
+			}
 		}
 	}
 
@@ -51,9 +108,22 @@ class BlockingQueue {
 		if (this._blockedJobs.length == 0) {
 			this._items.push(item);  
 		} else {
-			let callback = this._blockedJobs.shift();
-			callback(null, item);
+			this._serve(this._blockedJobs.shift(), item);
+		}
+	}
+
+	/**
+	 * Remove an item which is in the queue.
+	 * @param {any} item The item to remove
+	 * @return {boolean} False if the item is not in the queue
+	 */
+	remove(item) {
+		let index = this._items.indexOf(item);
+		if (index == -1) {
+			return false;
 		}
+		this._items.splice(index, 1);
+		return true;
 	}
 
 	/**
@@ -61,11 +131,34 @@ class BlockingQueue {
 	 * @param {Error} err The error to raise
 	 */
 	clearWaiting(err) {
-		this._blockedJobs.forEach((callback) => {
-			callback(err);
+		this._blockedJobs.forEach((job) => {
+			if (job.timer !== null) clearTimeout(job.timer);
+			job.callback(err);
 		});
 		this._blockedJobs.length = 0;
 	}
+
+	_serve(job, item) {
+		if (job.timer !== null) clearTimeout(job.timer);
+		const stats = this._statsOf(job.priority);
+		const waitTime = Date.now() - job.time;
+		stats.served++;
+		stats.totalWaitTime += waitTime;
+		stats.maxWaitTime = Math.max(stats.maxWaitTime, waitTime);
+		job.callback(null, item);
+	}
+
+	_expire(job) {
+		this._statsOf(job.priority).expired++;
+		job.callback(new TimeoutError("Waiting in BlockingQueue"));
+	}
+
+	_statsOf(priority) {
+		if (!(priority in this._waitStats)) {
+			this._waitStats[priority] = {served: 0, expired: 0, totalWaitTime: 0, maxWaitTime: 0};
+		}
+		return this._waitStats[priority];
+	}
 }
 
 module.exports = BlockingQueue;
@@ -67,11 +67,44 @@ class TimeoutError extends ZyspawnError {
 	}
 }
 
+/**
+ * Error when a call exceeds one of its resource limits. Occurs in
+ *      ZygoteInterface.call()
+ */
+class ResourceLimitError extends ZyspawnError {
+	/**
+	 * @param {string} limit The exceeded limit: 'cpu', 'memory' or 'files'
+	 */
+	constructor(limit, funcname, filename) {
+		super("Exceeded " + limit + " limit in function \"" + funcname + "\" in file \"" + filename + "\"");
+		this.limit = limit;
+	}
+}
+
+/**
+ * Error when the worker exits or is killed during a call, e.g. when it
+ * crashes or is killed by the OOM killer. Occurs in
+ *      ZygoteInterface.call()
+ */
+class WorkerDiedError extends ZyspawnError {
+	/**
+	 * @param {number} code The exit code of the worker, null if it was killed
+	 * @param {string} signal The name of the signal which killed the worker, or null
+	 */
+	constructor(code, signal, funcname, filename) {
+		super("Worker " + (signal !== null ? "killed by " + signal : "exited with code " + code) +
+			(funcname !== undefined ? " in function \"" + funcname + "\" in file \"" + filename + "\"" : ""));
+		this.code = code;
+		this.signal = signal;
+	}
+}
 
-// const {ZyspawnError, InternalZyspawnError, FileMissingError, FunctionMissingError, InvalidOperationError, TimeoutError}
+// const {ZyspawnError, InternalZyspawnError, FileMissingError, FunctionMissingError, InvalidOperationError, TimeoutError, ResourceLimitError, WorkerDiedError}
 module.exports.ZyspawnError = ZyspawnError;
 module.exports.InternalZyspawnError = InternalZyspawnError;
 module.exports.FileMissingError = FileMissingError;
 module.exports.FunctionMissingError = FunctionMissingError;
 module.exports.InvalidOperationError = InvalidOperationError;
 module.exports.TimeoutError = TimeoutError;
+module.exports.ResourceLimitError = ResourceLimitError;
+module.exports.WorkerDiedError = WorkerDiedError;
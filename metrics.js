@@ -0,0 +1,230 @@
+const EventEmitter = require('events');
+const _ = require('lodash');
+
+// Default buckets of histograms
+const SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+const BYTES_BUCKETS = [100, 1000, 10000, 100000, 1000000, 10000000, 100000000];
+
+/**
+ * Format labels as in the Prometheus text format, e.g. {operation="call"}.
+ * @param {Object} labels Maps label names to values
+ * @return {String}
+ */
+function formatLabels(labels) {
+	const names = Object.keys(labels).sort();
+	if (names.length == 0) {
+		return '';
+	}
+	return '{' + names.map((name) => {
+		const value = String(labels[name]).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+		return name + '="' + value + '"';
+	}).join(',') + '}';
+}
+
+/**
+ * A monotonically increasing count, per set of labels.
+ */
+class Counter {
+	/**
+	 * @param {String} name Metric name
+	 * @param {String} help Description of the metric
+	 */
+	constructor(name, help) {
+		this.name = name;
+		this.help = help;
+		this._values = new Map(); // formatted labels => {labels, value}
+	}
+
+	/**
+	 * @param {Object} labels
+	 * @param {number} value Amount to add, defaults to 1
+	 */
+	inc(labels={}, value=1) {
+		const key = formatLabels(labels);
+		let entry = this._values.get(key);
+		if (entry === undefined) {
+			entry = {labels: labels, value: 0};
+			this._values.set(key, entry);
+		}
+		entry.value += value;
+	}
+
+	/**
+	 * @param {Object} labels
+	 * @return {number} The current count for the labels
+	 */
+	get(labels={}) {
+		const entry = this._values.get(formatLabels(labels));
+		return entry === undefined ? 0 : entry.value;
+	}
+
+	toPrometheus() {
+		const lines = ['# HELP ' + this.name + ' ' + this.help, '# TYPE ' + this.name + ' counter'];
+		for (const [key, entry] of this._values) {
+			lines.push(this.name + key + ' ' + entry.value);
+		}
+		return lines.join('\n');
+	}
+}
+
+/**
+ * Counts observations in cumulative buckets, per set of labels.
+ */
+class Histogram {
+	/**
+	 * @param {String} name Metric name
+	 * @param {String} help Description of the metric
+	 * @param {Array} buckets Upper bounds of the buckets, in increasing order
+	 */
+	constructor(name, help, buckets=SECONDS_BUCKETS) {
+		this.name = name;
+		this.help = help;
+		this.buckets = buckets;
+		this._values = new Map(); // formatted labels => {labels, counts, sum, count}
+	}
+
+	/**
+	 * @param {number} value The observed value
+	 * @param {Object} labels
+	 */
+	observe(value, labels={}) {
+		const key = formatLabels(labels);
+		let entry = this._values.get(key);
+		if (entry === undefined) {
+			entry = {labels: labels, counts: this.buckets.map(() => 0), sum: 0, count: 0};
+			this._values.set(key, entry);
+		}
+		// buckets are few, a linear scan is fine
+		for (let i = 0; i < this.buckets.length; i++) {
+			if (value <= this.buckets[i]) {
+				entry.counts[i]++;
+				break;
+			}
+		}
+		entry.sum += value;
+		entry.count++;
+	}
+
+	/**
+	 * @param {Object} labels
+	 * @return {Object} {count, sum} of the observations for the labels
+	 */
+	get(labels={}) {
+		const entry = this._values.get(formatLabels(labels));
+		return entry === undefined ? {count: 0, sum: 0} : {count: entry.count, sum: entry.sum};
+	}
+
+	toPrometheus() {
+		const lines = ['# HELP ' + this.name + ' ' + this.help, '# TYPE ' + this.name + ' histogram'];
+		for (const [key, entry] of this._values) {
+			let cumulative = 0;
+			this.buckets.forEach((bound, i) => {
+				cumulative += entry.counts[i];
+				const labels = _.defaults({le: String(bound)}, entry.labels);
+				lines.push(this.name + '_bucket' + formatLabels(labels) + ' ' + cumulative);
+			});
+			const labels = _.defaults({le: '+Inf'}, entry.labels);
+			lines.push(this.name + '_bucket' + formatLabels(labels) + ' ' + entry.count);
+			lines.push(this.name + '_sum' + key + ' ' + entry.sum);
+			lines.push(this.name + '_count' + key + ' ' + entry.count);
+		}
+		return lines.join('\n');
+	}
+}
+
+/**
+ * The metrics of a ZygotePool and its zygotes. Every recorded value is also
+ * emitted as a 'metric' event with (name, value, labels).
+ */
+class Metrics extends EventEmitter {
+	constructor() {
+		super();
+		this._metrics = new Map(); // name => Counter or Histogram
+		this.histogram('zyspawn_queue_wait_seconds', 'Time requests waited for an idle zygote');
+		this.counter('zyspawn_queue_expired_total', 'Requests which passed their deadline waiting for an idle zygote');
+		this.histogram('zyspawn_worker_start_seconds', 'Latency of starting a worker');
+		this.histogram('zyspawn_worker_kill_seconds', 'Latency of killing a worker');
+		this.histogram('zyspawn_worker_reset_seconds', 'Latency of resetting a worker for reuse');
+		this.histogram('zyspawn_call_seconds', 'Latency of calls, including the round-trip to the worker');
+		this.histogram('zyspawn_call_import_seconds', 'Time calls spent importing their module in the worker');
+		this.histogram('zyspawn_call_exec_seconds', 'Time calls spent executing their function in the worker');
+		this.histogram('zyspawn_result_bytes', 'Size of call results', BYTES_BUCKETS);
+		this.counter('zyspawn_timeouts_total', 'Operations which timed out');
+		this.counter('zyspawn_port_broken_total', 'Operations which failed because a pipe to the zygote broke');
+		this.counter('zyspawn_zygote_spawns_total', 'Zygotes spawned');
+		this.counter('zyspawn_worker_deaths_total', 'Workers which died on their own, by signal');
+		this.counter('zyspawn_result_cache_requests_total', 'Lookups of calls in the result cache, by result (hit or miss)');
+	}
+
+	/**
+	 * Register a counter, or get the registered one.
+	 * @param {String} name
+	 * @param {String} help
+	 * @return {Counter}
+	 */
+	counter(name, help) {
+		if (!this._metrics.has(name)) {
+			this._metrics.set(name, new Counter(name, help));
+		}
+		return this._metrics.get(name);
+	}
+
+	/**
+	 * Register a histogram, or get the registered one.
+	 * @param {String} name
+	 * @param {String} help
+	 * @param {Array} buckets Upper bounds of the buckets
+	 * @return {Histogram}
+	 */
+	histogram(name, help, buckets=SECONDS_BUCKETS) {
+		if (!this._metrics.has(name)) {
+			this._metrics.set(name, new Histogram(name, help, buckets));
+		}
+		return this._metrics.get(name);
+	}
+
+	/**
+	 * Get a registered metric.
+	 * @param {String} name
+	 * @return {Counter|Histogram} The metric or undefined
+	 */
+	get(name) {
+		return this._metrics.get(name);
+	}
+
+	/**
+	 * Add to a registered counter.
+	 * @param {String} name
+	 * @param {Object} labels
+	 * @param {number} value
+	 */
+	inc(name, labels={}, value=1) {
+		this._metrics.get(name).inc(labels, value);
+		this.emit('metric', name, value, labels);
+	}
+
+	/**
+	 * Observe a value of a registered histogram.
+	 * @param {String} name
+	 * @param {number} value
+	 * @param {Object} labels
+	 */
+	observe(name, value, labels={}) {
+		this._metrics.get(name).observe(value, labels);
+		this.emit('metric', name, value, labels);
+	}
+
+	/**
+	 * Format all metrics in the Prometheus text exposition format.
+	 * @return {String}
+	 */
+	toPrometheus() {
+		return Array.from(this._metrics.values(), (metric) => metric.toPrometheus()).join('\n') + '\n';
+	}
+}
+
+module.exports.Metrics = Metrics;
+module.exports.Counter = Counter;
+module.exports.Histogram = Histogram;
+module.exports.SECONDS_BUCKETS = SECONDS_BUCKETS;
+module.exports.BYTES_BUCKETS = BYTES_BUCKETS;
@@ -1,38 +1,241 @@
-const assert = require('assert');
+const fs = require('fs');
+const path = require('path');
 const util = require('util');
 const stream = require('stream');
+const { StringDecoder } = require('string_decoder');
 
-const { InternalZyspawnError } = require('./error');
+const { InternalZyspawnError, InvalidOperationError } = require('./error');
+
+const NEWLINE = 0x0a;
+
+/**
+ * Serializers of shared memory segments (see Port), by name. msgpack needs
+ * the optional msgpack-lite package, which is loaded on first use.
+ */
+const SERIALIZERS = {
+	json: {
+		encode: (obj) => Buffer.from(JSON.stringify(obj)),
+		decode: (buffer) => JSON.parse(buffer.toString('utf8')),
+	},
+	msgpack: null,
+};
+
+/**
+ * @param {String} name 'json' or 'msgpack'
+ * @return {Object} The serializer {encode, decode}
+ */
+function getSerializer(name) {
+	if (name === 'msgpack' && SERIALIZERS.msgpack === null) {
+		let msgpack;
+		try {
+			msgpack = require('msgpack-lite');
+		} catch (err) {
+			throw new InvalidOperationError('serializer "msgpack" needs the msgpack-lite package');
+		}
+		SERIALIZERS.msgpack = {encode: msgpack.encode, decode: msgpack.decode};
+	}
+	if (!SERIALIZERS[name]) {
+		throw new InvalidOperationError('unknown serializer "' + name + '"');
+	}
+	return SERIALIZERS[name];
+}
+
+/**
+ * Drop the data of a transform up to and including the marker given to its
+ * resync(), see Port.resync().
+ * @return {Buffer} The data after the marker, or null if it has not come yet
+ */
+function skipToMarker(transform, data) {
+	const buffer = transform._markerTail === null ? data : Buffer.concat([transform._markerTail, data]);
+	const index = buffer.indexOf(transform._marker);
+	if (index == -1) {
+		// the marker may begin at the end of this chunk
+		transform._markerTail = buffer.slice(Math.max(0, buffer.length - transform._marker.length + 1));
+		return null;
+	}
+	const rest = buffer.slice(index + transform._marker.length);
+	transform._marker = null;
+	transform._markerTail = null;
+	return rest;
+}
 
 /**
  * Transform a stream of bytes into a stream of String (break by newline).
+ *
+ * Incoming chunks are kept in a list and only joined once a line is
+ * complete, so the cost is linear in the size of the data even for
+ * lines spanning many chunks. Every complete line in a chunk is emitted
+ * right away.
  */
 class LineTransform extends stream.Transform {
+	/**
+	 * @param {Object} options Options of stream.Transform, and optional
+	 *      maxMessageSize: maximum size of a line in bytes (0 means no limit).
+	 *      A longer line makes the stream emit a MessageTooLargeError.
+	 */
 	constructor(options) {
 		options = options || {};
 		options.readableObjectMode = true;
-		options.decodeStrings = false;
+		options.decodeStrings = true;
 		super(options);
-		this._buffer = "";
+		this._maxMessageSize = options.maxMessageSize || 0;
+		this._chunks = [];
+		this._length = 0;
+		this._marker = null; // see resync()
+		this._markerTail = null;
+	}
+
+	/**
+	 * Drop the buffered part of a line and all data up to the marker.
+	 * @param {Buffer} marker
+	 */
+	resync(marker) {
+		this._chunks = [];
+		this._length = 0;
+		this._marker = marker;
+		this._markerTail = null;
 	}
 
 	_transform(data, encoding, callback) {
-		this._buffer += data;
-		let end = this._buffer.indexOf('\n');
-		if (end != -1) {
-			this.push(this._buffer.substring(0, end));
-			this._buffer = this._buffer.substring(end+1);
+		if (this._marker !== null) {
+			data = skipToMarker(this, data);
+			if (data === null) {
+				callback();
+				return;
+			}
+		}
+		let start = 0;
+		let end = data.indexOf(NEWLINE);
+		while (end != -1) {
+			if (!this._append(data.slice(start, end))) {
+				callback(new MessageTooLargeError(this._maxMessageSize));
+				return;
+			}
+			this.push(this._takeLine());
+			start = end + 1;
+			end = data.indexOf(NEWLINE, start);
+		}
+		if (start < data.length && !this._append(data.slice(start))) {
+			callback(new MessageTooLargeError(this._maxMessageSize));
+			return;
 		}
 		callback();
 	}
 
 	_flush(callback) {
-		if (this._buffer.length > 0) {
-			this.push(this._buffer);
-			this._buffer = "";
+		if (this._length > 0) {
+			this.push(this._takeLine());
+		}
+		callback();
+	}
+
+	/**
+	 * Add part of a line, returns false if the line becomes too large.
+	 */
+	_append(chunk) {
+		this._chunks.push(chunk);
+		this._length += chunk.length;
+		return this._maxMessageSize == 0 || this._length <= this._maxMessageSize;
+	}
+
+	/**
+	 * Join the buffered chunks into a line and reset the buffer.
+	 */
+	_takeLine() {
+		let line = this._chunks.length == 1 ?
+			this._chunks[0] : Buffer.concat(this._chunks, this._length);
+		this._chunks = [];
+		this._length = 0;
+		return line.toString('utf8');
+	}
+}
+
+
+const FRAME_PREFIX_SIZE = 8;
+
+/**
+ * Transform a stream of bytes into a stream of frames. Each frame is
+ *      <header length: uint32 BE><payload length: uint32 BE><header><payload>
+ * and is emitted as {header: String, payload: Buffer}, where the header
+ * is decoded as utf-8 and the payload is left as raw bytes.
+ */
+class FrameTransform extends stream.Transform {
+	/**
+	 * @param {Object} options Options of stream.Transform, and optional
+	 *      maxMessageSize: maximum size of header and payload in bytes (0 means
+	 *      no limit). A larger frame makes the stream emit a MessageTooLargeError.
+	 */
+	constructor(options) {
+		options = options || {};
+		options.readableObjectMode = true;
+		options.decodeStrings = true;
+		super(options);
+		this._maxMessageSize = options.maxMessageSize || 0;
+		this._chunks = [];
+		this._length = 0;
+		this._headerLength = -1; // -1 until the prefix of a frame is read
+		this._payloadLength = -1;
+		this._marker = null; // see resync()
+		this._markerTail = null;
+	}
+
+	/**
+	 * Drop the buffered part of a frame and all data up to the marker.
+	 * @param {Buffer} marker
+	 */
+	resync(marker) {
+		this._chunks = [];
+		this._length = 0;
+		this._headerLength = -1;
+		this._payloadLength = -1;
+		this._marker = marker;
+		this._markerTail = null;
+	}
+
+	_transform(data, encoding, callback) {
+		if (this._marker !== null) {
+			data = skipToMarker(this, data);
+			if (data === null) {
+				callback();
+				return;
+			}
+		}
+		this._chunks.push(data);
+		this._length += data.length;
+		while (true) {
+			if (this._headerLength == -1) {
+				if (this._length < FRAME_PREFIX_SIZE) break;
+				let prefix = this._take(FRAME_PREFIX_SIZE);
+				this._headerLength = prefix.readUInt32BE(0);
+				this._payloadLength = prefix.readUInt32BE(4);
+				let size = this._headerLength + this._payloadLength;
+				if (this._maxMessageSize != 0 && size > this._maxMessageSize) {
+					callback(new MessageTooLargeError(this._maxMessageSize));
+					return;
+				}
+			}
+			if (this._length < this._headerLength + this._payloadLength) break;
+			let frame = this._take(this._headerLength + this._payloadLength);
+			this.push({
+				header: frame.toString('utf8', 0, this._headerLength),
+				payload: frame.slice(this._headerLength),
+			});
+			this._headerLength = -1;
+			this._payloadLength = -1;
 		}
 		callback();
 	}
+
+	/**
+	 * Remove the first n buffered bytes and return them.
+	 */
+	_take(n) {
+		let buffer = this._chunks.length == 1 ?
+			this._chunks[0] : Buffer.concat(this._chunks, this._length);
+		this._chunks = n < buffer.length ? [buffer.slice(n)] : [];
+		this._length -= n;
+		return buffer.slice(0, n);
+	}
 }
 
 
@@ -40,49 +243,142 @@ class LineTransform extends stream.Transform {
  * Wraps the logic of two-way communication through two pipes (one to
  * send and another to receive). Messages are expected to be strings of
  * JSON objects and seperated by newlines.
- * 
- * Timeout is also supported. Note that a timeout of one message will
- * lead to errors in all subsequent message sending. This is because
- * the sender cannot distinguish a late response for a timeout message
- * from the response for the current message (unless we specify an ID
- * for each message, which adds more complexity).
+ *
+ * Every message is wrapped in an envelope {id: <number>, msg: <object>}
+ * and the other side is expected to answer with the same id. Therefore
+ * several messages can be in flight together and responses are matched
+ * by id rather than by order.
+ *
+ * Responses are either lines or, with the 'binary' framing, frames of
+ * FrameTransform whose header is the JSON envelope and whose payload is
+ * passed to the callback as a Buffer.
+ *
+ * Timeout is also supported. A timeout only fails the message it was
+ * given for; a late response for that message is discarded. Malformed
+ * responses cannot be matched to any message, so they break the Port
+ * and lead to errors in all pending and subsequent messages. A writer
+ * killed in the middle of a response leaves part of it in the pipe; the
+ * next writer starts with a marker, see resync().
+ *
+ * With the shmThreshold option, a message larger than it is written to a
+ * file under shmDir (a tmpfs such as /dev/shm, so the data stays in
+ * memory) and only its path is sent, as {id, shm: <path>}. Responses may
+ * come the same way. The reader of a segment removes it. Segments are
+ * encoded with the serializer option (JSON or msgpack).
  */
 class Port {
 	/**
 	 * @param {stream.Writable} sender A raw stream to send data to
 	 * @param {stream.Readable} receiver A raw stream to receive data from
+	 * @param {Object} options Include optional maxMessageSize (in bytes) of
+	 *                         a response, framing ('line' or 'binary') of
+	 *                         responses, shmThreshold (bytes, 0 disables
+	 *                         shared memory segments), shmDir and serializer
+	 *                         ('json' or 'msgpack') of segments
 	 */
-	constructor(sender, receiver) {
-		this._in = receiver.pipe(new LineTransform());
+	constructor(sender, receiver, options={}) {
+		const transformOptions = {maxMessageSize: options.maxMessageSize};
+		this._in = receiver.pipe(options.framing === 'binary' ?
+			new FrameTransform(transformOptions) : new LineTransform(transformOptions));
 		this._out = sender;
-		this._busy = false;
-		this._waiting_jobs = [];
+		this._nextId = 0;
+		this._pendingJobs = new Map(); // id => {callback, timer}
 		this._broken = false;
+		this._unreportedError = null; // broken before any message was sent
+		this._shmThreshold = options.shmThreshold || 0;
+		this._shmDir = options.shmDir || '/dev/shm';
+		this._serializer = getSerializer(options.serializer || 'json');
+		this._in.on('data', this._handleResponse.bind(this));
+		this._in.on('error', this._break.bind(this));
+		// e.g. EPIPE when the other end has exited
+		this._out.on('error', this._break.bind(this));
 	}
 
 	/**
 	 * Send an object and get a response.
 	 * @param {Number} timeout Maximum waiting time (0 means no timeout)
 	 * @param {Object} obj The object to send
-	 * @param {Function(Error, Object)} callback Called when response received
-	 *                                           or any error happens
+	 * @param {Function(Error, Object, Buffer, Number)} callback Called when
+	 *      response received or any error happens. The Buffer is the payload
+	 *      of a binary frame (null for lines), the Number the length of the
+	 *      response (header and payload)
 	 */
 	send(obj, timeout, callback) {
 		if (this._broken) {
-			callback(new PortBrokenError());
-		} else {
-			this._waiting_jobs.push({obj: obj, timeout: timeout, callback: callback});
-			if (!this._busy) {
-				this._start_next_job();
+			callback(this._unreportedError || new PortBrokenError());
+			this._unreportedError = null;
+			return;
+		}
+
+		const id = this._nextId++;
+		const job = {callback: callback, timer: null, segment: null};
+		if (timeout !== 0) {
+			job.timer = setTimeout(() => {
+				// a late response will find no job and be discarded
+				this._pendingJobs.delete(id);
+				removeSegment(job.segment);
+				callback(new PortTimeoutError(timeout));
+			}, timeout);
+		}
+		this._pendingJobs.set(id, job);
+		this._out.write(this._envelope(id, obj, job) + '\n');
+	}
+
+	/**
+	 * Encode the envelope of a message, writing the message to a segment
+	 * if it is larger than shmThreshold.
+	 * @param {Object} job The job whose segment is recorded (removed if the
+	 *                     other side does not answer), if any
+	 */
+	_envelope(id, obj, job) {
+		let json = null;
+		if (this._shmThreshold > 0) {
+			let data = null;
+			if (this._serializer === SERIALIZERS.json) {
+				// the JSON is reused for the envelope of a small message
+				json = JSON.stringify(obj);
+				if (Buffer.byteLength(json) > this._shmThreshold) data = Buffer.from(json);
+			} else {
+				data = this._serializer.encode(obj);
+				if (data.length <= this._shmThreshold) data = null;
+			}
+			if (data !== null) {
+				const segment = path.join(this._shmDir, util.format('zyspawn-%d-%d', process.pid, nextSegmentId++));
+				fs.writeFileSync(segment, data, {mode: 0o600, flag: 'wx'});
+				if (job) job.segment = segment;
+				return JSON.stringify({id: id, shm: segment});
 			}
 		}
+		if (json === null) json = JSON.stringify(obj);
+		return '{"id":' + JSON.stringify(id) + ',"msg":' + json + '}';
+	}
+
+	/**
+	 * Drop what was received of a response and everything that comes before
+	 * the marker, e.g. when another process takes over the pipe of one that
+	 * was killed while writing a response. The new writer has to write the
+	 * marker before its first response.
+	 * @param {Buffer} marker
+	 */
+	resync(marker) {
+		this._in.resync(marker);
+	}
+
+	/**
+	 * Send an object without waiting for any response.
+	 * @param {Object} obj The object to send
+	 */
+	notify(obj) {
+		if (!this._broken) {
+			this._out.write(this._envelope(null, obj, null) + '\n');
+		}
 	}
 
 	/**
 	 * Check if this Port is busy (waiting for some response).
 	 */
 	isBusy() {
-		return this._busy;
+		return this._pendingJobs.size != 0;
 	}
 
 	/**
@@ -92,48 +388,159 @@ class Port {
 		return this._broken;
 	}
 
-	_start_next_job() {
-		assert(!this._busy);
-		assert(this._waiting_jobs.length != 0);
-
-		this._busy = true;
-		let job = this._waiting_jobs.shift();
-		
-		let timer, dataReceivedCallback;
+	_handleResponse(response) {
+		if (this._broken) return;
 
-		timer = job.timeout === 0 ? null : setTimeout(() => {
-			// clean up
-			this._in.removeListener('data', dataReceivedCallback);
-			this._busy = false;
-
-			this._break(job, new PortTimeoutError(job.timeout));
-		}, job.timeout);
+		let payload = null;
+		let size = response.length;
+		if (typeof response !== 'string') {
+			payload = response.payload;
+			response = response.header;
+			size = response.length + payload.length;
+		}
+		let envelope = parseJSON(response);
+		if (envelope instanceof SyntaxError || envelope === null
+				|| typeof envelope !== 'object' || !('id' in envelope)) {
+			this._break(new PortParseError(response));
+			return;
+		}
 
-		dataReceivedCallback = (response) => {
-			// clean up
-			if (job.timeout !== 0) clearTimeout(timer);
-			this._busy = false;
-			
-			let obj = parseJSON(response);
-			if (obj instanceof SyntaxError) {
-				this._break(job, new PortParseError(response));
-			} else {
-				if (this._waiting_jobs.length != 0) this._start_next_job();                
-				job.callback(null, obj);
+		let msg = envelope.msg;
+		if (typeof envelope.shm === 'string') {
+			try {
+				const data = fs.readFileSync(envelope.shm);
+				size += data.length;
+				msg = this._serializer.decode(data);
+			} catch (err) {
+				this._break(err);
+				return;
+			} finally {
+				removeSegment(envelope.shm);
 			}
-		};
+		}
 
-		this._in.once('data', dataReceivedCallback);
-		this._out.write(JSON.stringify(job.obj) + '\n');        
+		let job = this._pendingJobs.get(envelope.id);
+		if (job === undefined) {
+			// response for a message which has timed out
+			return;
+		}
+		this._pendingJobs.delete(envelope.id);
+		if (job.timer !== null) clearTimeout(job.timer);
+		// the other side has read the segment of the message
+		removeSegment(job.segment);
+		job.callback(null, msg, payload, size);
 	}
 
-	_break(current_job, err) {
-		this._broken = true;
-		current_job.callback(err);
-		this._waiting_jobs.forEach((job) => {
-			job.callback(new PortBrokenError());
+	/**
+	 * Fail the jobs waiting for a response, e.g. because the other side has
+	 * exited. Unlike a broken Port, the Port can still be used.
+	 * @param {Error} err Passed to the callbacks of the jobs
+	 */
+	cancel(err) {
+		let jobs = Array.from(this._pendingJobs.values());
+		this._pendingJobs.clear();
+		jobs.forEach((job) => {
+			if (job.timer !== null) clearTimeout(job.timer);
+			removeSegment(job.segment);
+			job.callback(err);
 		});
-		this._waiting_jobs.length = 0;
+	}
+
+	_break(err) {
+		this._broken = true;
+		if (this._pendingJobs.size == 0) {
+			this._unreportedError = err;
+		}
+		this.cancel(err);
+	}
+}
+
+
+/**
+ * Accumulate the stdout and stderr of a call.
+ *
+ * Chunks are kept once, as Buffers tagged with their stream, and only
+ * joined into strings when asked for. At most maxSize bytes are kept in
+ * total, the rest is dropped and replaced by a marker in the strings. A
+ * character cut at maxSize is dropped as a whole.
+ */
+class OutputCapture {
+	/**
+	 * @param {Number} maxSize Maximum number of bytes kept (0 means no limit)
+	 */
+	constructor(maxSize=0) {
+		this._maxSize = maxSize;
+		this._chunks = []; // {stream, data}
+		this._size = 0;
+		this._dropped = {stdout: 0, stderr: 0}; // bytes dropped per stream
+	}
+
+	/**
+	 * @param {String} stream 'stdout' or 'stderr'
+	 * @param {Buffer|String} data
+	 */
+	append(stream, data) {
+		if (typeof data === 'string') {
+			data = Buffer.from(data);
+		}
+		if (this._maxSize > 0 && this._size + data.length > this._maxSize) {
+			const keep = this._maxSize - this._size;
+			this._dropped[stream] += data.length - keep;
+			if (keep == 0) return;
+			data = data.slice(0, keep);
+		}
+		this._chunks.push({stream: stream, data: data});
+		this._size += data.length;
+	}
+
+	isTruncated() {
+		return this._dropped.stdout + this._dropped.stderr > 0;
+	}
+
+	stdout() {
+		return this._join('stdout', this._dropped.stdout);
+	}
+
+	stderr() {
+		return this._join('stderr', this._dropped.stderr);
+	}
+
+	/**
+	 * @return {String} stdout and stderr interleaved as they arrived
+	 */
+	both() {
+		return this._join(null, this._dropped.stdout + this._dropped.stderr);
+	}
+
+	_join(stream, dropped) {
+		const buffers = [];
+		for (const chunk of this._chunks) {
+			if (stream === null || chunk.stream === stream) {
+				buffers.push(chunk.data);
+			}
+		}
+		const buffer = Buffer.concat(buffers);
+		let str = buffer.toString('utf8');
+		if (dropped > 0) {
+			// the cut may be in the middle of a character, which is dropped too
+			str = new StringDecoder('utf8').write(buffer);
+			dropped += buffer.length - Buffer.byteLength(str);
+			str += util.format('\n[output truncated: %d bytes dropped]\n', dropped);
+		}
+		return str;
+	}
+}
+
+
+let nextSegmentId = 0;
+
+/**
+ * Remove a shared memory segment, if it still exists.
+ * @param {String} segment Path of the segment, or null
+ */
+function removeSegment(segment) {
+	if (segment !== null) {
+		fs.unlink(segment, () => {});
 	}
 }
 
@@ -168,8 +575,19 @@ class PortParseError extends InternalZyspawnError {
 }
 
 
+class MessageTooLargeError extends InternalZyspawnError {
+	constructor(maxMessageSize) {
+		super(`Message larger than the limit of ${maxMessageSize} bytes`);
+	}
+}
+
+
 module.exports.LineTransform = LineTransform;
+module.exports.FrameTransform = FrameTransform;
 module.exports.Port = Port;
+module.exports.OutputCapture = OutputCapture;
+module.exports.getSerializer = getSerializer;
 module.exports.PortBrorkenError = PortBrokenError;
 module.exports.PortTimeoutError = PortTimeoutError;
-module.exports.PortParseError = PortParseError;
\ No newline at end of file
+module.exports.PortParseError = PortParseError;
+module.exports.MessageTooLargeError = MessageTooLargeError;
\ No newline at end of file
@@ -0,0 +1,388 @@
+/**
+ * @fileoverview
+ * This module defines ResultCache (see below).
+ */
+const _ = require('lodash');
+const fs = require('fs');
+const path = require('path');
+const crypto = require('crypto');
+const { Output } = require('./zygote-manager');
+const { FileMissingError } = require('./error');
+
+// Number of module files whose hash is kept
+const FILE_HASH_LIMIT = 1000;
+
+/**
+ * Caches the Output of deterministic calls, keyed by the content of the
+ * module file, the function name and the arguments. Only the module file
+ * itself is hashed, not the modules it imports.
+ *
+ * Entries are kept in memory up to maxSize bytes and evicted in least
+ * recently used order. With a dir, entries are also written to files
+ * there, up to maxDiskSize bytes evicted in the same way, and read back
+ * when they are not in memory, e.g. after a restart.
+ *
+ * A cached Output has no usage (null), as the call did not run.
+ */
+class ResultCache {
+	/**
+	 * @param {Object} options Include optional maxSize (bytes of entries kept
+	 *      in memory, defaults to 64MB), dir (directory of the on-disk tier,
+	 *      none by default), maxDiskSize (bytes of entries kept in dir,
+	 *      defaults to 1GB), cacheByDefault (cache calls unless their
+	 *      options say cache: false, otherwise only calls with cache: true,
+	 *      defaults to false) and metrics (a Metrics, see metrics.js)
+	 */
+	constructor(options={}) {
+		options = _.defaults({}, options, {
+			maxSize: 64 * 1024 * 1024,
+			dir: null,
+			maxDiskSize: 1024 * 1024 * 1024,
+			cacheByDefault: false,
+			metrics: null,
+		});
+		this._options = options;
+		this.metrics = options['metrics'];
+		this._entries = new Map(); // key => {data: serialized Output, size}, in LRU order
+		this._size = 0;
+		this._diskEntries = new Map(); // key => size of its file, in LRU order
+		this._diskSize = 0;
+		this._fileHashes = new Map(); // path => {mtimeMs, size, hash}, in LRU order
+		this._hits = 0;
+		this._misses = 0;
+		this._writeErrors = 0;
+		if (options['dir'] !== null) {
+			if (!fs.existsSync(options['dir'])) {
+				fs.mkdirSync(options['dir']);
+			}
+			this._loadDiskEntries();
+		}
+	}
+
+	/**
+	 * Check if a call is to be cached.
+	 * @param {Object} options Options of the call, with optional cache
+	 * @return {boolean}
+	 */
+	isEnabled(options) {
+		return options && options.cache !== undefined ?
+			Boolean(options.cache) : this._options['cacheByDefault'];
+	}
+
+	/**
+	 * Compute the key of a call.
+	 * @param {String} moduleName The module of the call
+	 * @param {String} functionName The function of the call
+	 * @param {Array} args Arguments of the call
+	 * @param {Object} options Options of the call, with cwd and paths
+	 * @param {function(Error, String)} callback Called with the key, or an
+	 *      error if the module file is not found
+	 */
+	key(moduleName, functionName, args, options, callback) {
+		const dirs = [options.cwd || __dirname].concat(options.paths || []);
+		this._findModule(moduleName, dirs, (err, file, hash) => {
+			if (err) {
+				callback(err);
+				return;
+			}
+			const keyHash = crypto.createHash('sha256');
+			keyHash.update(JSON.stringify([
+				file, hash, functionName, canonicalize(args), Boolean(options.returnByArg),
+			]));
+			callback(null, keyHash.digest('hex'));
+		});
+	}
+
+	/**
+	 * Look up a call.
+	 * @param {String} key See key()
+	 * @param {function(Error, Output)} callback Called with a copy of the
+	 *      cached Output, or null on a miss
+	 */
+	get(key, callback) {
+		const entry = this._entries.get(key);
+		if (entry !== undefined) {
+			// move to the most recently used end
+			this._entries.delete(key);
+			this._entries.set(key, entry);
+			this._touchDiskEntry(key);
+			this._count(true);
+			callback(null, deserialize(entry.data));
+			return;
+		}
+		if (this._options['dir'] === null) {
+			this._count(false);
+			callback(null, null);
+			return;
+		}
+		fs.readFile(this._file(key), 'utf8', (err, data) => {
+			if (err) {
+				this._forgetDiskEntry(key);
+				this._count(false);
+				callback(null, null);
+				return;
+			}
+			this._store(key, data);
+			this._touchDiskEntry(key);
+			this._count(true);
+			callback(null, deserialize(data));
+		});
+	}
+
+	/**
+	 * Store the Output of a call.
+	 * @param {String} key See key()
+	 * @param {Output} output
+	 * @param {function(Error)} callback Optional, called once the entry is
+	 *      written to dir, or with the error of writing it (the entry is then
+	 *      only kept in memory)
+	 */
+	set(key, output, callback=() => {}) {
+		const data = serialize(output);
+		const size = Buffer.byteLength(data);
+		this._store(key, data);
+		if (this._options['dir'] === null || size > this._options['maxDiskSize']) {
+			callback(null);
+			return;
+		}
+		// write to a temporary file first, so readers never see a partial entry
+		const file = this._file(key);
+		const tmp = file + '.' + process.pid + '.tmp';
+		const failed = (err) => {
+			this._writeErrors++;
+			fs.unlink(tmp, () => callback(err));
+		};
+		fs.writeFile(tmp, data, (err) => {
+			if (err) {
+				failed(err);
+				return;
+			}
+			fs.rename(tmp, file, (err) => {
+				if (err) {
+					failed(err);
+					return;
+				}
+				this._forgetDiskEntry(key);
+				this._diskEntries.set(key, size);
+				this._diskSize += size;
+				this._evictDiskEntries();
+				callback(null);
+			});
+		});
+	}
+
+	/**
+	 * Remove all entries, also those on disk.
+	 */
+	clear() {
+		this._entries.clear();
+		this._size = 0;
+		this._diskEntries.clear();
+		this._diskSize = 0;
+		if (this._options['dir'] !== null) {
+			fs.readdirSync(this._options['dir']).forEach((name) => {
+				if (name.endsWith('.json')) {
+					fs.unlinkSync(path.join(this._options['dir'], name));
+				}
+			});
+		}
+	}
+
+	/**
+	 * @return {Object} {hits, misses, entries, size, diskEntries, diskSize,
+	 *      writeErrors} where entries and size (bytes) are of the in-memory
+	 *      entries and diskEntries and diskSize of those in dir
+	 */
+	stats() {
+		return {
+			hits: this._hits, misses: this._misses, entries: this._entries.size, size: this._size,
+			diskEntries: this._diskEntries.size, diskSize: this._diskSize, writeErrors: this._writeErrors,
+		};
+	}
+
+	_store(key, data) {
+		if (this._entries.has(key)) {
+			this._size -= this._entries.get(key).size;
+			this._entries.delete(key);
+		}
+		const size = Buffer.byteLength(data);
+		if (size > this._options['maxSize']) {
+			return;
+		}
+		this._entries.set(key, {data: data, size: size});
+		this._size += size;
+		for (const [oldKey, oldEntry] of this._entries) {
+			if (this._size <= this._options['maxSize']) break;
+			this._entries.delete(oldKey);
+			this._size -= oldEntry.size;
+		}
+	}
+
+	/**
+	 * Register the entries already in dir, least recently written first.
+	 */
+	_loadDiskEntries() {
+		const entries = [];
+		fs.readdirSync(this._options['dir']).forEach((name) => {
+			if (name.endsWith('.json')) {
+				const stat = fs.statSync(path.join(this._options['dir'], name));
+				entries.push({key: name.slice(0, -'.json'.length), size: stat.size, mtimeMs: stat.mtimeMs});
+			}
+		});
+		entries.sort((a, b) => a.mtimeMs - b.mtimeMs);
+		for (const entry of entries) {
+			this._diskEntries.set(entry.key, entry.size);
+			this._diskSize += entry.size;
+		}
+		this._evictDiskEntries();
+	}
+
+	_touchDiskEntry(key) {
+		const size = this._diskEntries.get(key);
+		if (size !== undefined) {
+			this._diskEntries.delete(key);
+			this._diskEntries.set(key, size);
+		}
+	}
+
+	_forgetDiskEntry(key) {
+		const size = this._diskEntries.get(key);
+		if (size !== undefined) {
+			this._diskEntries.delete(key);
+			this._diskSize -= size;
+		}
+	}
+
+	_evictDiskEntries() {
+		for (const [oldKey, oldSize] of this._diskEntries) {
+			if (this._diskSize <= this._options['maxDiskSize']) break;
+			this._diskEntries.delete(oldKey);
+			this._diskSize -= oldSize;
+			fs.unlink(this._file(oldKey), () => {});
+		}
+	}
+
+	_count(hit) {
+		if (hit) {
+			this._hits++;
+		} else {
+			this._misses++;
+		}
+		if (this.metrics) {
+			this.metrics.inc('zyspawn_result_cache_requests_total', {result: hit ? 'hit' : 'miss'});
+		}
+	}
+
+	_file(key) {
+		return path.join(this._options['dir'], key + '.json');
+	}
+
+	/**
+	 * Find the file of a module as python would (the first of the dirs with
+	 * <module>/__init__.py or <module>.py) and hash its content. The hashes
+	 * of the FILE_HASH_LIMIT most recently used files are kept until the
+	 * mtime or size of the file changes.
+	 * @param {function(Error, String, String)} callback Called with the path
+	 *      and the hash of the file
+	 */
+	_findModule(moduleName, dirs, callback) {
+		if (dirs.length == 0) {
+			callback(new FileMissingError(moduleName));
+			return;
+		}
+		const base = path.join(dirs[0], moduleName.replace(/\./g, path.sep));
+		// a package comes before a module of the same name
+		const files = [path.join(base, '__init__.py'), base + '.py'];
+		const next = (i) => {
+			if (i == files.length) {
+				this._findModule(moduleName, dirs.slice(1), callback);
+				return;
+			}
+			this._hashFile(files[i], (err, hash) => {
+				if (err) {
+					callback(err);
+				} else if (hash === null) {
+					next(i + 1);
+				} else {
+					callback(null, files[i], hash);
+				}
+			});
+		};
+		next(0);
+	}
+
+	/**
+	 * Hash the content of a file, see _findModule().
+	 * @param {String} file
+	 * @param {function(Error, String)} callback Called with the hash, or
+	 *      null if there is no such file
+	 */
+	_hashFile(file, callback) {
+		fs.stat(file, (err, stat) => {
+			if (err || !stat.isFile()) {
+				callback(null, null);
+				return;
+			}
+			const known = this._fileHashes.get(file);
+			if (known !== undefined && known.mtimeMs === stat.mtimeMs && known.size === stat.size) {
+				// move to the most recently used end
+				this._fileHashes.delete(file);
+				this._fileHashes.set(file, known);
+				callback(null, known.hash);
+				return;
+			}
+			fs.readFile(file, (err, content) => {
+				if (err) {
+					callback(err);
+					return;
+				}
+				const hash = crypto.createHash('sha256').update(content).digest('hex');
+				this._fileHashes.delete(file);
+				this._fileHashes.set(file, {mtimeMs: stat.mtimeMs, size: stat.size, hash: hash});
+				if (this._fileHashes.size > FILE_HASH_LIMIT) {
+					this._fileHashes.delete(this._fileHashes.keys().next().value);
+				}
+				callback(null, hash);
+			});
+		});
+	}
+}
+
+/**
+ * Convert a value to a form whose JSON does not depend on the order in which
+ * object keys were added.
+ */
+function canonicalize(value) {
+	if (Array.isArray(value)) {
+		return value.map(canonicalize);
+	}
+	if (value !== null && typeof value === 'object') {
+		const sorted = {};
+		Object.keys(value).sort().forEach((key) => {
+			sorted[key] = canonicalize(value[key]);
+		});
+		return sorted;
+	}
+	return value;
+}
+
+function serialize(output) {
+	const binary = Buffer.isBuffer(output.result);
+	return JSON.stringify({
+		stdout: output.stdout,
+		stderr: output.stderr,
+		consoleLog: output.consoleLog,
+		result: binary ? output.result.toString('base64') : output.result,
+		binary: binary,
+	});
+}
+
+function deserialize(data) {
+	const entry = JSON.parse(data);
+	return new Output(
+		entry.stdout, entry.stderr, entry.consoleLog,
+		entry.binary ? Buffer.from(entry.result, 'base64') : entry.result
+	);
+}
+
+module.exports = ResultCache;
@@ -1,5 +1,6 @@
 const util = require('util')
 const BlockingQueue = require('../blocking-queue');
+const { TimeoutError } = require('../error');
 
 const { timeout }  = require('./test-util');
 
@@ -73,3 +74,73 @@ test("stress test", async () => {
     expect(q.size()).toBe(resourceNum);
     expect(q.waitingCount()).toBe(0);
 });
+
+
+test("remove and wait time test", async () => {
+    var q = new BlockingQueue();
+
+    q.put(1);
+    q.put(2);
+    expect(q.remove(1)).toBe(true);
+    expect(q.remove(1)).toBe(false);
+    expect(q.size()).toBe(1);
+    expect(q.longestWaitTime()).toBe(0);
+
+    q.get((err, n) => { expect(n).toBe(2); });
+    q.get((err, n) => { expect(n).toBe(3); });
+    expect(q.waitingCount()).toBe(1);
+
+    await timeout(50);
+    expect(q.longestWaitTime()).toBeGreaterThanOrEqual(40);
+    q.put(3);
+    expect(q.waitingCount()).toBe(0);
+    expect(q.longestWaitTime()).toBe(0);
+});
+
+
+test("priority and deadline test", async () => {
+    var q = new BlockingQueue();
+    var record = [];
+
+    q.get((err, n) => { record.push('low ' + n); });
+    q.get((err, n) => { record.push('high ' + n); }, {priority: 10});
+    q.get((err, n) => { record.push('normal ' + n); }, {priority: 5});
+    q.get((err, n) => { record.push('high2 ' + n); }, {priority: 10});
+    q.get((err, n) => {
+        expect(err).toBeInstanceOf(TimeoutError);
+        record.push('expired');
+    }, {priority: 20, deadline: Date.now() + 20});
+
+    await timeout(50);
+    expect(q.waitingCount()).toBe(4);
+    for (let i = 1; i <= 4; i++) {
+        q.put(i);
+    }
+    expect(record).toEqual(['expired', 'high 1', 'high2 2', 'normal 3', 'low 4']);
+
+    // a passed deadline fails even if an item is available
+    q.put(5);
+    q.get((err, n) => {
+        expect(err).toBeInstanceOf(TimeoutError);
+    }, {deadline: new Date(Date.now() - 1)});
+    expect(q.size()).toBe(1);
+
+    let stats = q.waitStats();
+    expect(stats[10].served).toBe(2);
+    expect(stats[10].maxWaitTime).toBeGreaterThanOrEqual(40);
+    expect(stats[20].expired).toBe(1);
+    expect(stats[0].served).toBe(1);
+    expect(stats[0].expired).toBe(1);
+});
+
+
+test("prefer test", async () => {
+    var q = new BlockingQueue();
+
+    q.put(1);
+    q.put(2);
+    q.put(3);
+    q.get((err, n) => { expect(n).toBe(2); }, {prefer: (n) => n % 2 == 0});
+    q.get((err, n) => { expect(n).toBe(1); }, {prefer: (n) => n % 2 == 0});
+    expect(q.size()).toBe(1);
+});
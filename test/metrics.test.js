@@ -0,0 +1,53 @@
+const { Metrics, Counter, Histogram } = require('../metrics');
+
+
+test("counter test", () => {
+    var c = new Counter('requests_total', 'Requests');
+    c.inc();
+    c.inc({kind: 'a'}, 2);
+    c.inc({kind: 'a'});
+
+    expect(c.get()).toBe(1);
+    expect(c.get({kind: 'a'})).toBe(3);
+    expect(c.get({kind: 'b'})).toBe(0);
+    expect(c.toPrometheus()).toBe([
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total 1',
+        'requests_total{kind="a"} 3',
+    ].join('\n'));
+});
+
+test("histogram test", () => {
+    var h = new Histogram('latency_seconds', 'Latency', [0.1, 1]);
+    h.observe(0.05);
+    h.observe(0.5);
+    h.observe(5);
+
+    expect(h.get()).toEqual({count: 3, sum: 5.55});
+    expect(h.toPrometheus()).toBe([
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ].join('\n'));
+});
+
+test("metrics events test", () => {
+    var m = new Metrics();
+    var record = [];
+    m.on('metric', (name, value, labels) => record.push([name, value, labels]));
+
+    m.inc('zyspawn_timeouts_total', {operation: 'call'});
+    m.observe('zyspawn_call_seconds', 0.2);
+
+    expect(record).toEqual([
+        ['zyspawn_timeouts_total', 1, {operation: 'call'}],
+        ['zyspawn_call_seconds', 0.2, {}],
+    ]);
+    expect(m.get('zyspawn_timeouts_total').get({operation: 'call'})).toBe(1);
+    expect(m.toPrometheus()).toMatch(/^zyspawn_timeouts_total\{operation="call"\} 1$/m);
+});
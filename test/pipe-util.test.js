@@ -1,10 +1,16 @@
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
 const stream = require('stream');
 const {
     LineTransform,
+    FrameTransform,
     Port,
+    OutputCapture,
     PortBrorkenError,
     PortTimeoutError,
-    PortParseError
+    PortParseError,
+    MessageTooLargeError
 } = require('../pipe-util');
 const { timeout }  = require('./test-util');
 
@@ -33,6 +39,66 @@ test("LineTransform test", async () => {
     await check;
 });
 
+function frame(header, payload) {
+    let headerBuffer = Buffer.from(header);
+    let prefix = Buffer.alloc(8);
+    prefix.writeUInt32BE(headerBuffer.length, 0);
+    prefix.writeUInt32BE(payload.length, 4);
+    return Buffer.concat([prefix, headerBuffer, payload]);
+}
+
+test("FrameTransform test", async () => {
+    let input = new stream.PassThrough();
+    let output = input.pipe(new FrameTransform());
+
+    let results = [];
+    output.on('data', (f) => { results.push([f.header, Array.from(f.payload)]); });
+    let check = new Promise((resolve) => {
+        output.on('end', () => {
+            expect(results).toEqual([["A", []], ["BB", [0, 10, 255]], ["C", [1]]]);
+            resolve();
+        });
+    });
+
+    let data = Buffer.concat([
+        frame("A", Buffer.alloc(0)),
+        frame("BB", Buffer.from([0, 10, 255])),
+        frame("C", Buffer.from([1])),
+    ]);
+    // split in every possible position of the second frame
+    input.write(data.slice(0, 10)); await timeout(10);
+    for (let i = 10; i < data.length - 10; i++) {
+        input.write(data.slice(i, i + 1));
+    }
+    await timeout(10);
+    input.write(data.slice(data.length - 10));
+    input.end(); await timeout(10);
+
+    await check;
+});
+
+test("Transform resync test", async () => {
+    let marker = Buffer.from('sync-1234\n');
+    let lines = new LineTransform();
+    let frames = new FrameTransform();
+    let results = [];
+    lines.on('data', (line) => { results.push(line); });
+    frames.on('data', (f) => { results.push(f.header); });
+
+    // a partial message, then more of it before the marker, which is split
+    lines.write('{"id": 1, "ms');
+    lines.resync(marker);
+    lines.write('g": null}\nsync-12');
+    lines.write('34\n{"id": 2}\n');
+    let data = frame("A", Buffer.alloc(100));
+    frames.write(data.slice(0, 20));
+    frames.resync(marker);
+    frames.write(Buffer.concat([data.slice(20), marker, frame("B", Buffer.alloc(0))]));
+    await timeout(10);
+
+    expect(results).toEqual(['{"id": 2}', 'B']);
+});
+
 test("Port basic test", async () => {
     let echo = new stream.PassThrough();
     let port = new Port(echo, echo);
@@ -70,6 +136,24 @@ test("Port stress test", async () => {
     }
 });
 
+test("Port binary framing test", async () => {
+    let sender = new stream.PassThrough();
+    let receiver = new stream.PassThrough();
+    let port = new Port(sender, receiver, {framing: 'binary'});
+
+    let response = new Promise((resolve) => {
+        port.send('file', 100, (err, response, payload) => {
+            expect(err).toBeNull();
+            expect(response).toEqual({binary: true});
+            expect(Array.from(payload)).toEqual([0, 1, 2, 10, 255]);
+            resolve();
+        });
+    });
+    receiver.write(frame(JSON.stringify({id: 0, msg: {binary: true}}), Buffer.from([0, 1, 2, 10, 255])));
+
+    await response;
+});
+
 test("Port bad format test", async () => {
     let sender = new stream.PassThrough();
     let receiver = new stream.PassThrough();    
@@ -93,7 +177,9 @@ test("Port bad format test", async () => {
 });
 
 test("Port timeout test", async () => {
-    let port = new Port(stream.PassThrough(), stream.PassThrough());
+    let sender = new stream.PassThrough();
+    let receiver = new stream.PassThrough();
+    let port = new Port(sender, receiver);
 
     await new Promise((resolve) => {
         port.send('hello', 10, (err, response) => {
@@ -102,10 +188,192 @@ test("Port timeout test", async () => {
         });
     });
 
+    expect(port.isBroken()).toBe(false);
+
+    // the late response of 'hello' is discarded
+    sender.pipe(receiver);
+
     await new Promise((resolve) => {
-        port.send('hello', 10, (err, response) => {
-            expect(err).toBeInstanceOf(PortBrorkenError);
+        port.send('world', 10, (err, response) => {
+            expect(err).toBeNull();
+            expect(response).toBe('world');
+            resolve();
+        });
+    });
+});
+
+test("Port pipelining test", async () => {
+    let sender = new stream.PassThrough();
+    let receiver = new stream.PassThrough();
+    let port = new Port(sender, receiver);
+    let requests = input_lines(sender);
+    let msg = ['A', 'B', 'C'];
+
+    let jobs = msg.map((m) => new Promise((resolve) => {
+        port.send(m, 100, (err, response) => {
+            expect(err).toBeNull();
+            expect(response).toBe(m.toLowerCase());
+            resolve();
+        });
+    }));
+
+    await timeout(10);
+    expect(port.isBusy()).toBe(true);
+    // answer in reverse order
+    requests.reverse().forEach((request) => {
+        receiver.write(JSON.stringify({id: request.id, msg: request.msg.toLowerCase()}) + '\n');
+    });
+
+    await Promise.all(jobs);
+    expect(port.isBusy()).toBe(false);
+});
+
+function input_lines(readable) {
+    let lines = [];
+    readable.pipe(new LineTransform()).on('data', (line) => {
+        lines.push(JSON.parse(line));
+    });
+    return lines;
+}
+
+test("LineTransform max message size test", async () => {
+    let input = new stream.PassThrough();
+    let output = input.pipe(new LineTransform({maxMessageSize: 8}));
+    let results = [];
+    output.on('data', (line) => { results.push(line); });
+
+    await new Promise((resolve) => {
+        output.on('error', (err) => {
+            expect(err).toBeInstanceOf(MessageTooLargeError);
+            resolve();
+        });
+        input.write("12345678\n1234");
+        input.write("56789\n");
+    });
+
+    expect(results).toEqual(["12345678"]);
+});
+
+test("Port max message size test", async () => {
+    let echo = new stream.PassThrough();
+    let port = new Port(echo, echo, {maxMessageSize: 1024});
+
+    await new Promise((resolve) => {
+        port.send('x'.repeat(2048), 100, (err, response) => {
+            expect(err).toBeInstanceOf(MessageTooLargeError);
+            expect(port.isBroken()).toBe(true);
+            resolve();
+        });
+    });
+});
+
+test("Port shared memory segment test", async () => {
+    let dir = fs.mkdtempSync(path.join(os.tmpdir(), 'zyspawn-'));
+    let sent = [];
+    let echo = new stream.PassThrough();
+    echo.on('data', (line) => sent.push(JSON.parse(line)));
+    let port = new Port(echo, echo, {shmThreshold: 100, shmDir: dir});
+    // the last message is 55 characters but 135 bytes long
+    let msg = [{'small': 'x'}, {'large': 'x'.repeat(1000)}, {'euro': '€'.repeat(40)}];
+
+    await Promise.all(msg.map((m) => new Promise((resolve) => {
+        port.send(m, 100, (err, response, payload, size) => {
+            expect(err).toBeNull();
+            expect(response).toEqual(m);
             resolve();
         });
+    })));
+    // only the large messages went through a segment, which was removed
+    expect('msg' in sent[0]).toBe(true);
+    expect(typeof sent[1].shm).toBe('string');
+    expect(typeof sent[2].shm).toBe('string');
+    await timeout(10);
+    expect(fs.readdirSync(dir)).toEqual([]);
+    fs.rmdirSync(dir);
+});
+
+/**
+ * The former implementation of LineTransform, which concatenates strings
+ * and emits at most one line per chunk. Kept for the benchmark below.
+ */
+class StringLineTransform extends stream.Transform {
+    constructor() {
+        super({readableObjectMode: true, decodeStrings: false});
+        this._buffer = "";
+    }
+
+    _transform(data, encoding, callback) {
+        this._buffer += data;
+        let end = this._buffer.indexOf('\n');
+        if (end != -1) {
+            this.push(this._buffer.substring(0, end));
+            this._buffer = this._buffer.substring(end+1);
+        }
+        callback();
+    }
+}
+
+function timeLargeLine(transform, lineSize, chunkSize) {
+    let chunk = Buffer.alloc(chunkSize, 'a');
+    return new Promise((resolve) => {
+        let start = process.hrtime();
+        transform.on('data', (line) => {
+            let [s, ns] = process.hrtime(start);
+            expect(line.length).toBe(lineSize);
+            resolve(s * 1000 + ns / 1e6);
+        });
+        for (let written = 0; written < lineSize; written += chunkSize) {
+            transform.write(chunk);
+        }
+        transform.write('\n');
     });
-});
\ No newline at end of file
+}
+
+test("LineTransform large message benchmark", async () => {
+    jest.setTimeout(30000);
+    const lineSize = 8 * 1024 * 1024;
+    const chunkSize = 64 * 1024;
+
+    let stringTime = await timeLargeLine(new StringLineTransform(), lineSize, chunkSize);
+    let bufferTime = await timeLargeLine(new LineTransform(), lineSize, chunkSize);
+    console.log(`8MB line in 64KB chunks: string concatenation ${stringTime.toFixed(1)} ms, chunk list ${bufferTime.toFixed(1)} ms`);
+
+    expect(bufferTime).toBeLessThan(stringTime);
+});
+
+test("OutputCapture test", () => {
+    let capture = new OutputCapture();
+    capture.append('stdout', Buffer.from('a\n'));
+    capture.append('stderr', 'b\n');
+    // a multi-byte character split between chunks
+    let euro = Buffer.from('€\n');
+    capture.append('stdout', euro.slice(0, 1));
+    capture.append('stdout', euro.slice(1));
+
+    expect(capture.stdout()).toBe('a\n€\n');
+    expect(capture.stderr()).toBe('b\n');
+    expect(capture.both()).toBe('a\nb\n€\n');
+    expect(capture.isTruncated()).toBe(false);
+});
+
+test("OutputCapture max size test", () => {
+    let capture = new OutputCapture(5);
+    capture.append('stdout', 'abc');
+    capture.append('stderr', 'def');
+    capture.append('stdout', 'ghi');
+
+    expect(capture.isTruncated()).toBe(true);
+    expect(capture.stdout()).toBe('abc\n[output truncated: 3 bytes dropped]\n');
+    expect(capture.stderr()).toBe('de\n[output truncated: 1 bytes dropped]\n');
+    expect(capture.both()).toBe('abcde\n[output truncated: 4 bytes dropped]\n');
+});
+
+test("OutputCapture max size in a character test", () => {
+    let capture = new OutputCapture(5);
+    // '€' is 3 bytes, the limit falls after its first byte
+    capture.append('stdout', 'abcd€');
+    capture.append('stdout', 'ef');
+
+    expect(capture.stdout()).toBe('abcd\n[output truncated: 5 bytes dropped]\n');
+    expect(capture.both()).toBe('abcd\n[output truncated: 5 bytes dropped]\n');
+});
@@ -0,0 +1,2 @@
+def file(n):
+    return bytes(range(n))
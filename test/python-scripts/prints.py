@@ -0,0 +1,11 @@
+import sys, time
+
+def spam(n, line):
+    for i in range(n):
+        print(line)
+    sys.stderr.write("done\n")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # let the output arrive before the result
+    time.sleep(0.2)
+    return n
@@ -0,0 +1,7 @@
+def generate(data):
+    data["params"]["x"] = 2
+    print("generated")
+
+def grade(data):
+    data["score"] = 1 if data["params"]["x"] == 2 else 0
+    print("graded")
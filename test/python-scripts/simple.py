@@ -10,6 +10,14 @@ def timeout():
     while True:
         pass
 
+def timeoutCatching():
+    while True:
+        try:
+            while True:
+                pass
+        except Exception:
+            pass
+
 def sleep(seconds):
     time.sleep(seconds)
     return seconds
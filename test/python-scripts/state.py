@@ -0,0 +1,23 @@
+import os, signal, time
+
+calls = 0
+
+def count():
+    global calls
+    calls += 1
+    return calls
+
+def pid():
+    return os.getpid()
+
+def gcEnabled():
+    import gc
+    return gc.isenabled()
+
+def crash():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def partialResult():
+    # the start of a frame (or line) of 4096 bytes, which never ends
+    os.write(3, b'\x00\x00\x00\x10\x00\x00\x10\x00{"id": ')
+    time.sleep(60)
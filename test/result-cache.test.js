@@ -0,0 +1,104 @@
+const os = require('os');
+const fs = require('fs');
+const path = require('path');
+const util = require('util');
+const ResultCache = require('../result-cache');
+const { Output } = require('../zygote-manager');
+const { FileMissingError } = require('../error');
+
+const options = {
+    cwd: path.join(__dirname, 'python-scripts')
+}
+
+function key(cache, moduleName, fn, args, callOptions) {
+    return util.promisify(cache.key.bind(cache))(moduleName, fn, args, callOptions);
+}
+
+function get(cache, key) {
+    return util.promisify(cache.get.bind(cache))(key);
+}
+
+test("Result cache key test", async () => {
+    var cache = new ResultCache();
+    var k = await key(cache, "simple", "add", [{a: 1, b: 2}], options);
+    // the order of object keys does not matter
+    expect(await key(cache, "simple", "add", [{b: 2, a: 1}], options)).toBe(k);
+    expect(await key(cache, "simple", "add", [{a: 1, b: 3}], options)).not.toBe(k);
+    expect(await key(cache, "simple", "sub", [{a: 1, b: 2}], options)).not.toBe(k);
+    expect(await key(cache, "simple", "add", [{a: 1, b: 2}], {cwd: options.cwd, returnByArg: true})).not.toBe(k);
+    // modules are also found in paths
+    expect(await key(cache, "simple", "add", [{a: 1, b: 2}], {paths: [options.cwd]})).toBe(k);
+    await expect(key(cache, "nonexist", "add", [], options)).rejects.toBeInstanceOf(FileMissingError);
+
+    // packages are found by their __init__.py
+    var dir = fs.mkdtempSync(path.join(os.tmpdir(), 'zyspawn-package-'));
+    fs.mkdirSync(path.join(dir, 'pkg'));
+    fs.writeFileSync(path.join(dir, 'pkg', '__init__.py'), 'def f():\n    return 1\n');
+    k = await key(cache, "pkg", "f", [], {cwd: dir});
+    fs.writeFileSync(path.join(dir, 'pkg', '__init__.py'), 'def f():\n    return 2\n');
+    expect(await key(cache, "pkg", "f", [], {cwd: dir})).not.toBe(k);
+
+    expect(cache.isEnabled({})).toBe(false);
+    expect(cache.isEnabled({cache: true})).toBe(true);
+    expect(new ResultCache({cacheByDefault: true}).isEnabled({})).toBe(true);
+    expect(new ResultCache({cacheByDefault: true}).isEnabled({cache: false})).toBe(false);
+});
+
+test("Result cache get and set test", async () => {
+    var dir = fs.mkdtempSync(path.join(os.tmpdir(), 'zyspawn-cache-'));
+    var cacheOptions = {maxSize: 300, dir: dir};
+    var cache = new ResultCache(cacheOptions);
+    // the defaults do not end up in the options of the caller
+    expect(cacheOptions).toEqual({maxSize: 300, dir: dir});
+    expect(await get(cache, 'a')).toBe(null);
+
+    cache.set('a', new Output('out', '', '', {x: 1}, {utime: 0.1}));
+    cache.set('b', new Output('', '', '', Buffer.from('bytes'), {}));
+    var output = await get(cache, 'a');
+    expect(output).toBeInstanceOf(Output);
+    expect(output.stdout).toBe('out');
+    expect(output.result).toEqual({x: 1});
+    // the usage of the call which was cached is not reported again
+    expect(output.usage).toBe(null);
+    expect((await get(cache, 'b')).result).toEqual(Buffer.from('bytes'));
+    expect(cache.stats()).toEqual(expect.objectContaining({hits: 2, misses: 1, entries: 2}));
+
+    // the least recently used entry is evicted from memory, but read back from disk
+    cache.set('c', new Output('x'.repeat(100), '', '', null, {}));
+    expect(cache.stats().entries).toBe(2);
+    await new Promise((resolve) => setTimeout(resolve, 100));
+    expect((await get(cache, 'a')).result).toEqual({x: 1});
+
+    cache.clear();
+    expect(cache.stats().entries).toBe(0);
+    expect(await get(cache, 'c')).toBe(null);
+    fs.rmdirSync(dir);
+});
+
+test("Result cache disk size test", async () => {
+    var dir = fs.mkdtempSync(path.join(os.tmpdir(), 'zyspawn-cache-'));
+    var cache = new ResultCache({maxSize: 0, maxDiskSize: 250, dir: dir});
+    var set = util.promisify(cache.set.bind(cache));
+    // each entry is 100 bytes (80 characters), two of them fit
+    await set('a', new Output('€'.repeat(10), '', '', null));
+    await set('b', new Output('€'.repeat(10), '', '', null));
+    expect((await get(cache, 'a')).stdout).toBe('€'.repeat(10));
+    await set('c', new Output('€'.repeat(10), '', '', null));
+    expect(cache.stats()).toEqual(expect.objectContaining({entries: 0, diskEntries: 2}));
+    expect(cache.stats().diskSize).toBeLessThan(251);
+    await new Promise((resolve) => setTimeout(resolve, 100));
+    expect(fs.readdirSync(dir).sort()).toEqual(['a.json', 'c.json']);
+    expect(await get(cache, 'b')).toBe(null);
+
+    // entries in dir are found again
+    expect(new ResultCache({dir: dir}).stats().diskEntries).toBe(2);
+    cache.clear();
+
+    // a failed write leaves no temporary file behind
+    fs.mkdirSync(path.join(dir, 'd.json'));
+    await expect(set('d', new Output('', '', '', null))).rejects.toBeInstanceOf(Error);
+    expect(cache.stats().writeErrors).toBe(1);
+    expect(fs.readdirSync(dir)).toEqual(['d.json']);
+    fs.rmdirSync(path.join(dir, 'd.json'));
+    fs.rmdirSync(dir);
+});
@@ -1,7 +1,10 @@
+const fs = require('fs');
+const os = require('os');
 const util = require('util');
 const path = require('path');
 const ZygoteManager = require('../zygote-manager');
 const {timeout} = require('./test-util');
+const {ResourceLimitError, WorkerDiedError, TimeoutError, InvalidOperationError} = require('../error');
 
 const options = {
     cwd: path.join(__dirname, 'python-scripts')
@@ -258,3 +261,660 @@ test("Zygote reuse zygote", async (done) => {
           });
     });
 });
+
+test("Zygote preload reports timing", async (done) => {
+    jest.setTimeout(10000);
+    const preload = ["json", path.join(__dirname, "python-scripts", "strings.py"), "nonexsist_module"];
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          expect(zMan.preloadInfo.map((info) => info.name)).toEqual(preload);
+          expect(zMan.preloadInfo.map((info) => info.success)).toEqual([true, true, false]);
+          zMan.preloadInfo.forEach((info) => {
+              expect(info.time).toBeGreaterThanOrEqual(0);
+          });
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("strings", "count", ["ababab","ab"], options, (err, output) => {
+                  expect(err).toBeNull();
+                  expect(output.result).toBe(3);
+                  zMan.killWorker((err) => {
+                        expect(err).toBeNull();
+                        zMan.killMyZygote((err)=>{
+                            expect(err).toBeNull();
+                            zInterface = null;
+                            done();
+                        });
+                  });
+              });
+          });
+    }, {preload: preload});
+});
+
+test("Zygote survives timed out call", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("simple", "sleep", [0.5], {cwd: options.cwd, timeout: 100}, (err, output) => {
+                  expect(String(err)).toBe('ZyspawnError: Timeout on: function \"sleep\" in file \"simple\"');
+                  // status messages can be pipelined with killing the worker
+                  zMan.status((err, message) => {
+                      expect(err).toBeNull();
+                      expect(message.success).toBe(true);
+                  });
+                  zMan.killWorker((err) => {
+                      expect(err).toBeNull();
+                      zMan.startWorker((err)=>{
+                          expect(err).toBeNull();
+                          zMan.workerPid((err, pid) => {
+                              expect(err).toBeNull();
+                              expect(pid).toBeGreaterThan(0);
+                          });
+                          zMan.call("simple", "add", [1,2], options, (err, output) => {
+                              expect(err).toBeNull();
+                              expect(output.result).toBe(3);
+                              zMan.killWorker((err) => {
+                                  expect(err).toBeNull();
+                                  zMan.killMyZygote((err)=>{
+                                      expect(err).toBeNull();
+                                      zInterface = null;
+                                      done();
+                                  });
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    });
+});
+
+test("Zygote call file with binary results", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("files", "file", [256], options, (err, output) => {
+                  expect(err).toBeNull();
+                  expect(Buffer.isBuffer(output.result)).toBe(true);
+                  expect(output.result.length).toBe(256);
+                  expect(output.result[255]).toBe(255);
+                  zMan.call("simple", "add", [1,2], options, (err, output) => {
+                      expect(err).toBeNull();
+                      expect(output.result).toBe(3);
+                      zMan.killWorker((err) => {
+                          expect(err).toBeNull();
+                          zMan.killMyZygote((err)=>{
+                              expect(err).toBeNull();
+                              zInterface = null;
+                              done();
+                          });
+                      });
+                  });
+              });
+          });
+    }, {binaryResults: true});
+});
+
+test("Zygote call file with base64 results", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("files", "file", [256], options, (err, output) => {
+                  expect(err).toBeNull();
+                  expect(Buffer.from(output.result, 'base64').length).toBe(256);
+                  zMan.killWorker((err) => {
+                      expect(err).toBeNull();
+                      zMan.killMyZygote((err)=>{
+                          expect(err).toBeNull();
+                          zInterface = null;
+                          done();
+                      });
+                  });
+              });
+          });
+    });
+});
+
+test("Zygote warm modules", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.warm("strings", options, (err) => {
+              expect(err).toBeNull();
+              expect(zMan.isWarm("strings", options)).toBe(true);
+              zMan.warm("simple", options, (err) => {
+                  expect(err).toBeNull();
+                  // least recently warmed module is evicted
+                  expect(zMan.isWarm("strings", options)).toBe(false);
+                  expect(zMan.isWarm("simple", options)).toBe(true);
+                  zMan.warm("nonexsist", options, (err) => {
+                      expect(err).toBeTruthy();
+                      zMan.startWorker((err)=>{
+                          expect(err).toBeNull();
+                          zMan.call("simple", "add", [1,2], options, (err, output) => {
+                              expect(err).toBeNull();
+                              expect(output.result).toBe(3);
+                              zMan.killWorker((err) => {
+                                  expect(err).toBeNull();
+                                  zMan.killMyZygote((err)=>{
+                                      expect(err).toBeNull();
+                                      zInterface = null;
+                                      done();
+                                  });
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    }, {warmModuleLimit: 1});
+});
+
+test("Zygote call batch", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              const byArg = {cwd: options.cwd, returnByArg: true};
+              const calls = [
+                  {module: "question", fn: "generate", args: [{params: {}}], options: byArg},
+                  {module: "question", fn: "grade", args: [{}], options: byArg},
+                  {module: "simple", fn: "add", args: [1,2], options: options},
+                  {module: "simple", fn: "bad", args: [], options: options},
+                  {module: "simple", fn: "add", args: [3,4], options: options},
+              ];
+              zMan.callBatch(calls, {threadData: true}, (err, results) => {
+                  expect(err).toBeNull();
+                  // stopOnError skips the call after "bad"
+                  expect(results.length).toBe(4);
+                  expect(results[0].output.stdout).toBe("generated\n");
+                  expect(results[1].err).toBeNull();
+                  expect(results[1].output.stdout).toBe("graded\n");
+                  expect(results[1].output.result).toEqual({params: {x: 2}, score: 1});
+                  expect(results[2].output.result).toBe(3);
+                  expect(results[3].err).toBeTruthy();
+                  zMan.call("simple", "add", [1,2], options, (err, output) => {
+                      expect(err).toBeNull();
+                      expect(output.result).toBe(3);
+                      zMan.killWorker((err) => {
+                          expect(err).toBeNull();
+                          zMan.killMyZygote((err)=>{
+                              expect(err).toBeNull();
+                              zInterface = null;
+                              done();
+                          });
+                      });
+                  });
+              });
+          });
+    });
+});
+
+test("Zygote call with resource limits", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              const limited = {cwd: options.cwd, timeout: 5000, limits: {cpu: 1}};
+              zMan.call("simple", "timeout", [], limited, (err, output) => {
+                  expect(err).toBeInstanceOf(ResourceLimitError);
+                  expect(err.limit).toBe("cpu");
+                  // also when the function catches every Exception
+                  zMan.call("simple", "timeoutCatching", [], Object.assign({}, limited), (err, output) => {
+                      expect(err).toBeInstanceOf(ResourceLimitError);
+                      expect(err.limit).toBe("cpu");
+                      // the worker is still usable and reports its usage
+                      zMan.call("simple", "add", [1,2], {cwd: options.cwd}, (err, output) => {
+                          expect(err).toBeNull();
+                          expect(output.result).toBe(3);
+                          expect(output.usage.userCpu).toBeGreaterThanOrEqual(0);
+                          expect(output.usage.execTime).toBeGreaterThanOrEqual(0);
+                          expect(output.usage.maxRss).toBeGreaterThan(0);
+                          zMan.killWorker((err) => {
+                              expect(err).toBeNull();
+                              zMan.killMyZygote((err)=>{
+                                  expect(err).toBeNull();
+                                  zInterface = null;
+                                  done();
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    });
+});
+
+test("Zygote memory and worker gc", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("state", "gcEnabled", [], options, (err, output) => {
+                  expect(err).toBeNull();
+                  expect(output.result).toBe(false);
+                  zMan.memory((err, memory) => {
+                      expect(err).toBeNull();
+                      expect(memory.zygote.pss).toBeGreaterThan(0);
+                      // the worker shares pages with the zygote
+                      expect(memory.worker.shared).toBeGreaterThan(0);
+                      expect(memory.worker.uss).toBeLessThan(memory.worker.rss);
+                      zMan.killWorker((err) => {
+                          expect(err).toBeNull();
+                          zMan.memory((err, memory) => {
+                              expect(err).toBeNull();
+                              expect(memory.worker).toBeNull();
+                              zMan.killMyZygote((err)=>{
+                                  expect(err).toBeNull();
+                                  zInterface = null;
+                                  done();
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    }, {workerGc: 'disable'});
+});
+
+test("Zygote call with bounded and streamed output", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              let streamed = '';
+              const callOptions = {
+                  cwd: options.cwd,
+                  maxOutputSize: 100,
+                  onOutput: (stream, data) => {
+                      if (stream == 'stdout') streamed += data;
+                  },
+              };
+              zMan.call("prints", "spam", [50, "0123456789"], callOptions, (err, output) => {
+                  expect(err).toBeNull();
+                  expect(output.result).toBe(50);
+                  // everything is streamed, only maxOutputSize bytes are kept
+                  expect(streamed.length).toBe(550);
+                  expect(output.stdout).toBe(streamed.slice(0, 100) + '\n[output truncated: 450 bytes dropped]\n');
+                  expect(output.stderr).toBe('\n[output truncated: 5 bytes dropped]\n');
+                  zMan.killWorker((err) => {
+                      expect(err).toBeNull();
+                      zMan.killMyZygote((err)=>{
+                          expect(err).toBeNull();
+                          zInterface = null;
+                          done();
+                      });
+                  });
+              });
+          });
+    });
+});
+
+test("Zygote compile into code cache", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.status((err, status) => {
+              expect(err).toBeNull();
+              // the preloaded standard library module is loaded from its .pyc
+              expect(status.codeCache.entries).toBe(0);
+              zMan.compile([options.cwd], (err, codeCache) => {
+                  expect(err).toBeNull();
+                  expect(codeCache.entries).toBe(fs.readdirSync(options.cwd).filter((name) => name.endsWith('.py')).length);
+                  expect(codeCache.bytes).toBeGreaterThan(0);
+                  zMan.compile([path.join(options.cwd, "nonexsist.py")], (err) => {
+                      expect(err).toBeTruthy();
+                      zMan.startWorker((err)=>{
+                          expect(err).toBeNull();
+                          zMan.call("simple", "add", [1,2], options, (err, output) => {
+                              expect(err).toBeNull();
+                              expect(output.result).toBe(3);
+                              zMan.killWorker((err) => {
+                                  expect(err).toBeNull();
+                                  zMan.killMyZygote((err)=>{
+                                      expect(err).toBeNull();
+                                      zInterface = null;
+                                      done();
+                                  });
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    }, {codeCacheSize: 1024 * 1024, preload: ['fractions']});
+});
+
+test("Zygote preload compile without code cache", () => {
+    const preload = [path.join(__dirname, "python-scripts", "strings.py")];
+    expect(() => ZygoteManager.create(() => {}, {preload: preload, preloadCompile: true}))
+        .toThrow(InvalidOperationError);
+});
+
+test("Zygote compile without code cache", async (done) => {
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.compile([options.cwd], (err) => {
+              expect(err).toBeInstanceOf(InvalidOperationError);
+              zMan.killMyZygote((err)=>{
+                  expect(err).toBeNull();
+                  zInterface = null;
+                  done();
+              });
+          });
+    });
+});
+
+test("Zygote call with shared memory segments", async (done) => {
+    jest.setTimeout(10000);
+    const shmDir = fs.mkdtempSync(path.join(os.tmpdir(), 'zyspawn-'));
+    const callOptions = Object.assign({}, options, {returnByArg: true});
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              const data = {params: {}, matrix: 'x'.repeat(5000)};
+              zMan.call("question", "generate", [data], callOptions, (err, output) => {
+                  expect(err).toBeNull();
+                  expect(output.result.params.x).toBe(2);
+                  expect(output.result.matrix.length).toBe(5000);
+                  zMan.call("simple", "add", [1,2], options, (err, output) => {
+                      expect(err).toBeNull();
+                      expect(output.result).toBe(3);
+                      zMan.killWorker((err) => {
+                          expect(err).toBeNull();
+                          expect(fs.readdirSync(shmDir)).toEqual([]);
+                          fs.rmdirSync(shmDir);
+                          zMan.killMyZygote((err)=>{
+                              expect(err).toBeNull();
+                              zInterface = null;
+                              done();
+                          });
+                      });
+                  });
+              });
+          });
+    }, {shmThreshold: 1000, shmDir: shmDir});
+});
+
+test("Zygote with several worker slots", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          expect(zMan.freeSlotNum()).toBe(1);
+          const zSlot = zMan.attachSlot();
+          expect(zSlot.child).toBe(zMan.child);
+          expect(zMan.attachSlot()).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zSlot.startWorker((err)=>{
+                  expect(err).toBeNull();
+                  let pids = [];
+                  const check = (err, output) => {
+                      expect(err).toBeNull();
+                      pids.push(output.result);
+                      if (pids.length < 2) return;
+                      // every slot has its own worker
+                      expect(pids[0]).not.toBe(pids[1]);
+                      zSlot.killWorker((err) => {
+                          expect(err).toBeNull();
+                          // frees the slot, the zygote keeps running
+                          zSlot.killMyZygote((err) => {
+                              expect(err).toBeNull();
+                              expect(zSlot.hasDeparted()).toBe(true);
+                              expect(zMan.freeSlotNum()).toBe(1);
+                              zMan.call("simple", "add", [1,2], options, (err, output) => {
+                                  expect(err).toBeNull();
+                                  expect(output.result).toBe(3);
+                                  zMan.killWorker((err) => {
+                                      expect(err).toBeNull();
+                                      zMan.killMyZygote((err)=>{
+                                          expect(err).toBeNull();
+                                          zInterface = null;
+                                          done();
+                                      });
+                                  });
+                              });
+                          });
+                      });
+                  };
+                  zMan.call("state", "pid", [], options, check);
+                  zSlot.call("state", "pid", [], options, check);
+              });
+          });
+    }, {workerSlots: 2});
+});
+
+test("Zygote fork", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          expect(zMan.canFork({})).toBe(true);
+          expect(zMan.canFork({preload: ['json']})).toBe(false);
+          ZygoteManager.fork(zMan, (err, zForked)=>{
+              expect(err).toBeNull();
+              expect(zForked.child.pid).not.toBe(zMan.child.pid);
+              // the forked zygote is a child of the other one
+              const stat = fs.readFileSync('/proc/' + zForked.child.pid + '/stat', 'utf8');
+              expect(Number(stat.split(') ')[1].split(' ')[1])).toBe(zMan.child.pid);
+              expect(zForked.canFork({})).toBe(true);
+              zForked.startWorker((err)=>{
+                  expect(err).toBeNull();
+                  zForked.call("simple", "add", [1,2], options, (err, output) => {
+                      expect(err).toBeNull();
+                      expect(output.result).toBe(3);
+                      zForked.on('exit', (code, signal, unexpected) => {
+                          expect(unexpected).toBe(false);
+                      });
+                      zForked.killWorker((err) => {
+                          expect(err).toBeNull();
+                          zForked.killMyZygote((err)=>{
+                              expect(err).toBeNull();
+                              expect(zForked.hasDeparted()).toBe(true);
+                              zMan.killMyZygote((err)=>{
+                                  expect(err).toBeNull();
+                                  zInterface = null;
+                                  done();
+                              });
+                          });
+                      });
+                  });
+              });
+          }, {});
+    }, {});
+});
+
+test("Zygote worker death fails the call", async (done) => {
+    jest.setTimeout(10000);
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              const start = Date.now();
+              zMan.call("state", "crash", [], Object.assign({}, options, {timeout: 5000}), (err, output) => {
+                  // right away, not after the timeout
+                  expect(Date.now() - start).toBeLessThan(2000);
+                  expect(err).toBeInstanceOf(WorkerDiedError);
+                  expect(err.signal).toBe('SIGKILL');
+                  zMan.killWorker((err) => {
+                      expect(err).toBeNull();
+                      // the zygote starts another worker
+                      zMan.startWorker((err)=>{
+                          expect(err).toBeNull();
+                          zMan.call("simple", "add", [1,2], options, (err, output) => {
+                              expect(err).toBeNull();
+                              expect(output.result).toBe(3);
+                              zMan.killWorker((err) => {
+                                  zMan.killMyZygote((err)=>{
+                                      expect(err).toBeNull();
+                                      zInterface = null;
+                                      done();
+                                  });
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    }, {});
+});
+
+test("Zygote worker exits quietly at the end of its input", async (done) => {
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              let stderr = '';
+              zMan.stderr.on('data', (data) => { stderr += data; });
+              zMan.stdin.end();
+              setTimeout(() => {
+                  expect(stderr).toBe('');
+                  zMan.forceKillMyZygote((err)=>{
+                      zInterface = null;
+                      done();
+                  });
+              }, 500);
+          });
+    }, {});
+});
+
+test("Zygote worker killed while writing a result", async (done) => {
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("state", "partialResult", [], Object.assign({}, options, {timeout: 500}), (err, output) => {
+                  expect(err).toBeInstanceOf(TimeoutError);
+                  zMan.killWorker((err) => {
+                      expect(err).toBeNull();
+                      // the next worker's results are not read as the rest of the partial frame
+                      zMan.startWorker((err)=>{
+                          expect(err).toBeNull();
+                          zMan.call("simple", "add", [1,2], Object.assign({}, options, {timeout: 2000}), (err, output) => {
+                              expect(err).toBeNull();
+                              expect(output.result).toBe(3);
+                              expect(zMan.isHealthy()).toBe(true);
+                              zMan.killWorker((err) => {
+                                  zMan.killMyZygote((err)=>{
+                                      expect(err).toBeNull();
+                                      zInterface = null;
+                                      done();
+                                  });
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    }, {binaryResults: true});
+});
+
+test("Zygote worker death before its start is answered", async (done) => {
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          // deliver the answer to create worker only after the exit of the worker
+          const send = zMan.controlPort.send;
+          zMan.controlPort.send = function(obj, timeout, callback) {
+              send.call(this, obj, timeout, (err, message) => {
+                  if (obj.action !== 'create worker') {
+                      callback(err, message);
+                      return;
+                  }
+                  process.kill(message.pid, 'SIGKILL');
+                  const wait = setInterval(() => {
+                      if (zMan._earlyExits.size > 0) {
+                          clearInterval(wait);
+                          zMan.controlPort.send = send;
+                          callback(err, message);
+                      }
+                  }, 10);
+              });
+          };
+          zMan.startWorker((err)=>{
+              expect(err).toBeInstanceOf(WorkerDiedError);
+              expect(err.signal).toBe('SIGKILL');
+              expect(zMan.isWorkerReady()).toBe(false);
+              // the zygote starts another worker
+              zMan.startWorker((err)=>{
+                  expect(err).toBeNull();
+                  zMan.call("simple", "add", [1,2], Object.assign({}, options), (err, output) => {
+                      expect(err).toBeNull();
+                      expect(output.result).toBe(3);
+                      zMan.killWorker((err) => {
+                          zMan.killMyZygote((err)=>{
+                              expect(err).toBeNull();
+                              zInterface = null;
+                              done();
+                          });
+                      });
+                  });
+              });
+          });
+    }, {});
+});
+
+test("Zygote call with profile", async (done) => {
+    ZygoteManager.create((err, zMan)=>{
+          zInterface = zMan;
+          expect(err).toBeNull();
+          zMan.startWorker((err)=>{
+              expect(err).toBeNull();
+              zMan.call("simple", "add", [1,2], Object.assign({}, options, {profile: {top: 5}}), (err, output) => {
+                  expect(err).toBeNull();
+                  expect(output.result).toBe(3);
+                  expect(Object.keys(output.profile.phases).sort()).toEqual(['call', 'chdir', 'import', 'path', 'serialize']);
+                  expect(output.profile.functions.length).toBeLessThan(6);
+                  // the module is imported now, so the function itself shows up
+                  zMan.call("simple", "add", [1,2], Object.assign({}, options, {profile: {top: 1000}}), (err, output) => {
+                      expect(err).toBeNull();
+                      const add = output.profile.functions.find((f) => f.function.endsWith('simple.py:3(add)'));
+                      expect(add.calls).toBe(1);
+                      // true profiles with the defaults
+                      zMan.call("simple", "add", [1,2], Object.assign({}, options, {profile: true}), (err, output) => {
+                          expect(err).toBeNull();
+                          expect(output.profile.functions.length).toBeLessThan(21);
+                          // without the option there is no profile
+                          zMan.call("simple", "add", [1,2], Object.assign({}, options), (err, output) => {
+                              expect(err).toBeNull();
+                              expect(output.profile).toBeNull();
+                              zMan.killWorker((err) => {
+                                  zMan.killMyZygote((err)=>{
+                                      expect(err).toBeNull();
+                                      zInterface = null;
+                                      done();
+                                  });
+                              });
+                          });
+                      });
+                  });
+              });
+          });
+    }, {});
+});
@@ -1,6 +1,7 @@
+const fs = require('fs');
 const util = require('util');
 const path = require('path');
-const { ZygotePool, ZygoteInterface } = require('../zygote-pool');
+const { ZygotePool, ProfilePool, ResultCache, ZygoteInterface, TimeoutError, FunctionMissingError, WorkerDiedError, InvalidOperationError } = require('../zygote-pool');
 
 const { timeout }  = require('./test-util');
 
@@ -108,3 +109,575 @@ test("Call non-existing file test", async () => {
 
     expect(zygotePool.isShutdown()).toBe(true);
 });
+
+test("Standby worker test", async () => {
+    var zygotePool;
+    await new Promise((resolve) => {
+        zygotePool = new ZygotePool(2, (err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        }, {standbyWorker: true});
+    });
+
+    expect(zygotePool.idleZygoteNum()).toBe(2);
+
+    for (let i = 0; i < 3; i++) {
+        let zygoteInterface = zygotePool.request();
+        await new Promise((resolve) => {
+            zygoteInterface.call("simple", "add", [i, 2], options, (err, output) => {
+                expect(err).toBeFalsy();
+                expect(output.result).toBe(i + 2);
+                zygoteInterface.done((err) => {
+                    expect(err).toBeFalsy();
+                    resolve();
+                });
+            });
+        });
+    }
+
+    await new Promise((resolve) => {
+        zygotePool.shutdown((err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+
+    expect(zygotePool.isShutdown()).toBe(true);
+});
+
+test("Autoscale test", async () => {
+    jest.setTimeout(20000);
+    var zygotePool;
+    await new Promise((resolve) => {
+        zygotePool = new ZygotePool(1, (err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        }, {
+            minZygotes: 1,
+            maxZygotes: 3,
+            targetQueueWait: 20,
+            idleZygoteTimeout: 500,
+            autoscaleInterval: 10,
+        });
+    });
+
+    // three slow requests at once need three zygotes
+    let jobs = [];
+    for (let i = 0; i < 3; i++) {
+        jobs.push(new Promise((resolve) => {
+            let zygoteInterface = zygotePool.request();
+            zygoteInterface.call("simple", "sleep", [1], {cwd: options.cwd, timeout: 5000}, (err, output) => {
+                expect(err).toBeFalsy();
+                zygoteInterface.done(resolve);
+            });
+        }));
+    }
+    await timeout(200);
+    expect(zygotePool.totalZygoteNum()).toBe(3);
+    await Promise.all(jobs);
+
+    // idle zygotes are removed down to minZygotes
+    await timeout(1500);
+    expect(zygotePool.totalZygoteNum()).toBe(1);
+
+    await new Promise((resolve) => {
+        zygotePool.shutdown((err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+});
+
+test("Priority and deadline test", async () => {
+    jest.setTimeout(10000);
+    var zygotePool;
+    await new Promise((resolve) => {
+        zygotePool = new ZygotePool(1, (err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+
+    var record = [];
+    var busy = zygotePool.request();
+    var finished = new Promise((resolve) => {
+        busy.call("simple", "sleep", [0.5], options, (err, output) => {
+            expect(err).toBeFalsy();
+            busy.done(resolve);
+        });
+    });
+
+    var low = zygotePool.request();
+    var high = zygotePool.request({priority: 1});
+    var expired = zygotePool.request({priority: 2, deadline: Date.now() + 100});
+    var jobs = [[low, 'low'], [high, 'high'], [expired, 'expired']].map(([zygoteInterface, name]) => {
+        return new Promise((resolve) => {
+            zygoteInterface.call("simple", "add", [1, 2], options, (err, output) => {
+                if (err) {
+                    expect(err).toBeInstanceOf(TimeoutError);
+                    record.push(name + ' timeout');
+                    resolve();
+                } else {
+                    record.push(name);
+                    zygoteInterface.done(resolve);
+                }
+            });
+        });
+    });
+
+    await finished;
+    await Promise.all(jobs);
+    expect(record).toEqual(['expired timeout', 'high', 'low']);
+    expect(zygotePool.waitStats()[2].expired).toBe(1);
+
+    await new Promise((resolve) => {
+        zygotePool.shutdown((err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+});
+
+test("Module affinity test", async () => {
+    jest.setTimeout(10000);
+    var zygotePool;
+    await new Promise((resolve) => {
+        zygotePool = new ZygotePool(2, (err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        }, {warmThreshold: 1});
+    });
+
+    var warmZygoteManager = null;
+    for (let i = 0; i < 3; i++) {
+        let zygoteInterface = zygotePool.request();
+        await new Promise((resolve) => {
+            zygoteInterface.call("strings", "count", ["ababab", "ab"], options, (err, output) => {
+                expect(err).toBeFalsy();
+                expect(output.result).toBe(3);
+                if (warmZygoteManager === null) {
+                    warmZygoteManager = zygoteInterface._zygoteManager;
+                } else {
+                    expect(zygoteInterface._zygoteManager).toBe(warmZygoteManager);
+                }
+                zygoteInterface.done(resolve);
+            });
+        });
+        // wait for the module to be warmed
+        await timeout(200);
+        expect(warmZygoteManager.isWarm("strings", options)).toBe(true);
+    }
+
+    await new Promise((resolve) => {
+        zygotePool.shutdown((err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+});
+
+test("Recycle worker test", async () => {
+    var zygotePool;
+    await new Promise((resolve) => {
+        zygotePool = new ZygotePool(1, (err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        }, {workerMaxUses: 2});
+    });
+
+    const call = (moduleName, functionName) => new Promise((resolve) => {
+        let zygoteInterface = zygotePool.request();
+        zygoteInterface.call(moduleName, functionName, [], options, (err, output) => {
+            expect(err).toBeFalsy();
+            zygoteInterface.done((err) => {
+                expect(err).toBeFalsy();
+                resolve(output.result);
+            });
+        });
+    });
+
+    const pids = [];
+    for (let i = 0; i < 3; i++) {
+        pids.push(await call("state", "pid"));
+    }
+    // the worker serves two requests, then a new one is forked
+    expect(pids[1]).toBe(pids[0]);
+    expect(pids[2]).not.toBe(pids[1]);
+
+    // question modules are imported again in a reused worker
+    expect(await call("state", "count")).toBe(1);
+    expect(await call("state", "count")).toBe(1);
+
+    await new Promise((resolve) => {
+        zygotePool.shutdown((err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+});
+
+test("Recycle worker with warm modules test", async () => {
+    var zygotePool = await ZygotePool.create(1, {workerMaxUses: 2, warmThreshold: 1, healthCheckInterval: 0});
+    const call = async () => {
+        let zygoteInterface = zygotePool.request();
+        let output = await zygoteInterface.call("state", "count", [], Object.assign({}, options));
+        await zygoteInterface.done();
+        return output.result;
+    };
+
+    // the zygote imports state after the first call, later workers use its module
+    expect(await call()).toBe(1);
+    expect(await call()).toBe(1);
+    expect(zygotePool._zygoteManagerList[0].isWarm("state", options)).toBe(true);
+    expect(await call()).toBe(1);
+    // the state left in the warm module by a request does not reach the next one
+    expect(await call()).toBe(1);
+
+    await zygotePool.shutdown();
+});
+
+test("Partial result test", async () => {
+    var zygotePool = await ZygotePool.create(1, {binaryResults: true, healthCheckInterval: 0});
+    var pid = zygotePool._zygoteManagerList[0].child.pid;
+
+    var zygoteInterface = zygotePool.request();
+    await expect(zygoteInterface.call("state", "partialResult", [], Object.assign({}, options, {timeout: 500})))
+        .rejects.toBeInstanceOf(TimeoutError);
+    await zygoteInterface.done();
+
+    // the same zygote serves the next request
+    zygoteInterface = zygotePool.request();
+    var output = await zygoteInterface.call("simple", "add", [1, 2], Object.assign({}, options, {timeout: 2000}));
+    expect(output.result).toBe(3);
+    await zygoteInterface.done();
+    expect(zygotePool._zygoteManagerList[0].child.pid).toBe(pid);
+
+    await zygotePool.shutdown();
+});
+
+test("Metrics test", async () => {
+    var zygotePool;
+    await new Promise((resolve) => {
+        zygotePool = new ZygotePool(1, (err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+
+    for (let i = 0; i < 2; i++) {
+        let zygoteInterface = zygotePool.request();
+        await new Promise((resolve) => {
+            zygoteInterface.call("simple", "add", [i, 2], options, (err, output) => {
+                expect(err).toBeFalsy();
+                zygoteInterface.done((err) => {
+                    expect(err).toBeFalsy();
+                    resolve();
+                });
+            });
+        });
+    }
+
+    const metrics = zygotePool.metrics;
+    expect(metrics.get('zyspawn_zygote_spawns_total').get({reason: 'initial'})).toBe(1);
+    expect(metrics.get('zyspawn_queue_wait_seconds').get().count).toBe(2);
+    expect(metrics.get('zyspawn_worker_start_seconds').get().count).toBe(2);
+    expect(metrics.get('zyspawn_worker_kill_seconds').get().count).toBe(2);
+    expect(metrics.get('zyspawn_call_exec_seconds').get().count).toBe(2);
+    expect(metrics.get('zyspawn_result_bytes').get().sum).toBeGreaterThan(0);
+    expect(zygotePool.prometheusMetrics()).toMatch(/^zyspawn_call_seconds_count 2$/m);
+
+    await new Promise((resolve) => {
+        zygotePool.shutdown((err) => {
+            expect(err).toBeFalsy();
+            resolve();
+        });
+    });
+});
+
+test("Promise API test", async () => {
+    var zygotePool = await ZygotePool.create(2);
+    expect(zygotePool.idleZygoteNum()).toBe(2);
+
+    var zygoteInterface = zygotePool.request();
+    var output = await zygoteInterface.call("simple", "add", [1, 2], options);
+    expect(output.result).toBe(3);
+    await zygoteInterface.done();
+
+    var tasks = [];
+    for (let i = 0; i < 10; i++) {
+        tasks.push({module: "simple", fn: "add", args: [i, 1], options: options});
+    }
+    var outputs = await zygotePool.map(tasks, {concurrency: 3});
+    expect(outputs.map((output) => output.result)).toEqual([1, 2, 3, 4, 5, 6, 7, 8, 9, 10]);
+
+    tasks[4] = {module: "simple", fn: "nonexist", args: [], options: options};
+    await expect(zygotePool.map(tasks)).rejects.toBeInstanceOf(FunctionMissingError);
+
+    // all results, in order of completion
+    var iterator = zygotePool.iterate(tasks, {ordered: false});
+    var results = [];
+    for (let item = await iterator.next(); !item.done; item = await iterator.next()) {
+        results.push(item.value);
+    }
+    expect(results.length).toBe(10);
+    results.sort((a, b) => a.index - b.index);
+    expect(results[4].err).toBeInstanceOf(FunctionMissingError);
+    expect(results[5].output.result).toBe(6);
+
+    await zygotePool.shutdown();
+    expect(zygotePool.isShutdown()).toBe(true);
+});
+
+test("Replace dead zygotes test", async () => {
+    jest.setTimeout(20000);
+    var zygotePool = await ZygotePool.create(2, {
+        healthCheckInterval: 100,
+        healthCheckTimeout: 300,
+    });
+    const waitForReplacement = async (zygoteManager) => {
+        while (zygotePool._zygoteManagerList.includes(zygoteManager)
+                || zygotePool.idleZygoteNum() < 2) {
+            await timeout(50);
+        }
+    };
+
+    // an idle zygote exits
+    var dead = zygotePool._zygoteManagerList[0];
+    process.kill(dead.child.pid, 'SIGKILL');
+    await waitForReplacement(dead);
+    expect(zygotePool.totalZygoteNum()).toBe(2);
+
+    // an idle zygote stops answering
+    var stopped = zygotePool._zygoteManagerList[0];
+    process.kill(stopped.child.pid, 'SIGSTOP');
+    await waitForReplacement(stopped);
+    expect(zygotePool.totalZygoteNum()).toBe(2);
+
+    // a zygote exits during a call
+    var zygoteInterface = zygotePool.request();
+    var call = zygoteInterface.call("simple", "sleep", [5], {cwd: options.cwd, timeout: 1000});
+    await timeout(300);
+    var busy = zygoteInterface._zygoteManager;
+    process.kill(busy.child.pid, 'SIGKILL');
+    await expect(call).rejects.toBeInstanceOf(TimeoutError);
+    await zygoteInterface.done();
+    await waitForReplacement(busy);
+    expect(zygotePool.totalZygoteNum()).toBe(2);
+
+    var outputs = await zygotePool.map([0, 1, 2, 3].map((i) => ({module: "simple", fn: "add", args: [i, 1], options: options})));
+    expect(outputs.map((output) => output.result)).toEqual([1, 2, 3, 4]);
+
+    await zygotePool.shutdown();
+});
+
+test("Profile pool test", async () => {
+    var profilePool = await ProfilePool.create({
+        light: {size: 1, options: {}},
+        heavy: {size: 2, options: {preload: ['json']}},
+    }, {healthCheckInterval: 0});
+    expect(profilePool.profiles()).toEqual(['light', 'heavy']);
+    expect(profilePool.totalZygoteNum()).toBe(3);
+    expect(profilePool.pool('heavy').totalZygoteNum()).toBe(2);
+    // the default profile is the first one
+    expect(profilePool.pool()).toBe(profilePool.pool('light'));
+    expect(() => profilePool.request({profile: 'nonexist'})).toThrow();
+
+    var zygoteInterface = profilePool.request({profile: 'heavy'});
+    var output = await zygoteInterface.call("simple", "add", [1, 2], options);
+    expect(output.result).toBe(3);
+    expect(profilePool.pool('heavy').busyZygoteNum()).toBe(1);
+    expect(profilePool.pool('light').busyZygoteNum()).toBe(0);
+    await zygoteInterface.done();
+
+    var tasks = [0, 1, 2].map((i) => ({module: "simple", fn: "add", args: [i, 1], options: options}));
+    var outputs = await profilePool.map(tasks, {request: {profile: 'light'}});
+    expect(outputs.map((output) => output.result)).toEqual([1, 2, 3]);
+
+    var stats = await profilePool.memoryStats();
+    expect(stats.heavy.length).toBe(2);
+
+    await profilePool.shutdown();
+    expect(profilePool.isShutdown()).toBe(true);
+});
+
+test("Worker slots test", async () => {
+    var zygotePool = await ZygotePool.create(4, {workerSlots: 2, healthCheckInterval: 0});
+    expect(zygotePool.totalZygoteNum()).toBe(4);
+    // 4 slots in 2 zygote processes
+    var pids = new Set(zygotePool._zygoteManagerList.map((zygoteManager) => zygoteManager.child.pid));
+    expect(pids.size).toBe(2);
+
+    var tasks = [];
+    for (let i = 0; i < 8; i++) {
+        tasks.push({module: "state", fn: "pid", args: [], options: options});
+    }
+    var outputs = await zygotePool.map(tasks, {concurrency: 4});
+    expect(outputs.length).toBe(8);
+
+    // a dead zygote process takes its slots with it, they are replaced
+    var dead = zygotePool._zygoteManagerList[0];
+    process.kill(dead.child.pid, 'SIGKILL');
+    await new Promise((resolve) => dead.on('exit', resolve));
+    for (let i = 0; i < 100 && zygotePool.idleZygoteNum() < 4; i++) {
+        await timeout(20);
+    }
+    expect(zygotePool.idleZygoteNum()).toBe(4);
+    pids = new Set(zygotePool._zygoteManagerList.map((zygoteManager) => zygoteManager.child.pid));
+    expect(pids.size).toBe(2);
+    expect(pids.has(dead.child.pid)).toBe(false);
+
+    await zygotePool.shutdown();
+});
+
+test("Result cache test", async () => {
+    var resultCache = new ResultCache();
+    var zygotePool = await ZygotePool.create(1, {resultCache: resultCache, healthCheckInterval: 0});
+    expect(zygotePool.resultCache).toBe(resultCache);
+
+    var zygoteInterface = zygotePool.request();
+    var cached = Object.assign({}, options, {cache: true});
+    var first = await zygoteInterface.call("state", "pid", [], cached);
+    await zygoteInterface.done();
+    expect(resultCache.stats()).toEqual(expect.objectContaining({hits: 0, misses: 1, entries: 1}));
+
+    // served from the cache, without a worker
+    zygoteInterface = zygotePool.request();
+    var second = await zygoteInterface.call("state", "pid", [], cached);
+    expect(second.result).toBe(first.result);
+    expect(zygotePool.busyZygoteNum()).toBe(0);
+    // calls without cache: true are not cached
+    await zygoteInterface.call("state", "pid", [], Object.assign({}, options));
+    await zygoteInterface.done();
+    expect(resultCache.stats()).toEqual(expect.objectContaining({hits: 1, misses: 1, entries: 1}));
+    expect(zygotePool.metrics.get('zyspawn_result_cache_requests_total').get({result: 'hit'})).toBe(1);
+
+    // a hit replays the output to onOutput, without empty chunks
+    var chunks = [];
+    var onOutput = Object.assign({}, cached, {onOutput: (stream, data) => chunks.push([stream, data])});
+    zygoteInterface = zygotePool.request();
+    await zygoteInterface.call("prints", "spam", [2, "hi"], onOutput);
+    await zygoteInterface.done();
+    chunks = [];
+    await zygotePool.request().call("prints", "spam", [2, "hi"], onOutput);
+    expect(chunks).toEqual([["stdout", "hi\nhi\n"], ["stderr", "done\n"]]);
+    chunks = [];
+    await zygotePool.request().call("state", "pid", [], onOutput);
+    expect(chunks).toEqual([]);
+
+    await zygotePool.shutdown();
+});
+
+test("Fork zygotes test", async () => {
+    var zygotePool = await ZygotePool.create(3, {forkZygotes: true, readyOnFirst: true, healthCheckInterval: 0});
+    // the others may still be starting
+    expect(zygotePool.totalZygoteNum()).toBe(3);
+    var zygoteInterfaces = [0, 1, 2].map(() => zygotePool.request());
+    var outputs = await Promise.all(zygoteInterfaces.map((zygoteInterface) => {
+        return zygoteInterface.call("simple", "add", [1, 2], options);
+    }));
+    expect(outputs.map((output) => output.result)).toEqual([3, 3, 3]);
+    expect(zygotePool.idleZygoteNum()).toBe(0);
+    await Promise.all(zygoteInterfaces.map((zygoteInterface) => zygoteInterface.done()));
+
+    // one zygote process was started, the others forked from it
+    var pids = zygotePool._zygoteManagerList.map((zygoteManager) => zygoteManager.child.pid);
+    var parents = pids.map((pid) => {
+        return Number(fs.readFileSync('/proc/' + pid + '/stat', 'utf8').split(') ')[1].split(' ')[1]);
+    });
+    expect(parents.filter((ppid) => pids.includes(ppid)).length).toBe(2);
+
+    await zygotePool.shutdown();
+});
+
+test("Worker death test", async () => {
+    var zygotePool = await ZygotePool.create(1, {standbyWorker: true, healthCheckInterval: 0});
+    var pid = zygotePool._zygoteManagerList[0].child.pid;
+
+    var zygoteInterface = zygotePool.request();
+    await expect(zygoteInterface.call("state", "crash", [], Object.assign({}, options, {timeout: 5000})))
+        .rejects.toBeInstanceOf(WorkerDiedError);
+    await zygoteInterface.done();
+    expect(zygotePool.metrics.get('zyspawn_worker_deaths_total').get({signal: 'SIGKILL'})).toBe(1);
+
+    // the zygote is kept and serves the next request
+    zygoteInterface = zygotePool.request();
+    var output = await zygoteInterface.call("simple", "add", [1, 2], options);
+    expect(output.result).toBe(3);
+    await zygoteInterface.done();
+    expect(zygotePool._zygoteManagerList[0].child.pid).toBe(pid);
+
+    await zygotePool.shutdown();
+});
+
+test("Profile sampling test", async () => {
+    var profiles = [];
+    var zygotePool = await ZygotePool.create(1, {
+        profileSampleRate: 1,
+        onProfile: (profile, call) => profiles.push(call),
+        healthCheckInterval: 0,
+    });
+    var zygoteInterface = zygotePool.request();
+    var output = await zygoteInterface.call("simple", "add", [1, 2], Object.assign({}, options));
+    expect(output.profile.phases.call).toBeGreaterThanOrEqual(0);
+    // the option of a call wins over the sample rate
+    output = await zygoteInterface.call("simple", "add", [1, 2], Object.assign({}, options, {profile: false}));
+    expect(output.profile).toBeNull();
+    await zygoteInterface.done();
+    expect(profiles).toEqual([{module: "simple", fn: "add"}]);
+
+    await zygotePool.shutdown();
+});
+
+test("Shutdown while adding a zygote test", async () => {
+    var zygotePool = await ZygotePool.create(1, {healthCheckInterval: 0});
+    var added = false;
+    zygotePool.addZygote(1, (err) => {
+        expect(err).toBeFalsy();
+        added = true;
+    });
+    // the new zygote is still starting, shutdown() waits for it and
+    // shuts it down as well
+    await zygotePool.shutdown();
+    expect(added).toBe(true);
+    expect(zygotePool.totalZygoteNum()).toBe(0);
+    expect(zygotePool._zygoteManagerList.length).toBe(0);
+    expect(zygotePool._idleZygoteManagerQueue.size()).toBe(0);
+
+    var errs = await zygotePool.addZygote(1).then(() => null, (errs) => errs);
+    expect(errs[0]).toBeInstanceOf(InvalidOperationError);
+    expect(zygotePool.totalZygoteNum()).toBe(0);
+});
+
+test("Worker start failure test", async () => {
+    var zygotePool = await ZygotePool.create(1, {healthCheckInterval: 0});
+    var zygoteManager = zygotePool._zygoteManagerList[0];
+    // the first worker dies while starting
+    zygoteManager.startWorker = (callback) => {
+        delete zygoteManager.startWorker;
+        callback(new WorkerDiedError(null, 'SIGKILL'));
+    };
+
+    var zygoteInterface = zygotePool.request();
+    var output = await zygoteInterface.call("simple", "add", [1, 2], Object.assign({}, options));
+    expect(output.result).toBe(3);
+    await zygoteInterface.done();
+    // the zygote started another worker instead of being replaced
+    expect(zygotePool._zygoteManagerList.length).toBe(1);
+    expect(zygotePool._zygoteManagerList[0]).toBe(zygoteManager);
+
+    await zygotePool.shutdown();
+});
+
+test("Options are not modified test", async () => {
+    var poolOptions = {maxZygotes: 2, healthCheckInterval: 0};
+    var zygotePool = await ZygotePool.create(1, poolOptions);
+    var iterateOptions = {ordered: false};
+    var tasks = [{module: "simple", fn: "add", args: [1, 2], options: Object.assign({}, options)}];
+    var iterator = zygotePool.iterate(tasks, iterateOptions);
+    expect((await iterator.next()).value.output.result).toBe(3);
+    expect((await iterator.next()).done).toBe(true);
+    await zygotePool.shutdown();
+
+    expect(poolOptions).toEqual({maxZygotes: 2, healthCheckInterval: 0});
+    expect(iterateOptions).toEqual({ordered: false});
+});
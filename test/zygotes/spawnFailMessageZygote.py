@@ -31,10 +31,10 @@ try:
 
             # outFile.write(json_inp + '\n')
             # outFile.flush()
-            # unpack the input line as JSON
-            inputVal = json.loads(json_inp)
-            output = parseInput(inputVal)
-            json_output = json.dumps(output)
+            # unpack the input line as JSON (an envelope with id and msg)
+            envelope = json.loads(json_inp)
+            output = parseInput(envelope["msg"])
+            json_output = json.dumps({"id": envelope["id"], "msg": output})
 
             outZygote.write(json_output + '\n')
             outZygote.flush()
@@ -39,11 +39,11 @@ try:
 
             # outFile.write(json_inp + '\n')
             # outFile.flush()
-            # unpack the input line as JSON
-            inputVal = json.loads(json_inp)
-            output = parseInput(inputVal)
+            # unpack the input line as JSON (an envelope with id and msg)
+            envelope = json.loads(json_inp)
+            output = parseInput(envelope["msg"])
             if (output is not None):
-                json_output = json.dumps(output)
+                json_output = json.dumps({"id": envelope["id"], "msg": output})
                 # outFile.write(">" + json_output + '\n')
                 # outFile.flush()
                 outZygote.write(json_output + '\n')
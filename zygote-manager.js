@@ -10,11 +10,17 @@
 * Implementation here is just for testing.
 */
 const _ = require('lodash');
+const fs = require('fs');
+const os = require('os');
+const net = require('net');
 const util = require('util');
 const path = require('path');
+const crypto = require('crypto');
 const child_process = require('child_process');
-const {LineTransform,Port} = require('./pipe-util');
-const {ZyspawnError, InternalZyspawnError, FileMissingError, FunctionMissingError, InvalidOperationError, TimeoutError} = require('./error');
+const EventEmitter = require('events');
+const {StringDecoder} = require('string_decoder');
+const {LineTransform, Port, OutputCapture, PortTimeoutError, MessageTooLargeError, getSerializer} = require('./pipe-util');
+const {ZyspawnError, InternalZyspawnError, FileMissingError, FunctionMissingError, InvalidOperationError, TimeoutError, ResourceLimitError, WorkerDiedError} = require('./error');
 
 /*CREATING, INIT, PREPPING, READY, IN_CALL, EXITING, EXITED, DEPARTING, DEPARTED, ERROR*/
 // States for creating zygote
@@ -44,23 +50,35 @@ class BadStateError extends InternalZyspawnError {
 * An object which manages a python zygote. All communications between
 * javascript and python is wrapped inside this object.
 */
-class ZygoteManager {
+class ZygoteManager extends EventEmitter {
 	/**
 	 * Create a ZygoteManager and initialize it.
 	 * @param {function(Error, ZygoteManager)} callback Called after the underlying
 	 *                                                  zygote is initialized
+	 * @param {Object} options Include optional type (python executable), zygote,
+	 *      preload (module names or absolute paths imported by the zygote before
+	 *      forking any worker), preloadCompile (also compile every python file
+	 *      of the preloaded paths into the code cache, which codeCacheSize has
+	 *      to enable), codeCacheSize (bytes
+	 *      of python source of question and course directories whose compiled
+	 *      code the zygote keeps and its workers inherit, defaults to 0 which
+	 *      disables the code cache),
+	 *      binaryResults (file() results are sent as raw bytes and returned
+	 *      as a Buffer instead of a base64 string), warmThreshold (number of
+	 *      calls of a module after which the zygote imports it, 0 disables),
+	 *      warmModuleLimit (maximum number of such modules per zygote),
+	 *      gcFreeze (collect and gc.freeze() the zygote heap before forking, so
+	 *      that workers share more pages with it), workerGc (garbage collection
+	 *      in workers: 'enable', 'disable' or an array of gc thresholds),
+	 *      shmThreshold (calls and results larger than this many bytes are
+	 *      passed through a file in shmDir, a tmpfs, instead of the pipes; 0
+	 *      disables), serializer of such files ('json', or 'msgpack' which
+	 *      needs msgpack-lite and the python msgpack package), workerSlots
+	 *      (number of workers the zygote can run at once, see attachSlot())
+	 *      and the timeouts listed in the constructor.
 	 */
 	static create(callback, options={}) {
-		_.defaults(options, {
-			type: 'python3',
-			zygote: 'zygote.py',
-			debugMode: false,
-		});
-		// Options for constructor
-		const cmd = options['type'];
-		// TODO python-caller-trampoline is an awful name, rename it to zygote.py
-		const zygoteFile = path.join(__dirname, options['zygote']);
-		const args = ['-B', zygoteFile];
+		const [cmd, args] = ZygoteManager._zygoteCommand(options);
 		const env = _.clone(process.env);
 		// PYTHONIOENCODING might not be needed once we switch to Python 3.7
 		// https://www.python.org/dev/peps/pep-0538/
@@ -68,20 +86,143 @@ class ZygoteManager {
 		env.PYTHONIOENCODING = 'utf-8';
 		const call_options = {
 			cwd: __dirname,
-			stdio: ['pipe', 'pipe', 'pipe', 'pipe', 'pipe', 'pipe', 'pipe'],
+			// 0-6 as described in the constructor, then four pipes for
+			// every worker slot after the first one
+			stdio: _.fill(Array(7 + 4 * (options['workerSlots'] - 1)), 'pipe'),
 			env,
 		};
 		_.defaults(options, {
 			call_options: call_options,
 		});
-		var manager = new ZygoteManager(cmd, args, options, callback);
+		const child = child_process.spawn(cmd, args, options['call_options']);
+		var manager = new ZygoteManager(child, options, callback);
+		manager._zygote.command = [cmd].concat(args);
 		return manager;
 	}
 
-	constructor(command, args, options, callback) {
+	/**
+	 * Create a ZygoteManager of a new zygote process forked from the zygote
+	 * process of another ZygoteManager, instead of starting python and
+	 * preloading modules again. The new zygote inherits the imported modules
+	 * and the code cache of the other one, but not its workers, and talks to
+	 * this process through FIFOs instead of pipes.
+	 * @param {ZygoteManager} parent See canFork()
+	 * @param {function(Error, ZygoteManager)} callback As for create(), with
+	 *      a null ZygoteManager if no zygote process was forked
+	 * @param {Object} options As for create()
+	 */
+	static fork(parent, callback, options={}) {
+		if (!parent.canFork(options)) {
+			callback(new InvalidOperationError('Cannot fork a zygote with these options'), null);
+			return;
+		}
+		ZygoteManager._zygoteCommand(options);
+		const timeout = parent.options['zygoteSpawnTimeout'];
+		parent.controlPort.send({action: 'fork zygote'}, timeout, (err, message) => {
+			if (err != null) {
+				callback(new TimeoutError('Forking Zygote'), null);
+				return;
+			}
+			if (!message['success']) {
+				callback(new InternalZyspawnError('Forking Zygote failed with message: ' + message['message']), null);
+				return;
+			}
+			openFifos(message['dir'], options['workerSlots'], timeout, (err, stdio) => {
+				if (err) {
+					new ForkedZygoteProcess(message['pid'], null).kill('SIGKILL');
+					fs.readdir(message['dir'], (readErr, names) => {
+						(names || []).forEach((name) => fs.unlink(path.join(message['dir'], name), () => {}));
+						fs.rmdir(message['dir'], () => {});
+					});
+					callback(err, null);
+					return;
+				}
+				const manager = new ZygoteManager(new ForkedZygoteProcess(message['pid'], stdio), options, callback);
+				manager._zygote.command = parent._zygote.command;
+				manager.warmModules = new Set(parent.warmModules);
+			});
+		});
+	}
+
+	/**
+	 * Check if fork() can fork a zygote with the options from the zygote
+	 * process of this ZygoteManager, i.e. if the process is running and was
+	 * started with the same options.
+	 * @param {Object} options As for create()
+	 * @return {boolean}
+	 */
+	canFork(options) {
+		const zygote = this._zygote;
+		if (zygote.exited || zygote.failedHealthCheck || zygote.controlPort.isBroken()) {
+			return false;
+		}
+		const [cmd, args] = ZygoteManager._zygoteCommand(_.clone(options));
+		return _.isEqual([cmd].concat(args), zygote.command);
+	}
+
+	/**
+	 * Apply the defaults of create() to options.
+	 * @return {Array} [command, args] to start a zygote with
+	 */
+	static _zygoteCommand(options) {
+		_.defaults(options, {
+			type: 'python3',
+			zygote: 'zygote.py',
+			debugMode: false,
+			preload: [],
+			preloadCompile: false,
+			codeCacheSize: 0,
+			binaryResults: false,
+			warmModuleLimit: 16,
+			gcFreeze: true,
+			workerGc: 'enable',
+			shmThreshold: 0,
+			shmDir: '/dev/shm',
+			serializer: 'json',
+			workerSlots: 1,
+		});
+		// fail early if the serializer is not available
+		getSerializer(options['serializer']);
+		if (options['preloadCompile'] && options['codeCacheSize'] <= 0) {
+			// the compiled code would be evicted right away
+			throw new InvalidOperationError('preloadCompile needs the code cache, see codeCacheSize');
+		}
+		const cmd = options['type'];
+		// TODO python-caller-trampoline is an awful name, rename it to zygote.py
+		const zygoteFile = path.join(__dirname, options['zygote']);
+		// Configuration read by zygote.py from argv[1]
+		const zygoteConfig = {
+			preload: options['preload'],
+			preloadCompile: options['preloadCompile'],
+			codeCacheSize: options['codeCacheSize'],
+			binaryResults: options['binaryResults'],
+			warmModuleLimit: options['warmModuleLimit'],
+			gcFreeze: options['gcFreeze'],
+			workerGc: options['workerGc'],
+			shmThreshold: options['shmThreshold'],
+			shmDir: options['shmDir'],
+			serializer: options['serializer'],
+			workerSlots: options['workerSlots'],
+		};
+		return [cmd, ['-B', zygoteFile, JSON.stringify(zygoteConfig)]];
+	}
+
+	/**
+	 * Emits 'exit' (code, signal, unexpected) when the zygote process exits,
+	 * where unexpected is true unless the exit was asked for by shutdown(),
+	 * killMyZygote() or forceKillMyZygote().
+	 *
+	 * A ZygoteManager uses one worker slot of its zygote process, the child
+	 * (a ChildProcess, or see fork()). Given slotOf ({zygote, slot}, see
+	 * attachSlot()) it uses another slot of an existing zygote process
+	 * instead.
+	 */
+	constructor(child, options, callback, slotOf=null) {
+		super();
 		// setup pipes:
 		//  STDIN(worker), STDOUT(worker), STDERR(worker), data(worker),
-		//  command(zygote), message(zygote), status(exit/error worker)
+		//  command(zygote), message(zygote), status(exit/error worker),
+		//  then STDIN, STDOUT, STDERR and data of the workers of further slots
 		this.options = _.defaults(options, {
 			debugMode: false,
 			stdio6CallBack: ()=>{},
@@ -89,41 +230,123 @@ class ZygoteManager {
 			startWorkerTimeout: 4000,
 			killZygoteTimeout: 3000,
 			killWorkerTimeout: 1000,
+			statusTimeout: 1000,
+			healthCheckTimeout: 10000, // longer than warmTimeout, the zygote may be warming
+			resetWorkerTimeout: 1000,
+			warmTimeout: 10000,
+			warmThreshold: 0,
+			maxMessageSize: 0, // bytes of a response, 0 means no limit
+			limits: {}, // default resource limits of a call, see call()
+			maxOutputSize: 0, // bytes of stdout and stderr kept per call, 0 means no limit
+			metrics: null, // a Metrics (see metrics.js) to record latencies and errors in
 		});
 		this.debugMode = this.options['debugMode'];
+		this.metrics = this.options['metrics'];
 		this.messageBuffer = '';
-		this.child = child_process.spawn(command, args, this.options['call_options']);
+		this._moduleCallCounts = new Map();
+		this.workerUses = 0; // requests served by the current worker, see resetWorker()
+		this.workerStartTime = null;
+		this._workerPid = null; // pid of the current worker
+		this._workerExit = null; // {code, signal} once the current worker has died
+		// pid => {code, signal} of workers which exited while startWorker()
+		// waited for their pid
+		this._earlyExits = new Map();
+		this._output = new OutputCapture(); // stdout and stderr of the current call
+		this._onOutput = null;
+		this._decoders = null; // stream => StringDecoder for onOutput
 
-		this.stdin = this.child.stdin;
-		this.stdout = this.child.stdout;
-		this.stderr = this.child.stderr;
-		this.stdio3 = this.child.stdio[3];
+		if (slotOf !== null) {
+			this.state = INIT;
+			this.zygoteSpawned = true;
+			this._useSlot(slotOf.zygote, slotOf.slot);
+			return;
+		}
+
+		const portOptions = {maxMessageSize: this.options['maxMessageSize']};
+		// state of the zygote process, shared by the ZygoteManagers of its slots
+		this._zygote = {
+			child: child,
+			command: null, // [command, ...args] the zygote process was started with
+			controlPort: new Port(child.stdio[4], child.stdio[5], portOptions),
+			slots: [], // {stdin, stdout, stderr, stdio3, callPort, manager, retired, dirty}
+			exited: false,
+			failedHealthCheck: false,
+			preloadInfo: [],
+			warmModules: new Set(), // keys (see moduleKey()) of warm modules
+		};
 		// receive messages from Zygote
-		this.child.stdio[5].setEncoding('utf8');
-		this.child.stdio[6].setEncoding('utf8');
+		child.stdio[5].setEncoding('utf8');
+		child.stdio[6].setEncoding('utf8');
 		// Add exit listener for child
-		this.child.on('exit', this._zygoteExitListener.bind(this));
-		this.child.stdio[6].on('data', this.options['stdio6CallBack']);
-
-		this.state = CREATING;
-		this.child.stderr.on('data', this._handleStderrData.bind(this));
-		this.child.stdout.on('data', this._handleStdoutData.bind(this));
-		// Add Remove listeners
-		this.child.stderr.on('close', ()=>{
-			this.child.stderr.removeAllListeners();
-		});
-		this.child.stdout.on('close', ()=>{
-			this.child.stdout.removeAllListeners();
+		child.on('exit', (code, signal) => {
+			this._zygote.exited = true;
+			this._zygote.slots.forEach((slot) => {
+				if (slot.manager !== null) {
+					slot.manager._zygoteExitListener(code, signal);
+				}
+			});
 		});
-		this.stdio3.on('close', ()=>{
-			this.stdio3.removeAllListeners();
+		child.stdio[6].on('data', this.options['stdio6CallBack']);
+		// exit info of workers (see reapWorkers in zygote.py), handled by
+		// the ZygoteManager of their slot
+		const zygote = this._zygote;
+		child.stdio[6].pipe(new LineTransform()).on('data', (line) => {
+			let info;
+			try {
+				info = JSON.parse(line);
+			} catch (err) {
+				return;
+			}
+			const slot = zygote.slots[info['slot']];
+			if (info['type'] === 'exit' && slot !== undefined && slot.manager !== null) {
+				slot.manager._workerExitListener(info['pid'], info['code'], info['signal']);
+			}
 		});
-		this.child.stdio[5].on('close', ()=>{
-			this.child.stdio[5].removeAllListeners();
+		child.stdio[5].on('close', ()=>{
+			child.stdio[5].removeAllListeners();
 		});
 
-		this.controlPort = new Port(this.child.stdio[4], this.child.stdio[5]);
-		this.callPort = new Port(this.child.stdin, this.child.stdio[3]);
+		for (let i = 0; i < this.options['workerSlots']; i++) {
+			const fds = i == 0 ? [0, 1, 2, 3] : [7, 8, 9, 10].map((fd) => fd + 4 * (i - 1));
+			const slot = {
+				stdin: child.stdio[fds[0]],
+				stdout: child.stdio[fds[1]],
+				stderr: child.stdio[fds[2]],
+				stdio3: child.stdio[fds[3]],
+				callPort: new Port(child.stdio[fds[0]], child.stdio[fds[3]], _.defaults({
+					framing: this.options['binaryResults'] ? 'binary' : 'line',
+					shmThreshold: this.options['shmThreshold'],
+					shmDir: this.options['shmDir'],
+					serializer: this.options['serializer'],
+				}, portOptions)),
+				manager: null,
+				retired: false, // not to be used again, see _detachSlot()
+				dirty: false, // callPort may hold part of a response, see killWorker()
+			};
+			// the zygote writes to the stderr of slot 0 too
+			slot.stderr.on('data', (data) => {
+				if (slot.manager !== null) {
+					slot.manager._handleStderrData(data);
+				} else if (this.debugMode) {
+					console.log("ZygoteManager: Stderr: " + data);
+				}
+			});
+			slot.stdout.on('data', (data) => {
+				if (slot.manager !== null) {
+					slot.manager._handleStdoutData(data);
+				}
+			});
+			// Add Remove listeners
+			[slot.stdout, slot.stderr, slot.stdio3].forEach((stream) => {
+				stream.on('close', ()=>{
+					stream.removeAllListeners();
+				});
+			});
+			this._zygote.slots.push(slot);
+		}
+
+		this.state = CREATING;
+		this._useSlot(this._zygote, 0);
 
 		this.controlPort.send({action: 'status'}, this.options['zygoteSpawnTimeout'], (err, message) => {
 			if (err != null) {
@@ -133,6 +356,8 @@ class ZygoteManager {
 				if (message['success']) {
 					this.state = INIT;
 					this.zygoteSpawned = true;
+					// [{name, success, time (ms), error}] for each preloaded module
+					this._zygote.preloadInfo = message['preload'] || [];
 					callback(null, this);
 				} else {
 					this.state = ERROR;
@@ -144,12 +369,134 @@ class ZygoteManager {
 		});
 	}
 
+	/**
+	 * Use a worker slot of a zygote process.
+	 * @param {Object} zygote The shared state of the zygote process
+	 * @param {number} slot Index of the slot
+	 */
+	_useSlot(zygote, slot) {
+		this._zygote = zygote;
+		this.slot = slot;
+		this._slot = zygote.slots[slot];
+		this._slot.manager = this;
+		this.stdin = this._slot.stdin;
+		this.stdout = this._slot.stdout;
+		this.stderr = this._slot.stderr;
+		this.stdio3 = this._slot.stdio3;
+	}
+
+	get child() {
+		return this._zygote.child;
+	}
+
+	get controlPort() {
+		return this._zygote.controlPort;
+	}
+
+	get callPort() {
+		return this._slot.callPort;
+	}
+
+	/**
+	 * [{name, success, time (ms), error}] for each preloaded module
+	 */
+	get preloadInfo() {
+		return this._zygote.preloadInfo;
+	}
+
+	get warmModules() {
+		return this._zygote.warmModules;
+	}
+
+	set warmModules(warmModules) {
+		this._zygote.warmModules = warmModules;
+	}
+
+	/**
+	 * Count the worker slots of the zygote process which are not in use and
+	 * can be attached to (see attachSlot()).
+	 * @return {number} 0 if the zygote process has exited or is unhealthy
+	 */
+	freeSlotNum() {
+		const zygote = this._zygote;
+		if (zygote.exited || zygote.failedHealthCheck || zygote.controlPort.isBroken()) {
+			return 0;
+		}
+		return zygote.slots.filter((slot) => {
+			return slot.manager === null && !slot.retired && !slot.callPort.isBroken();
+		}).length;
+	}
+
+	/**
+	 * Get a ZygoteManager for a free worker slot of the same zygote process
+	 * (see the workerSlots option of create()). It starts in the state of a
+	 * newly created ZygoteManager and runs its own worker, with its own pipes,
+	 * alongside the workers of the other slots. Killing it (killMyZygote(),
+	 * forceKillMyZygote() or shutdown()) only frees its slot while other
+	 * slots are in use; the zygote process exits with its last slot.
+	 * @return {ZygoteManager} null if no slot is free
+	 */
+	attachSlot() {
+		if (this.freeSlotNum() == 0) {
+			return null;
+		}
+		const index = this._zygote.slots.findIndex((slot) => {
+			return slot.manager === null && !slot.retired && !slot.callPort.isBroken();
+		});
+		return new ZygoteManager(null, _.clone(this.options), null, {zygote: this._zygote, slot: index});
+	}
+
+	/**
+	 * @return {boolean} True if other slots of the zygote process are in use
+	 */
+	_otherSlotsInUse() {
+		return this._zygote.slots.some((slot) => slot.manager !== null && slot.manager !== this);
+	}
+
+	/**
+	 * Free the worker slot of this ZygoteManager, killing its worker, while
+	 * the zygote process keeps running for the other slots. A slot whose
+	 * worker may have left a call unread or a result half written is not
+	 * used again.
+	 * @param {function(Error)} callback Called after the slot is freed
+	 */
+	_detachSlot(callback) {
+		const hadWorker = ![CREATING, INIT, EXITED, DEPARTED].includes(this.state);
+		if (![INIT, EXITED, READY].includes(this.state)) {
+			this._slot.retired = true;
+		}
+		this._slot.manager = null;
+		this.state = DEPARTING;
+		const finish = () => {
+			this.state = DEPARTED;
+			if (callback) {
+				callback(null);
+			}
+		};
+		if (hadWorker) {
+			// commands are handled in order, so the slot is free for later ones
+			this.controlPort.send({action: 'kill worker', slot: this.slot}, this.options['killWorkerTimeout'], finish);
+		} else {
+			finish();
+		}
+	}
+
 	/**
 	 * Call a function in a python script.
 	 * @param {String} fileName The file where the function resides
 	 * @param {String} functionName The function to run
 	 * @param {Array} arg Arguments for the function as an array
-	 * @param {Object} options Include optional cwd (as absolute path), paths and timeout.
+	 * @param {Object} options Include optional cwd (as absolute path), paths, timeout
+	 *      and limits ({cpu: seconds, memory: bytes of address space, files:
+	 *      number of open files}, defaulting to the limits given to the constructor).
+	 *      Exceeding a limit fails the call with a ResourceLimitError.
+	 *      Also optional maxOutputSize (bytes of stdout and stderr kept in the
+	 *      Output, defaulting to the constructor option) and onOutput (a
+	 *      function(stream, data) called with every piece of 'stdout' or
+	 *      'stderr' as it arrives, also beyond maxOutputSize).
+	 *      With profile (true, or {top: number of functions, defaults to 20,
+	 *      sort: 'cumulative' or 'total'}) the worker runs the call under
+	 *      cProfile, and the Output has a profile (see Output).
 	 * @param {function(Error, Output)} callback Called when the result is computed
 	 *                                           or any error happens
 	 *
@@ -180,6 +527,8 @@ class ZygoteManager {
 			returnByArg: false,
 		});
 
+		this._countModuleCall(fileName, options);
+
 		const callData = {
 			file: fileName,
 			fcn: functionName,
@@ -187,51 +536,203 @@ class ZygoteManager {
 			cwd: options.cwd,
 			paths: options.paths,
 			returnByArg: options.returnByArg,
+			limits: _.defaults({}, options.limits, this.options.limits),
 		};
-		const callDataString = JSON.stringify(callData);
-
+		if (options.profile) {
+			callData.profile = typeof options.profile === 'object' ? options.profile : {};
+		}
 		if (this.debugMode) {
-				console.log("Calling function: " + callDataString + " with timeout: " + options.timeout);
+				console.log("Calling function: " + JSON.stringify(callData) + " with timeout: " + options.timeout);
 		}
 
-		this.outputStdout = '';
-		this.outputStderr = '';
-		this.outputBoth = '';
+		this._startOutput(options);
 
 		this.lastCallData = callData;
 		this.state = IN_CALL;
-		this.callPort.send(callData, options.timeout, (err, message) => {
+		const start = Date.now();
+		this.callPort.send(callData, options.timeout, (err, message, payload, size) => {
 			if (err != null) {
 				this.state = ERROR;
+				this._countPortError(err, 'call');
 				var output = new Output(
-					this.outputStdout, this.outputStderr,
-					this.outputBoth, null
+					this._output.stdout(), this._output.stderr(),
+					this._output.both(), null
 				);
-				callback(new TimeoutError('function "' + functionName + '" in file "' + fileName + '"'), output);
+				if (err instanceof MessageTooLargeError) {
+					callback(err, output);
+				} else if (err instanceof WorkerDiedError) {
+					callback(new WorkerDiedError(err.code, err.signal, functionName, fileName), output);
+				} else {
+					callback(new TimeoutError('function "' + functionName + '" in file "' + fileName + '"'), output);
+				}
 			} else {
+				this._observeCall(start, message['usage'], size);
 				if (message['present']) {
 					var output = new Output(
-						this.outputStdout, this.outputStderr,
-						this.outputBoth, message.val
+						this._output.stdout(), this._output.stderr(),
+						this._output.both(), message['binary'] ? payload : message.val,
+						message['usage'], message['profile'] || null
 					);
 					this.state = READY;
 					callback(null, output);
 				} else {
 					// TODO we can read from the message to see internal state/specificly what went wrong
 					this.state = READY;
-					if (message['error'] == 'Function not present') {
-						callback(new FunctionMissingError(functionName, fileName)); // TODO implement stderr and stdout
-					} else if (message['error'] == 'File not present in the current directory') {
-						callback(new FileMissingError(fileName));
-					} else {
-						callback(new InternalZyspawnError(message['error']));
-					}
+					callback(this._callError(message, fileName, functionName)); // TODO implement stderr and stdout
 					this._logError('_createdMessageHandler Failed with messsage "' + message['message'] + '"');
 				}
 			}
 		});
 	}
 
+	/**
+	 * Call several functions in one request to the worker.
+	 * @param {Array} calls Array of {module, fn, args, options} where options
+	 *      include optional cwd, paths, returnByArg and limits as in call()
+	 * @param {Object} options Include optional timeout (for the whole batch),
+	 *      threadData (pass the 'data' of a returnByArg call to the next
+	 *      returnByArg call) and stopOnError (do not run calls after a failed
+	 *      one, defaults to true)
+	 * @param {function(Error, Array)} callback Called with an array of
+	 *      {err, output} for each call which was run, or an error if the
+	 *      batch as a whole failed. The Output of each call contains the
+	 *      stdout and stderr of that call.
+	 */
+	callBatch(calls, options, callback) {
+		if (this.debugMode) {
+			console.log(util.format("[ZygoteManager] Running batch of %d calls", calls.length));
+		}
+
+		if (![READY].includes(this.state)) {
+			callback(new BadStateError([READY], this.state));
+			return;
+		}
+
+		_.defaults(options, {
+			timeout: 3000,
+			threadData: false,
+			stopOnError: true,
+		});
+
+		const batchData = {
+			batch: calls.map((call) => {
+				const callOptions = _.defaults({}, call.options, {
+					cwd: __dirname,
+					paths: [],
+					returnByArg: false,
+				});
+				this._countModuleCall(call.module, callOptions);
+				return {
+					file: call.module,
+					fcn: call.fn,
+					args: call.args,
+					cwd: callOptions.cwd,
+					paths: callOptions.paths,
+					returnByArg: callOptions.returnByArg,
+					limits: _.defaults({}, callOptions.limits, this.options.limits),
+				};
+			}),
+			threadData: options.threadData,
+			stopOnError: options.stopOnError,
+		};
+
+		this._startOutput({});
+
+		this.lastCallData = batchData;
+		this.state = IN_CALL;
+		const start = Date.now();
+		this.callPort.send(batchData, options.timeout, (err, message, payload, size) => {
+			if (err != null) {
+				this.state = ERROR;
+				this._countPortError(err, 'call');
+				if (err instanceof MessageTooLargeError || err instanceof WorkerDiedError) {
+					callback(err);
+				} else {
+					callback(new TimeoutError('batch of ' + calls.length + ' calls'));
+				}
+				return;
+			}
+			this.state = READY;
+			this._observeCall(start, null, size);
+			message['batch'].forEach((result) => this._observeUsage(result['usage']));
+			callback(null, message['batch'].map((result, i) => {
+				const call = batchData.batch[i];
+				const output = new Output(
+					result['stdout'], result['stderr'], result['stdout'] + result['stderr'],
+					!result['present'] ? null :
+						result['binary'] ? payload.slice(result['offset'], result['offset'] + result['length']) :
+						result['val'],
+					result['usage']
+				);
+				return {
+					err: result['present'] ? null : this._callError(result, call.file, call.fcn),
+					output: output,
+				};
+			}));
+		});
+	}
+
+	/**
+	 * Record a value in the metrics, if any.
+	 */
+	_observe(name, value, labels) {
+		if (this.metrics) {
+			this.metrics.observe(name, value, labels);
+		}
+	}
+
+	/**
+	 * Record the latency, the import and execution time (see Output.usage)
+	 * and the result size of a call in the metrics, if any.
+	 */
+	_observeCall(start, usage, size) {
+		if (!this.metrics) {
+			return;
+		}
+		this.metrics.observe('zyspawn_call_seconds', (Date.now() - start) / 1000);
+		this.metrics.observe('zyspawn_result_bytes', size);
+		this._observeUsage(usage);
+	}
+
+	_observeUsage(usage) {
+		if (this.metrics && usage) {
+			this.metrics.observe('zyspawn_call_import_seconds', usage['importTime'] / 1000);
+			this.metrics.observe('zyspawn_call_exec_seconds', usage['execTime'] / 1000);
+		}
+	}
+
+	/**
+	 * Count a failed message to the zygote or worker in the metrics, if any.
+	 * @param {Error} err The error from the Port (null for a bad response)
+	 * @param {String} operation
+	 */
+	_countPortError(err, operation) {
+		if (!this.metrics) {
+			return;
+		}
+		if (err instanceof PortTimeoutError) {
+			this.metrics.inc('zyspawn_timeouts_total', {operation: operation});
+		} else if (err != null && !(err instanceof MessageTooLargeError) && !(err instanceof WorkerDiedError)) {
+			// PortBrokenError, or the error which broke the port
+			this.metrics.inc('zyspawn_port_broken_total', {operation: operation});
+		}
+	}
+
+	/**
+	 * Convert the message of a failed call into an error.
+	 */
+	_callError(message, fileName, functionName) {
+		if (message['error'] == 'Resource limit exceeded') {
+			return new ResourceLimitError(message['limit'], functionName, fileName);
+		} else if (message['error'] == 'Function not present') {
+			return new FunctionMissingError(functionName, fileName);
+		} else if (message['error'] == 'File not present in the current directory') {
+			return new FileMissingError(fileName);
+		} else {
+			return new InternalZyspawnError(message['error']);
+		}
+	}
+
 	/**
 	 * Shutdown the zygote.
 	 * @param {function(Error)} callback Called after shutdown.
@@ -253,6 +754,10 @@ class ZygoteManager {
 			if (this.debugMode) {
 					console.log("[ZygoteManager] killing my zygote");
 			}
+			if (this._otherSlotsInUse()) {
+				this._detachSlot(callback);
+				return;
+			}
 			// TODO add check for state=departed
 			// TODO remove state exited from the check here
 			if (![INIT, EXITED, ERROR].includes(this.state)) {
@@ -283,7 +788,7 @@ class ZygoteManager {
 				this.state = DEPARTED;
 			}, this.options['killZygoteTimeout']);
 
-		this.child.stdio[4].write(JSON.stringify({action: 'kill self'})+'\n');
+		this.controlPort.notify({action: 'kill self'});
 	}
 
 	/*
@@ -293,6 +798,10 @@ class ZygoteManager {
 		if (this.debugMode) {
 			console.log("[ZygoteManager] Forcing death of zygote");
 		}
+		if (this._otherSlotsInUse()) {
+			this._detachSlot(callback);
+			return;
+		}
 
 		this.state = DEPARTING;
 		if (callback) {
@@ -344,17 +853,41 @@ class ZygoteManager {
 			return;
 		}
 		this.state = PREPPING;
-		this.controlPort.send({action: 'create worker'}, this.options['startWorkerTimeout'], (err, message) => {
+		const start = Date.now();
+		const command = {action: 'create worker', slot: this.slot};
+		if (this._slot.dirty) {
+			// the worker writes the marker before its first result
+			command.sync = 'zyspawn-sync-' + crypto.randomBytes(8).toString('hex') + '\n';
+			this.callPort.resync(Buffer.from(command.sync));
+		}
+		this.controlPort.send(command, this.options['startWorkerTimeout'], (err, message) => {
 			if (err != null) {
+				this._earlyExits.clear();
 				this.state = ERROR;
+				this._countPortError(err, 'start_worker');
 				callback(new TimeoutError("Creating Worker"));
 			} else {
 				if (message['success']) {
+					this._observe('zyspawn_worker_start_seconds', (Date.now() - start) / 1000);
+					this._slot.dirty = false;
 					this.state = READY;
 					this.workerSpawned = true;
+					this.workerUses = 1;
+					this.workerStartTime = Date.now();
+					this._workerPid = message['pid'] === undefined ? null : message['pid'];
+					this._workerExit = null;
+					const early = this._earlyExits.get(this._workerPid);
+					this._earlyExits.clear();
+					if (early !== undefined) {
+						// its exit arrived before this reply
+						this._workerExitListener(this._workerPid, early.code, early.signal);
+						callback(new WorkerDiedError(this._workerExit.code, this._workerExit.signal));
+						return;
+					}
 					callback(null);
 				} else {
 					// TODO we can read from the message to see internal state/specificly what went wrong
+					this._earlyExits.clear();
 					this.state = INIT;
 					this.workerSpawned = false;
 					callback(new InternalZyspawnError("Failed to spawn worker"));
@@ -384,16 +917,32 @@ class ZygoteManager {
 			callback(new InternalZyspawnError('Invalid ZygoteManager props for killWorker()'), null);
 			return;
 		}
+		if (this.state === ERROR) {
+			// a call may have timed out or its worker died while writing the
+			// result, the next worker of the slot resyncs callPort
+			this._slot.dirty = true;
+		}
+		if (this._workerExit !== null) {
+			// the worker has died already, see _workerExitListener()
+			this.state = EXITED;
+			this.workerSpawned = false;
+			callback(null);
+			return;
+		}
 
 		this.state = EXITING;
 
-		this.controlPort.send({action: 'kill worker'}, this.options['killWorkerTimeout'], (err, message) => {
+		const start = Date.now();
+		this.controlPort.send({action: 'kill worker', slot: this.slot}, this.options['killWorkerTimeout'], (err, message) => {
 			if (err != null) {
 				this.state = ERROR;
 				this.workerSpawned = false;
+				this._countPortError(err, 'kill_worker');
 				callback(new TimeoutError("Killing Worker"));
 			} else {
-				if (message['success']) {
+				// the worker may have died after the message was sent
+				if (message['success'] || this._workerExit !== null) {
+					this._observe('zyspawn_worker_kill_seconds', (Date.now() - start) / 1000);
 					this.state = EXITED;
 					this.workerSpawned = false;
 					callback(null);
@@ -408,6 +957,230 @@ class ZygoteManager {
 		});
 	}
 
+	/**
+	 * Reset the state left behind by calls in the worker (sys.path, cwd,
+	 * question modules, matplotlib figures and random seeds), so that the
+	 * worker can serve another request without being killed and forked again.
+	 * @param {function(Error)} callback Called after the worker is reset
+	 *                                   or any error happens
+	 *
+	 * Notice:
+	 * The worker is not isolated from what earlier requests did beyond the
+	 * state listed above, so only reuse it for trusted code.
+	 */
+	resetWorker(callback) {
+		if (![READY].includes(this.state)) {
+			callback(new BadStateError([READY], this.state));
+			return;
+		}
+
+		this.state = IN_CALL;
+		const start = Date.now();
+		this.callPort.send({reset: true}, this.options['resetWorkerTimeout'], (err, message) => {
+			if (err != null || !message['reset']) {
+				this.state = ERROR;
+				this._countPortError(err, 'reset_worker');
+				callback(new TimeoutError("Resetting Worker"));
+			} else {
+				this._observe('zyspawn_worker_reset_seconds', (Date.now() - start) / 1000);
+				this.state = READY;
+				this.workerUses++;
+				callback(null);
+			}
+		});
+	}
+
+	/**
+	 * Get how long the current worker has been running.
+	 * @return {number} Milliseconds since the worker was started, 0 if there is none
+	 */
+	workerAge() {
+		return this.workerStartTime == null ? 0 : Date.now() - this.workerStartTime;
+	}
+
+	/**
+	 * Ask the zygote for its status. Can be used in any state while the
+	 * zygote is alive, also while a call or another control message is in
+	 * flight.
+	 * @param {function(Error, Object)} callback Called with the status message
+	 *      ({success, message, preload}) or an error
+	 */
+	status(callback) {
+		this.controlPort.send({action: 'status'}, this.options['statusTimeout'], (err, message) => {
+			if (err != null) {
+				callback(new TimeoutError("Zygote status"));
+			} else {
+				callback(null, message);
+			}
+		});
+	}
+
+	/**
+	 * Measure the memory of the zygote and its worker.
+	 * @param {function(Error, Object)} callback Called with {zygote, worker}
+	 *      where each is {rss, pss, uss, shared} in bytes (from
+	 *      /proc/<pid>/smaps_rollup, null if unavailable or no worker)
+	 */
+	memory(callback) {
+		this.controlPort.send({action: 'memory', slot: this.slot}, this.options['statusTimeout'], (err, message) => {
+			if (err != null) {
+				callback(new TimeoutError("Zygote memory"));
+			} else {
+				callback(null, {zygote: message['zygote'], worker: message['worker']});
+			}
+		});
+	}
+
+	/**
+	 * Compile python files into the code cache of the zygote, so that workers
+	 * started afterwards do not compile them when importing them. Cached
+	 * code is dropped when the file changes (its mtime or size).
+	 * @param {Array} paths Absolute paths of python files or directories
+	 *                      (compiled recursively)
+	 * @param {function(Error, Object)} callback Called with {entries, bytes}
+	 *      of the code cache, or an error if a file failed to compile or the
+	 *      code cache is disabled
+	 */
+	compile(paths, callback) {
+		if (this.options['codeCacheSize'] <= 0) {
+			callback(new InvalidOperationError('compile() needs the code cache, see codeCacheSize'));
+			return;
+		}
+		this.controlPort.send({action: 'compile', paths: paths}, this.options['warmTimeout'], (err, message) => {
+			if (err != null) {
+				callback(new TimeoutError("Compiling " + paths.join(', ')));
+			} else if (!message['success']) {
+				callback(new InternalZyspawnError("Failed to compile due to: " + message['errors'].join('; ')));
+			} else {
+				callback(null, message['codeCache']);
+			}
+		});
+	}
+
+	/**
+	 * Ask the zygote for the pid of its worker.
+	 * @param {function(Error, number)} callback Called with the pid (-1 if there
+	 *                                           is no worker) or an error
+	 */
+	workerPid(callback) {
+		this.controlPort.send({action: 'workerPid', slot: this.slot}, this.options['statusTimeout'], (err, message) => {
+			if (err != null) {
+				callback(new TimeoutError("Worker pid"));
+			} else {
+				callback(null, parseInt(message['message']));
+			}
+		});
+	}
+
+	/**
+	 * Import a module in the zygote, so that workers started afterwards do
+	 * not need to import it again. The zygote keeps a limited number of
+	 * such modules (option warmModuleLimit) and evicts the least recently
+	 * warmed one.
+	 * @param {String} fileName The module to import
+	 * @param {Object} options Include optional cwd and paths, as in call()
+	 * @param {function(Error)} callback Called after the module is imported
+	 *                                   or any error happens
+	 */
+	warm(fileName, options, callback) {
+		const warmData = {
+			action: 'warm',
+			file: fileName,
+			cwd: options.cwd || __dirname,
+			paths: options.paths || [],
+		};
+		this.controlPort.send(warmData, this.options['warmTimeout'], (err, message) => {
+			if (err != null) {
+				callback(new TimeoutError("Warming module " + fileName));
+				return;
+			}
+			this.warmModules = new Set(message['warm'].map(([cwd, paths, file]) => {
+				return ZygoteManager.moduleKey(file, {cwd: cwd, paths: paths});
+			}));
+			if (message['success']) {
+				callback(null);
+			} else {
+				callback(new InternalZyspawnError("Failed to warm module due to: " + message['message']));
+			}
+		});
+	}
+
+	/**
+	 * Check if a module has been imported by the zygote (see warm()).
+	 * @param {String} fileName The module
+	 * @param {Object} options Include optional cwd and paths, as in call()
+	 * @return {boolean} True if workers do not need to import the module
+	 */
+	isWarm(fileName, options) {
+		return this.warmModules.has(ZygoteManager.moduleKey(fileName, options));
+	}
+
+	/**
+	 * Get a key identifying a module together with where it is imported from.
+	 */
+	static moduleKey(fileName, options) {
+		options = options || {};
+		return JSON.stringify([options.cwd || __dirname, options.paths || [], fileName]);
+	}
+
+	/**
+	 * Count calls of a module and warm it after warmThreshold calls.
+	 */
+	_countModuleCall(fileName, options) {
+		if (this.options['warmThreshold'] <= 0) return;
+		const key = ZygoteManager.moduleKey(fileName, options);
+		const count = (this._moduleCallCounts.get(key) || 0) + 1;
+		this._moduleCallCounts.set(key, count);
+		if (count >= this.options['warmThreshold'] && !this.warmModules.has(key)) {
+			this._moduleCallCounts.delete(key);
+			this.warm(fileName, options, (err) => {
+				if (err) this._logError(String(err));
+			});
+		}
+	}
+
+	/**
+	 * Check if the zygote can still be used: it has been created, has not
+	 * exited, its pipes work and its last health check did not fail.
+	 * @return {boolean}
+	 */
+	isHealthy() {
+		return Boolean(this.zygoteSpawned) && ![DEPARTING, DEPARTED].includes(this.state)
+			&& !this._zygote.failedHealthCheck
+			&& !this.controlPort.isBroken() && !this.callPort.isBroken();
+	}
+
+	/**
+	 * @return {boolean} True if the zygote process has exited
+	 */
+	hasDeparted() {
+		return this.state === DEPARTED;
+	}
+
+	/**
+	 * Check that the zygote answers a status message in time. If it does
+	 * not, isHealthy() returns false from then on.
+	 * @param {function(Error)} callback Called with null if the zygote answered
+	 */
+	healthCheck(callback) {
+		this.controlPort.send({action: 'status'}, this.options['healthCheckTimeout'], (err, message) => {
+			if (err != null || !message['success']) {
+				this._zygote.failedHealthCheck = true;
+				callback(err || new InternalZyspawnError("Bad status of zygote"));
+			} else {
+				callback(null);
+			}
+		});
+	}
+
+	/**
+	 * Check if a worker has been started and is waiting for calls.
+	 * @return {boolean} True if call() can be used right away
+	 */
+	isWorkerReady() {
+		return this.state === READY;
+	}
+
 	_clearTimeout() {
 		if (this.timeoutID == null) {
 			this._logError("cannot clear timeout with no active timeout");
@@ -487,8 +1260,41 @@ class ZygoteManager {
 		return true;
 	}
 
+	/**
+	 * Called when a worker of the slot of this ZygoteManager exits without
+	 * being killed by killWorker(), e.g. when it crashes, exceeds a hard
+	 * resource limit or is killed by the OOM killer. A call in progress fails
+	 * right away with a WorkerDiedError instead of timing out, an idle
+	 * worker is forgotten so that startWorker() can start another one.
+	 * @param {number} pid
+	 * @param {number} code Exit code, null if killed by a signal
+	 * @param {number} signal Number of the signal, or null
+	 */
+	_workerExitListener(pid, code, signal) {
+		if (pid !== this._workerPid && this.state === PREPPING) {
+			// may be the worker being started, see startWorker()
+			this._earlyExits.set(pid, {code: code, signal: signal});
+			return;
+		}
+		if (pid !== this._workerPid || this._workerExit !== null) {
+			return; // not the current worker
+		}
+		this._workerExit = {code: code, signal: signal === null ? null : signalName(signal)};
+		if (this.metrics) {
+			this.metrics.inc('zyspawn_worker_deaths_total', {signal: String(this._workerExit.signal)});
+		}
+		if (this.state === IN_CALL) {
+			// call() (or callBatch(), resetWorker()) fails and moves to ERROR
+			this.callPort.cancel(new WorkerDiedError(this._workerExit.code, this._workerExit.signal));
+		} else if (this.state === READY) {
+			this.state = EXITED;
+			this.workerSpawned = false;
+		}
+	}
+
 	_zygoteExitListener(code, signal) {
 		// TODO add check for state=departed
+		const unexpected = this.state !== DEPARTING;
 		var err = null;
 		if (![DEPARTING].includes(this.state)) {
 			err = new InternalZyspawnError('invalid state for _zygoteExitListener:' + String(this.state));
@@ -508,12 +1314,13 @@ class ZygoteManager {
 			this.departingCallback(err);
 		} else {
 			console.error(String(err));
-			console.error(this.outputStderr);
+			console.error(this._output.stderr());
 		}
 		if (this.debugMode) {
 			console.log("Zygote Exited with code: " + String(code));
 		}
 		this.departingCallback = null;
+		this.emit('exit', code, signal, unexpected);
 	}
 
 	_handleStderrData(data) {
@@ -523,8 +1330,7 @@ class ZygoteManager {
 		// CREATING, INIT and Prepping Are added for zygote
 		this._checkState([CREATING, INIT, PREPPING, IN_CALL, EXITING, EXITED, ERROR, DEPARTING], '_handleStderrData');
 		if (this.state == IN_CALL) {
-			this.outputStderr += data;
-			this.outputBoth += data;
+			this._appendOutput('stderr', data);
 		}
 	}
 
@@ -534,12 +1340,137 @@ class ZygoteManager {
 		}
 		this._checkState([IN_CALL, EXITING, EXITED], '_handleStdoutData');
 		if (this.state == IN_CALL) {
-			this.outputStdout += data;
-			this.outputBoth += data;
+			this._appendOutput('stdout', data);
+		}
+	}
+
+	/**
+	 * Start capturing the output of a call.
+	 * @param {Object} options Options of the call, with optional maxOutputSize
+	 *                         and onOutput (see call())
+	 */
+	_startOutput(options) {
+		const maxOutputSize = options.maxOutputSize !== undefined ?
+			options.maxOutputSize : this.options['maxOutputSize'];
+		this._output = new OutputCapture(maxOutputSize);
+		this._onOutput = options.onOutput || null;
+		this._decoders = this._onOutput ?
+			{stdout: new StringDecoder('utf8'), stderr: new StringDecoder('utf8')} : null;
+	}
+
+	_appendOutput(stream, data) {
+		this._output.append(stream, data);
+		if (this._onOutput) {
+			const str = typeof data === 'string' ? data : this._decoders[stream].write(data);
+			if (str.length > 0) {
+				this._onOutput(stream, str);
+			}
 		}
 	}
 }
 
+/**
+ * @param {number} signal The number of a signal
+ * @return {String} Its name, e.g. 'SIGKILL', or the number as a String
+ */
+function signalName(signal) {
+	const name = Object.keys(os.constants.signals).find((name) => os.constants.signals[name] === signal);
+	return name === undefined ? String(signal) : name;
+}
+
+/**
+ * Stands in for the ChildProcess of a zygote forked by ZygoteManager.fork(),
+ * which is a child of the zygote it was forked from. It has the pid, stdio
+ * (the FIFOs) and kill() of a ChildProcess and emits 'exit' when the zygote
+ * closes its response pipe (5), i.e. exits, with a null code and signal.
+ */
+class ForkedZygoteProcess extends EventEmitter {
+	/**
+	 * @param {number} pid
+	 * @param {Array} stdio A stream for every pipe, null if opening the FIFOs failed
+	 */
+	constructor(pid, stdio) {
+		super();
+		this.pid = pid;
+		this.stdio = stdio;
+		this.exited = false;
+		if (stdio !== null) {
+			stdio[5].on('close', () => {
+				this.exited = true;
+				// the other readable pipes close by themselves
+				stdio.forEach((stream) => {
+					if (stream.writable) {
+						stream.destroy();
+					}
+				});
+				this.emit('exit', null, null);
+			});
+		}
+	}
+
+	kill(signal='SIGTERM') {
+		if (this.exited) {
+			return false;
+		}
+		try {
+			process.kill(this.pid, signal);
+			return true;
+		} catch (err) {
+			return false;
+		}
+	}
+}
+
+/**
+ * Open the FIFOs of a zygote forked by the "fork zygote" action of zygote.py,
+ * numbered as the pipes described in the constructor of ZygoteManager. The
+ * pipes read by the zygote can only be opened once the zygote has opened them
+ * (it does so after the others), so they are opened without blocking and
+ * retried until the timeout.
+ * @param {String} dir Directory of the FIFOs
+ * @param {number} workerSlots
+ * @param {number} timeout ms
+ * @param {function(Error, Array)} callback Called with a stream for every pipe
+ */
+function openFifos(dir, workerSlots, timeout, callback) {
+	const count = 7 + 4 * (workerSlots - 1);
+	const deadline = Date.now() + timeout;
+	const handles = new Array(count).fill(null);
+	let left = count;
+	let failed = false;
+	const isInput = (fd) => fd == 0 || fd == 4 || (fd >= 7 && (fd - 7) % 4 == 0);
+	const open = (fd) => {
+		const flags = (isInput(fd) ? fs.constants.O_WRONLY : fs.constants.O_RDONLY) | fs.constants.O_NONBLOCK;
+		fs.open(path.join(dir, String(fd)), flags, (err, handle) => {
+			if (failed) {
+				if (!err) fs.close(handle, () => {});
+				return;
+			}
+			if (err && err.code === 'ENXIO' && Date.now() < deadline) {
+				setTimeout(() => open(fd), 1);
+				return;
+			}
+			if (err) {
+				failed = true;
+				handles.forEach((handle) => {
+					if (handle !== null) fs.close(handle, () => {});
+				});
+				callback(err.code === 'ENXIO' ? new TimeoutError('Opening FIFOs of forked zygote') : err, null);
+				return;
+			}
+			handles[fd] = handle;
+			if (--left == 0) {
+				callback(null, handles.map((handle, fd) => {
+					return new net.Socket({fd: handle, readable: !isInput(fd), writable: isInput(fd)});
+				}));
+			}
+		});
+	};
+	for (let fd = 0; fd < count; fd++) {
+		open(fd);
+	}
+}
+
 /**
 * Represents the output of a program.
 */
@@ -549,12 +1480,21 @@ class Output {
 	 * @param {String} stderr Standard error
 	 * @param {String} consoleLog Combined standard out and standard error
 	 * @param {any} result Return value
+	 * @param {Object} usage Resources used by the call: userCpu, systemCpu,
+	 *      importTime and execTime (ms), and maxRss (peak RSS of the worker in bytes)
+	 * @param {Object} profile Of calls with the profile option: phases (ms spent
+	 *      setting up sys.path, changing the directory, importing, calling and
+	 *      serializing the result: path, chdir, import, call, serialize) and
+	 *      functions ([{function, calls, primitiveCalls, totalTime,
+	 *      cumulativeTime}] of the top functions, times in ms)
 	 */
-	constructor(stdout, stderr, consoleLog, result) {
+	constructor(stdout, stderr, consoleLog, result, usage=null, profile=null) {
 		this.stdout = stdout;
 		this.stderr = stderr;
 		this.consoleLog = consoleLog;
 		this.result = result;
+		this.usage = usage;
+		this.profile = profile;
 	}
 
 	hasResult() {
@@ -570,3 +1510,4 @@ class Output {
 }
 
 module.exports = ZygoteManager;
+module.exports.Output = Output;
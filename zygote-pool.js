@@ -44,17 +44,44 @@ const _ = require('lodash');
 const assert = require('assert');
 const BlockingQueue = require('./blocking-queue');
 const ZygoteManager = require('./zygote-manager');
+const ResultCache = require('./result-cache');
+const { Metrics } = require('./metrics');
 const {
 	ZyspawnError,
 	InternalZyspawnError,
 	FileMissingError,
 	FunctionMissingError,
 	InvalidOperationError,
-	TimeoutError
+	TimeoutError,
+	ResourceLimitError,
+	WorkerDiedError
 } = require('./error');
 
 const DEFAULT_CALLBACK = (err) => { if(err) throw err; };
 
+/**
+ * Run a callback style operation. Without a callback, return a Promise
+ * settled by the operation instead.
+ * @param {function} callback The callback given by the user, if any
+ * @param {function(function(Error, any))} run Starts the operation
+ * @return {Promise} undefined if a callback is given
+ */
+function callbackOrPromise(callback, run) {
+	if (callback) {
+		run(callback);
+		return undefined;
+	}
+	return new Promise((resolve, reject) => {
+		run((err, result) => {
+			if (err) {
+				reject(err);
+			} else {
+				resolve(result);
+			}
+		});
+	});
+}
+
 /**
  * Manages a pool of zygotes. Users create and use zygotes through this class.
  */
@@ -64,37 +91,182 @@ class ZygotePool {
 	 * @param {number} zygoteNum The number of zygotes to use
 	 * @param {function(Error)} callback Called after initialization,
 	 *      if not specified, errors will be throwed.
+	 * @param {Object} options Options passed to ZygoteManager.create() for
+	 *      every zygote, e.g. {preload: ['numpy', '/course/lib/helpers.py']}.
+	 *      Pool specific options:
+	 *          standbyWorker: keep a forked worker ready in every idle zygote,
+	 *              so that allocation does not wait for startWorker() and
+	 *              done() does not wait for killWorker()
+	 *          minZygotes, maxZygotes: enable autoscaling between these
+	 *              numbers of zygotes (zygoteNum is the initial number)
+	 *          targetQueueWait: add zygotes when a request waits longer than
+	 *              this (ms) for an idle zygote
+	 *          idleZygoteTimeout: remove zygotes which stay idle longer than
+	 *              this (ms)
+	 *          autoscaleInterval: how often (ms) the above are checked
+	 *          warmThreshold: zygotes import a module after this many calls
+	 *              of it, and requests prefer zygotes with the module of
+	 *              their first call imported (see ZygoteManager.warm())
+	 *          workerMaxUses, workerMaxAge: reuse a worker for up to this
+	 *              many requests or this long (ms), resetting it between
+	 *              requests instead of killing it (see ZygoteManager.resetWorker()).
+	 *              Only for trusted code.
+	 *          metrics: a Metrics (see metrics.js) to record in, e.g. to share
+	 *              one between pools. A new one by default.
+	 *          healthCheckInterval: how often (ms) idle zygotes are asked for
+	 *              their status (0 disables). Zygotes which exit, break or fail
+	 *              a health check are replaced in the background.
+	 *          respawnBackoff, maxRespawnBackoff: delay (ms) before retrying a
+	 *              failed replacement, doubled after every failure up to the
+	 *              maximum
+	 *          resultCache: a ResultCache (see result-cache.js), or its
+	 *              options, to serve calls of deterministic functions from
+	 *              (see ZygoteInterface.call()). None by default.
+	 *          workerSlots: run this many workers in every zygote process
+	 *              (see ZygoteManager.attachSlot()). Zygote numbers of the pool
+	 *              count slots, e.g. 8 zygotes with 4 slots are 2 processes.
+	 *          forkZygotes: start only one zygote process and fork the others
+	 *              from a running one (see ZygoteManager.fork()), so that
+	 *              they skip starting python and preloading modules
+	 *          readyOnFirst: call the callback once the first zygote is
+	 *              ready instead of all of them. The others keep starting
+	 *              in the background, and are replaced if they fail.
+	 *          profileSampleRate: profile this fraction of the calls which
+	 *              do not give the profile option (see ZygoteManager.call())
+	 *          onProfile: function(profile, {module, fn}) called with the
+	 *              profile of every profiled call, e.g. to log slow ones
 	 */
 	constructor(zygoteNum, callback = DEFAULT_CALLBACK, options={}) {
+		options = _.defaults({}, options, {
+			healthCheckInterval: 10000,
+			respawnBackoff: 100,
+			maxRespawnBackoff: 30000,
+		});
 		this._isShutdown = false;
 		this._totalZygoteNum = 0;
-		this._zygoteManagerList = []; // TODO health check?
+		this._startingZygoteNum = 0;
+		this._startingJobs = new Set(); // promises of zygotes being added, see _addZygote()
+		this._startingProcesses = []; // {unclaimedSlots, promise} of zygote processes being created
+		this._zygoteManagerList = [];
 		this._idleZygoteManagerQueue = new BlockingQueue();
-		this.addZygote(zygoteNum, callback, options);
+		this._idleSince = new Map(); // ZygoteManager => time it became idle
+		this._options = options;
+		this._standbyWorker = Boolean(options['standbyWorker']);
+		this._recycleWorker = options['workerMaxUses'] !== undefined || options['workerMaxAge'] !== undefined;
+		this._autoscaleTimer = null;
+		this._healthCheckTimer = null;
+		this._respawnFailures = 0; // consecutive failed replacements
+		this._profileSampleRate = options['profileSampleRate'] || 0;
+		this._onProfile = options['onProfile'] || null;
+		this.metrics = options['metrics'] || new Metrics();
+		this.resultCache = options['resultCache'] instanceof ResultCache ? options['resultCache'] :
+			options['resultCache'] ? new ResultCache(_.defaults({metrics: this.metrics}, options['resultCache'])) : null;
+		if (this.resultCache !== null && this.resultCache.metrics === null) {
+			this.resultCache.metrics = this.metrics;
+		}
+		if (options['maxZygotes'] !== undefined) {
+			this._startAutoscaling(zygoteNum, options);
+		}
+		if (options['healthCheckInterval'] > 0) {
+			this._startHealthChecks(options['healthCheckInterval']);
+		}
+		if (options['readyOnFirst']) {
+			let ready = false;
+			this._addZygote(zygoteNum, (errs) => {
+				if (!ready) {
+					callback(errs);
+					return;
+				}
+				(errs || []).forEach(() => this._respawnZygote());
+			}, options, 'initial', () => {
+				ready = true;
+				callback(null);
+			});
+		} else {
+			this._addZygote(zygoteNum, callback, options, 'initial');
+		}
+	}
+
+	/**
+	 * Create a zygote pool, see the constructor.
+	 * @param {number} zygoteNum The number of zygotes to use
+	 * @param {Object} options See the constructor
+	 * @return {Promise} Resolved with the ZygotePool after initialization
+	 */
+	static create(zygoteNum, options={}) {
+		return new Promise((resolve, reject) => {
+			const zygotePool = new ZygotePool(zygoteNum, (err) => {
+				if (err) {
+					reject(err);
+				} else {
+					resolve(zygotePool);
+				}
+			}, options);
+		});
 	}
 
 	/**
 	 * Add zygotes to the pool.
 	 * @param {number} num Number of zygotes to add
 	 * @param {function(Error)} callback Called after zygotes are created,
-	 *                                   or error happens
+	 *      or error happens. If not specified, a Promise is returned.
+	 * @param {Object} options Options for ZygoteManager.create(), defaults to
+	 *                         the options given to the constructor
+	 */
+	addZygote(num, callback, options = this._options) {
+		return callbackOrPromise(callback, (callback) => {
+			this._addZygote(num, callback, options, 'manual');
+		});
+	}
+
+	/**
+	 * Add zygotes to the pool, see addZygote().
+	 * @param {String} reason Why zygotes are added, counted in the metrics
+	 * @param {function} onReady Called when the first zygote is ready
 	 */
-	addZygote(num, callback = DEFAULT_CALLBACK, options) {
+	_addZygote(num, callback, options, reason, onReady=null) {
+		if (this._isShutdown) {
+			callback([new InvalidOperationError('Cannot add zygotes to a shutdown ZygotePool')]);
+			return;
+		}
+		this.metrics.inc('zyspawn_zygote_spawns_total', {reason: reason}, num);
+		options = _.defaults({metrics: this.metrics}, options);
 		this._totalZygoteNum += num;
+		this._startingZygoteNum += num;
 
 		var jobs = [];
 		for (let i = 0; i < num; i++) {
-			jobs.push(new Promise((resolve) => {
-				ZygoteManager.create((err, zygoteManager) => {
-					if (!err) {
-						this._zygoteManagerList.push(zygoteManager);
-						this._idleZygoteManagerQueue.put(zygoteManager);
-						// TODO need to consider the case of shutdown before
-						// before creating finished
+			const job = this._createSlot(options).then((zygoteManager) => new Promise((resolve) => {
+				this._startingZygoteNum--;
+				this._zygoteManagerList.push(zygoteManager);
+				if (this._isShutdown) {
+					// shutdown() only removes the zygotes which were running,
+					// it waits for this one to be shutdown here
+					this._totalZygoteNum--;
+					this._shutdownZygoteManager(zygoteManager, () => { resolve(null); });
+					return;
+				}
+				zygoteManager.on('exit', (code, signal, unexpected) => {
+					// a busy zygote is replaced when it is reclaimed
+					if (unexpected && this._idleSince.has(zygoteManager)) {
+						this._replaceZygoteManager(zygoteManager);
 					}
-					resolve(err);
-				}, options);
-			}));
+				});
+				this._putIdleZygoteManager(zygoteManager, () => {
+					if (onReady !== null) {
+						onReady();
+						onReady = null;
+					}
+					resolve(null);
+				});
+			}), (err) => {
+				this._startingZygoteNum--;
+				this._totalZygoteNum--;
+				return err;
+			});
+			this._startingJobs.add(job);
+			job.then(() => { this._startingJobs.delete(job); });
+			jobs.push(job);
 		}
 
 		Promise.all(jobs).then((errs) => {
@@ -106,17 +278,98 @@ class ZygotePool {
 		});
 	}
 
+	/**
+	 * Get a ZygoteManager for a new zygote of the pool. With the workerSlots
+	 * option every zygote process runs several workers, so this is a free
+	 * slot of a running zygote process (see ZygoteManager.attachSlot()), of
+	 * one being started, or the first slot of a new one. With the forkZygotes
+	 * option new zygote processes are forked (see _forkParent()).
+	 * @param {Object} options Options for ZygoteManager.create()
+	 * @return {Promise} Resolved with the ZygoteManager
+	 */
+	_createSlot(options) {
+		for (const zygoteManager of this._zygoteManagerList) {
+			if (zygoteManager.freeSlotNum() > 0) {
+				return Promise.resolve(zygoteManager.attachSlot());
+			}
+		}
+		const starting = this._startingProcesses.find((zygote) => zygote.unclaimedSlots > 0);
+		if (starting !== undefined) {
+			starting.unclaimedSlots--;
+			return starting.promise.then((zygoteManager) => {
+				return zygoteManager.attachSlot() ||
+					Promise.reject(new InternalZyspawnError('No free worker slot in new zygote'));
+			});
+		}
+		const zygote = {unclaimedSlots: (options['workerSlots'] || 1) - 1, promise: null};
+		zygote.promise = this._forkParent(options).then((parent) => new Promise((resolve, reject) => {
+			const created = (err, zygoteManager) => {
+				if (err && parent !== null && zygoteManager === null) {
+					// nothing was forked, start the zygote process instead
+					parent = null;
+					ZygoteManager.create(created, options);
+					return;
+				}
+				_.pull(this._startingProcesses, zygote);
+				if (err) {
+					if (zygoteManager !== null) {
+						zygoteManager.forceKillMyZygote(() => {});
+					}
+					reject(err);
+				} else {
+					resolve(zygoteManager);
+				}
+			};
+			if (parent !== null) {
+				ZygoteManager.fork(parent, created, options);
+			} else {
+				ZygoteManager.create(created, options);
+			}
+		}));
+		this._startingProcesses.push(zygote);
+		return zygote.promise;
+	}
+
+	/**
+	 * Find the zygote process to fork a new one from with the forkZygotes
+	 * option: a running one started with the same options, or else the
+	 * first one being started.
+	 * @param {Object} options Options for the new zygote
+	 * @return {Promise} Resolved with a ZygoteManager of the zygote process,
+	 *      or null to start a new zygote process instead
+	 */
+	_forkParent(options) {
+		if (!options['forkZygotes']) {
+			return Promise.resolve(null);
+		}
+		const running = this._zygoteManagerList.find((zygoteManager) => zygoteManager.canFork(options));
+		if (running !== undefined) {
+			return Promise.resolve(running);
+		}
+		if (this._startingProcesses.length == 0) {
+			return Promise.resolve(null);
+		}
+		return this._startingProcesses[0].promise.then((zygoteManager) => {
+			return zygoteManager.canFork(options) ? zygoteManager : null;
+		}, () => null);
+	}
+
 	/**
 	 * Remove zygotes from the pool.
 	 * @param {number} num Number of zygotes to remove
 	 * @param {function(Error)} callback Called after zygotes are removed,
-	 *                                   or error happens
+	 *      or error happens. If not specified, a Promise is returned.
 	 */
-	removeZygote(num, callback = DEFAULT_CALLBACK) {
+	removeZygote(num, callback) {
+		return callbackOrPromise(callback, (callback) => this._removeZygote(num, callback));
+	}
+
+	_removeZygote(num, callback) {
 		if (num > this._totalZygoteNum) {
 			callback(new InvalidOperationError(
 				`Trying to remove ${num} zygote(s) while totalZygoteNum is ${this._totalZygoteNum}`
 			));
+			return;
 		}
 
 		this._totalZygoteNum -= num;
@@ -126,7 +379,8 @@ class ZygotePool {
 			jobs.push(new Promise((resolve) => {
 				this._idleZygoteManagerQueue.get((err, zygoteManager) => {
 					assert(!err); // BlockingQueue.clearWaiting() is never called
-					zygoteManager.shutdown((err) => { resolve(err); });
+					this._idleSince.delete(zygoteManager);
+					this._shutdownZygoteManager(zygoteManager, resolve);
 				});
 			}));
 		}
@@ -143,12 +397,168 @@ class ZygotePool {
 	/**
 	 * Shutdown ZygotePool. Stop allocating idle zygotes but working zygotes
 	 * won't be interrupted. All zygotes will be shutdown after they finish
-	 * their work.
+	 * their work. Zygotes still being started are shutdown once they are
+	 * ready.
 	 * @param {function(Error)} callback Called after all zygotes are shutdown.
+	 *      If not specified, a Promise is returned.
 	 */
-	shutdown(callback = DEFAULT_CALLBACK) {
+	shutdown(callback) {
 		this._isShutdown = true;
-		this.removeZygote(this._totalZygoteNum, callback);
+		if (this._autoscaleTimer !== null) {
+			clearInterval(this._autoscaleTimer);
+			this._autoscaleTimer = null;
+		}
+		if (this._healthCheckTimer !== null) {
+			clearInterval(this._healthCheckTimer);
+			this._healthCheckTimer = null;
+		}
+		const starting = Array.from(this._startingJobs);
+		return callbackOrPromise(callback, (callback) => {
+			this._removeZygote(this._totalZygoteNum - this._startingZygoteNum, (err) => {
+				Promise.all(starting).then(() => callback(err));
+			});
+		});
+	}
+
+	/**
+	 * Shutdown an idle ZygoteManager which has been taken out of the pool.
+	 * @param {ZygoteManager} zygoteManager The ZygoteManager to shutdown
+	 * @param {function(Error)} callback Called after the zygote is shutdown
+	 */
+	_shutdownZygoteManager(zygoteManager, callback) {
+		_.pull(this._zygoteManagerList, zygoteManager);
+		if (!zygoteManager.isHealthy()) {
+			if (zygoteManager.hasDeparted()) {
+				callback(null);
+			} else {
+				zygoteManager.forceKillMyZygote(() => { callback(null); });
+			}
+		} else if (zygoteManager.isWorkerReady()) {
+			// standby or recycled worker has to be killed before the zygote
+			zygoteManager.killWorker(() => {
+				zygoteManager.shutdown(callback);
+			});
+		} else {
+			zygoteManager.shutdown(callback);
+		}
+	}
+
+	/**
+	 * Replace a broken or dead ZygoteManager by a new one in the background.
+	 * The ZygoteManager must not be in use. Failed replacements are retried
+	 * with exponential backoff.
+	 * @param {ZygoteManager} zygoteManager
+	 */
+	_replaceZygoteManager(zygoteManager) {
+		if (!this._zygoteManagerList.includes(zygoteManager)) {
+			return; // already replaced or removed
+		}
+		if (this._isShutdown) {
+			// shutdown() is waiting for it in the idle queue
+			if (!this._idleSince.has(zygoteManager)) {
+				this._idleSince.set(zygoteManager, Date.now());
+				this._idleZygoteManagerQueue.put(zygoteManager);
+			}
+			return;
+		}
+		_.pull(this._zygoteManagerList, zygoteManager);
+		this._idleZygoteManagerQueue.remove(zygoteManager);
+		this._idleSince.delete(zygoteManager);
+		this._totalZygoteNum--;
+		if (!zygoteManager.hasDeparted()) {
+			zygoteManager.forceKillMyZygote(() => {});
+		}
+		this._respawnZygote();
+	}
+
+	_respawnZygote() {
+		const options = this._options;
+		const delay = this._respawnFailures == 0 ? 0 : Math.min(
+			options['maxRespawnBackoff'],
+			options['respawnBackoff'] * Math.pow(2, this._respawnFailures - 1)
+		);
+		setTimeout(() => {
+			if (this._isShutdown) return;
+			this._addZygote(1, (err) => {
+				if (err) {
+					this._respawnFailures++;
+					this._respawnZygote();
+				} else {
+					this._respawnFailures = 0;
+				}
+			}, options, 'replace');
+		}, delay);
+	}
+
+	/**
+	 * Start asking idle zygotes periodically for their status.
+	 * @param {number} interval
+	 */
+	_startHealthChecks(interval) {
+		const checking = new Set(); // ZygoteManagers with a pending health check
+		this._healthCheckTimer = setInterval(() => {
+			this._idleSince.forEach((since, zygoteManager) => {
+				if (checking.has(zygoteManager)) return;
+				checking.add(zygoteManager);
+				zygoteManager.healthCheck((err) => {
+					checking.delete(zygoteManager);
+					// a zygote allocated meanwhile is replaced when reclaimed
+					if (err && this._idleSince.has(zygoteManager)) {
+						this._replaceZygoteManager(zygoteManager);
+					}
+				});
+			});
+		}, interval);
+		// health checks alone should not keep the process alive
+		this._healthCheckTimer.unref();
+	}
+
+	/**
+	 * Start checking periodically whether zygotes need to be added or removed.
+	 * @param {number} zygoteNum Initial number of zygotes
+	 * @param {Object} options Options given to the constructor
+	 */
+	_startAutoscaling(zygoteNum, options) {
+		this._options = options = _.defaults({}, options, {
+			minZygotes: zygoteNum,
+			targetQueueWait: 100,
+			idleZygoteTimeout: 60000,
+			autoscaleInterval: 100,
+		});
+		this._autoscaleTimer = setInterval(() => {
+			this._autoscale();
+		}, options['autoscaleInterval']);
+		// autoscaling alone should not keep the process alive
+		this._autoscaleTimer.unref();
+	}
+
+	/**
+	 * Add zygotes if requests wait too long, remove zygotes idle for too long.
+	 */
+	_autoscale() {
+		const options = this._options;
+		const queue = this._idleZygoteManagerQueue;
+
+		if (queue.longestWaitTime() > options['targetQueueWait']) {
+			// one new zygote for each waiting request not covered yet
+			let num = Math.min(
+				queue.waitingCount() - this._startingZygoteNum,
+				options['maxZygotes'] - this._totalZygoteNum
+			);
+			if (num > 0) {
+				this._addZygote(num, () => {}, this._options, 'autoscale');
+			}
+		}
+
+		const now = Date.now();
+		this._idleSince.forEach((since, zygoteManager) => {
+			if (this._totalZygoteNum <= options['minZygotes']) return;
+			if (now - since < options['idleZygoteTimeout']) return;
+			if (!queue.remove(zygoteManager)) return;
+			this._idleSince.delete(zygoteManager);
+			this._totalZygoteNum--;
+			this._shutdownZygoteManager(zygoteManager, () => {});
+		});
 	}
 
 	/**
@@ -183,34 +593,254 @@ class ZygotePool {
 		return this.totalZygoteNum() - this.idleZygoteNum();
 	}
 
+	/**
+	 * Get waiting statistics of requests for idle zygotes.
+	 * @return {Object} Maps priority to {served, expired, totalWaitTime,
+	 *                  maxWaitTime}, see BlockingQueue.waitStats()
+	 */
+	waitStats() {
+		return this._idleZygoteManagerQueue.waitStats();
+	}
+
+	/**
+	 * Get the metrics of this pool (see metrics.js) in the Prometheus text
+	 * format, e.g. to serve them to a Prometheus server.
+	 * @return {String}
+	 */
+	prometheusMetrics() {
+		return this.metrics.toPrometheus();
+	}
+
+	/**
+	 * Measure the memory of every zygote and its worker.
+	 * @param {function(Error, Array)} callback Called with an array of
+	 *      {zygote, worker} (see ZygoteManager.memory()), or an error.
+	 *      If not specified, a Promise is returned.
+	 */
+	memoryStats(callback) {
+		return callbackOrPromise(callback, (callback) => {
+			Promise.all(this._zygoteManagerList.map((zygoteManager) => new Promise((resolve, reject) => {
+				zygoteManager.memory((err, memory) => err ? reject(err) : resolve(memory));
+			}))).then((stats) => callback(null, stats), callback);
+		});
+	}
+
+	/**
+	 * Compile python files into the code cache of every zygote (see
+	 * ZygoteManager.compile()). Zygotes added later do not compile them;
+	 * use options preload and preloadCompile for that.
+	 * @param {Array} paths Absolute paths of python files or directories
+	 * @param {function(Error, Array)} callback Called with the {entries, bytes}
+	 *      of the code cache of every zygote, or an error.
+	 *      If not specified, a Promise is returned.
+	 */
+	compile(paths, callback) {
+		return callbackOrPromise(callback, (callback) => {
+			Promise.all(this._zygoteManagerList.map((zygoteManager) => new Promise((resolve, reject) => {
+				zygoteManager.compile(paths, (err, codeCache) => err ? reject(err) : resolve(codeCache));
+			}))).then((caches) => callback(null, caches), callback);
+		});
+	}
+
 	/**
 	 * Request a ZygoteIterface to use (but Zygote will not be allocated until
 	 * the first time of calling ZygoteIterface.run()). See implementation of
 	 * ZygoteInterface and allocateZygoteManager() below.
+	 * @param {Object} options Include optional priority (number, requests with
+	 *      higher priority get idle zygotes first, defaults to 0) and deadline
+	 *      (Date or ms since epoch, after which waiting for a zygote fails
+	 *      with TimeoutError)
 	 * @return {ZygoteInterface} An interface to use the zygote.
 	 */
-	request() {
-		return new ZygoteInterface(this);
+	request(options={}) {
+		return new ZygoteInterface(this, options);
+	}
+
+	/**
+	 * Run many independent calls over the zygotes of the pool, each in its
+	 * own request (see iterate()).
+	 * @param {Iterable} tasks {module, fn, args, options} for each call
+	 * @param {Object} options Include optional concurrency and request
+	 *      (see iterate())
+	 * @return {Promise} Resolved with the Output of every task, in the order
+	 *      of the tasks, or rejected with the first error (no further tasks
+	 *      are started then)
+	 */
+	map(tasks, options={}) {
+		const iterator = this.iterate(tasks, _.defaults({ordered: false}, options));
+		const outputs = [];
+		const next = () => iterator.next().then((item) => {
+			if (item.done) {
+				return outputs;
+			}
+			if (item.value.err) {
+				iterator.return();
+				throw item.value.err;
+			}
+			outputs[item.value.index] = item.value.output;
+			return next();
+		});
+		return next();
+	}
+
+	/**
+	 * Run many independent calls over the zygotes of the pool. Each task
+	 * gets its own request, so a worker which failed is not used again.
+	 * At most concurrency tasks run at a time, and no more are started
+	 * while that many results wait to be consumed.
+	 * @param {Iterable} tasks {module, fn, args, options} for each call, as
+	 *      for ZygoteInterface.call(). Consumed lazily.
+	 * @param {Object} options Include optional concurrency (defaults to
+	 *      maxZygotes or the number of zygotes), ordered (yield results in
+	 *      the order of the tasks rather than as they complete, defaults to
+	 *      true) and request (options of request())
+	 * @return {AsyncIterator} Yields {index, err, output} for each task
+	 */
+	iterate(tasks, options={}) {
+		options = _.defaults({}, options, {
+			concurrency: Math.max(1, this._options['maxZygotes'] || this._totalZygoteNum),
+			ordered: true,
+			request: {},
+		});
+		const source = tasks[Symbol.iterator]();
+		const results = new Map(); // index => finished result not yet yielded
+		const completed = []; // indices of results in the order they completed
+		const waiting = []; // resolve functions of pending next() calls
+		let nextIndex = 0; // of the next task to start
+		let yieldIndex = 0; // of the next result to yield when ordered
+		let running = 0;
+		let exhausted = false;
+
+		const take = () => {
+			let index;
+			if (options.ordered) {
+				index = results.has(yieldIndex) ? yieldIndex++ : undefined;
+			} else {
+				index = completed.shift();
+			}
+			if (index === undefined) {
+				return undefined;
+			}
+			const result = results.get(index);
+			results.delete(index);
+			return result;
+		};
+		const settle = () => {
+			while (waiting.length > 0) {
+				const result = take();
+				if (result !== undefined) {
+					waiting.shift()({value: result, done: false});
+				} else if (exhausted && running == 0 && results.size == 0) {
+					waiting.shift()({value: undefined, done: true});
+				} else {
+					break;
+				}
+			}
+		};
+		const start = () => {
+			while (!exhausted && running < options.concurrency && results.size < options.concurrency) {
+				const item = source.next();
+				if (item.done) {
+					exhausted = true;
+					break;
+				}
+				const index = nextIndex++;
+				running++;
+				this._runTask(item.value, options.request, (err, output) => {
+					running--;
+					results.set(index, {index: index, err: err, output: output});
+					completed.push(index);
+					settle();
+					start();
+				});
+			}
+			settle();
+		};
+
+		const iterator = {
+			next: () => new Promise((resolve) => {
+				waiting.push(resolve);
+				start();
+			}),
+			// stop starting tasks, running ones are still yielded
+			return: () => {
+				exhausted = true;
+				settle();
+				return Promise.resolve({value: undefined, done: true});
+			},
+		};
+		if (typeof Symbol.asyncIterator === 'symbol') {
+			iterator[Symbol.asyncIterator] = () => iterator;
+		}
+		return iterator;
+	}
+
+	/**
+	 * Run a task of iterate() in a new request.
+	 * @param {Object} task {module, fn, args, options}
+	 * @param {Object} requestOptions Options of request()
+	 * @param {function(Error, Output)} callback
+	 */
+	_runTask(task, requestOptions, callback) {
+		const zygoteInterface = this.request(requestOptions);
+		zygoteInterface.call(task.module, task.fn, task.args, _.clone(task.options || {}), (err, output) => {
+			zygoteInterface.done((doneErr) => {
+				callback(err || doneErr || null, err ? null : output);
+			});
+		});
 	}
 
 	/**
-	 * Allocate a ZygoteManager for a ZygoteInterface.
+	 * Allocate a ZygoteManager for a ZygoteInterface. Idle zygotes which have
+	 * already imported the module of the first call are preferred.
 	 * @param {ZygoteInterface} zygoteInterface Where to allocate the ZygoteManager
 	 * @param {function(Error)} callback Called after a ZygoteManager is allocated
 	 *                                   or error happens
+	 * @param {String} moduleName Module of the first call
+	 * @param {Object} options Options of the first call
 	 */
-	_allocateZygoteManager(zygoteInterface, callback) {
+	_allocateZygoteManager(zygoteInterface, callback, moduleName, options, retries=2) {
 		if (this._isShutdown) {
 			callback(new Error()); // TODO error type
 			return;
 		}
 
+		const requested = Date.now();
 		this._idleZygoteManagerQueue.get((err, zygoteManager) => {
-			assert(!err); // BlockingQueue.clearWaiting() is never called
+			if (err) { // deadline of the request has passed
+				this.metrics.inc('zyspawn_queue_expired_total');
+				callback(err);
+				return;
+			}
+			this.metrics.observe('zyspawn_queue_wait_seconds', (Date.now() - requested) / 1000);
+			this._idleSince.delete(zygoteManager);
+			if (!zygoteManager.isHealthy()) {
+				// never hand out a dead zygote, wait for another one
+				this._replaceZygoteManager(zygoteManager);
+				this._allocateZygoteManager(zygoteInterface, callback, moduleName, options, retries);
+				return;
+			}
+			if (zygoteManager.isWorkerReady()) {
+				// standby worker, no need to wait for startWorker()
+				zygoteInterface._initialize(zygoteManager, (callback) => {
+					this._reclaimZygoteManager(zygoteInterface, callback);
+				});
+				callback(null);
+				return;
+			}
 			zygoteManager.startWorker((err) => {
 				if (err) {
-					// TODO create a new Zygote?
-					callback(err); // do we need to pass the error outside
+					if (err instanceof WorkerDiedError || err instanceof ResourceLimitError) {
+						// only the new worker failed, the zygote can start another one
+						this._putIdleZygoteManager(zygoteManager, () => {});
+					} else {
+						this._replaceZygoteManager(zygoteManager);
+					}
+					if (retries > 0) {
+						this._allocateZygoteManager(zygoteInterface, callback, moduleName, options, retries - 1);
+					} else {
+						callback(err);
+					}
 				} else {
 					zygoteInterface._initialize(zygoteManager, (callback) => {
 						this._reclaimZygoteManager(zygoteInterface, callback);
@@ -218,7 +848,9 @@ class ZygotePool {
 					callback(null);
 				}
 			});
-		});
+		}, _.defaults({
+			prefer: (zygoteManager) => zygoteManager.isWarm(moduleName, options),
+		}, zygoteInterface._requestOptions));
 	}
 
 	/**
@@ -230,18 +862,101 @@ class ZygotePool {
 	_reclaimZygoteManager(zygoteInterface, callback) {
 		// TODO check if the zygote is still healthy
 		var zygoteManager = zygoteInterface._zygoteManager;
+		if (!zygoteManager.isHealthy()) {
+			this._replaceZygoteManager(zygoteManager);
+			zygoteInterface._finalize();
+			callback(null);
+			return;
+		}
+		if (this._canRecycleWorker(zygoteManager)) {
+			zygoteManager.resetWorker((err) => {
+				if (err) {
+					// the worker is broken, kill it as usual
+					this._killAndPutIdleZygoteManager(zygoteManager, callback);
+				} else {
+					this._putIdleZygoteManager(zygoteManager, () => { callback(null); });
+				}
+			});
+			zygoteInterface._finalize();
+			return;
+		}
+		if (this._standbyWorker) {
+			// kill and restart the worker in background
+			zygoteManager.killWorker((err) => {
+				if (err) {
+					this._replaceZygoteManager(zygoteManager);
+					return;
+				}
+				this._putIdleZygoteManager(zygoteManager, () => {});
+			});
+			zygoteInterface._finalize();
+			callback(null);
+			return;
+		}
+		this._killAndPutIdleZygoteManager(zygoteManager, callback);
+		zygoteInterface._finalize();
+	}
+
+	/**
+	 * Kill the worker of a ZygoteManager and put it into the idle queue.
+	 * @param {ZygoteManager} zygoteManager
+	 * @param {function(Error)} callback Called after the ZygoteManager is queued
+	 *                                   or error happens
+	 */
+	_killAndPutIdleZygoteManager(zygoteManager, callback) {
 		// console.log("Cleaning up! Start killing worker...");
 		zygoteManager.killWorker((err) => {
 			// console.log("Worker is killed!");
 			if (err) {
-				// TODO create a new Zygote?
-				callback(err);
-			} else {
-				this._idleZygoteManagerQueue.put(zygoteManager);
+				// the zygote is broken, the request is done nonetheless
+				this._replaceZygoteManager(zygoteManager);
 				callback(null);
+			} else {
+				this._putIdleZygoteManager(zygoteManager, () => { callback(null); });
 			}
 		});
-		zygoteInterface._finalize();
+	}
+
+	/**
+	 * Whether the worker of a reclaimed ZygoteManager should be reset and
+	 * reused rather than killed.
+	 * @param {ZygoteManager} zygoteManager
+	 * @return {boolean}
+	 */
+	_canRecycleWorker(zygoteManager) {
+		if (!this._recycleWorker || !zygoteManager.isWorkerReady()) {
+			return false;
+		}
+		const maxUses = this._options['workerMaxUses'];
+		const maxAge = this._options['workerMaxAge'];
+		return (maxUses === undefined || zygoteManager.workerUses < maxUses)
+			&& (maxAge === undefined || zygoteManager.workerAge() < maxAge);
+	}
+
+	/**
+	 * Put a ZygoteManager into the idle queue. In standby mode a worker is
+	 * started first so that the next allocation can use it right away.
+	 * @param {ZygoteManager} zygoteManager An idle ZygoteManager
+	 * @param {function()} callback Called after the ZygoteManager is queued
+	 */
+	_putIdleZygoteManager(zygoteManager, callback) {
+		if (!zygoteManager.isHealthy()) {
+			this._replaceZygoteManager(zygoteManager);
+			callback();
+			return;
+		}
+		if (!this._standbyWorker || zygoteManager.isWorkerReady()) {
+			this._idleSince.set(zygoteManager, Date.now());
+			this._idleZygoteManagerQueue.put(zygoteManager);
+			callback();
+			return;
+		}
+		zygoteManager.startWorker((err) => {
+			// On failure the worker will be started again on allocation
+			this._idleSince.set(zygoteManager, Date.now());
+			this._idleZygoteManagerQueue.put(zygoteManager);
+			callback();
+		});
 	}
 }
 
@@ -256,8 +971,13 @@ class ZygotePool {
  * their work.
  */
 class ZygoteInterface {
-	constructor(zygotePool) {
+	/**
+	 * @param {ZygotePool} zygotePool The pool to allocate a zygote from
+	 * @param {Object} requestOptions priority and deadline, see ZygotePool.request()
+	 */
+	constructor(zygotePool, requestOptions={}) {
 		this._zygotePool = zygotePool;
+		this._requestOptions = requestOptions;
 		this._zygoteManager = null;
 		this._done = (callback) => { callback(null); };
 		this._state = ZygoteInterface.UNINITIALIZED;
@@ -301,21 +1021,80 @@ class ZygoteInterface {
 	 * @param {String} moduleName The module where the function resides
 	 * @param {String} functionName The function to run
 	 * @param {Array} arg Arguments for the function as an array
-	 * @param {Object} options Include optional cwd (as absolute path), paths and timeout.
+	 * @param {Object} options Include optional cwd (as absolute path), paths, timeout,
+	 *      limits, maxOutputSize, onOutput and profile (see ZygoteManager.call()), and
+	 *      cache (look up and store the Output in the result cache of the pool,
+	 *      defaults to the cacheByDefault option of the cache). A cached Output
+	 *      is returned without allocating a zygote, its stdout and stderr are
+	 *      passed to onOutput in one piece each.
 	 * @param {function(Error, Output)} callback Called when the result is computed
-	 *      or any error happens. Output contains tree fields: stdout(String),
-	 *      stderr(String), result(object)
+	 *      or any error happens. Output contains stdout(String), stderr(String),
+	 *      result(object) and usage(object). If not specified, a Promise of
+	 *      the Output is returned.
 	 */
 	call(moduleName, functionName, arg, options, callback) {
+		return callbackOrPromise(callback, (callback) => {
+			this._cachedCall(moduleName, functionName, arg, options, callback);
+		});
+	}
+
+	_cachedCall(moduleName, functionName, arg, options, callback) {
+		const cache = this._zygotePool.resultCache;
+		if (cache === null || !cache.isEnabled(options) || this.state() === ZygoteInterface.FINALIZED) {
+			this._call(moduleName, functionName, arg, options, callback);
+			return;
+		}
+		cache.key(moduleName, functionName, arg, options, (err, key) => {
+			if (err) { // the call fails with FileMissingError
+				this._call(moduleName, functionName, arg, options, callback);
+				return;
+			}
+			cache.get(key, (err, output) => {
+				if (output) {
+					if (options.onOutput) {
+						// the output kept in the Output, see maxOutputSize
+						['stdout', 'stderr'].forEach((stream) => {
+							if (output[stream].length > 0) {
+								options.onOutput(stream, output[stream]);
+							}
+						});
+					}
+					callback(null, output);
+					return;
+				}
+				this._call(moduleName, functionName, arg, options, (err, output) => {
+					if (!err) {
+						cache.set(key, output);
+					}
+					callback(err, output);
+				});
+			});
+		});
+	}
+
+	_call(moduleName, functionName, arg, options, callback) {
+		const pool = this._zygotePool;
+		if (options.profile === undefined && pool._profileSampleRate > 0 && Math.random() < pool._profileSampleRate) {
+			options = _.defaults({profile: true}, options);
+		}
+		if (options.profile && pool._onProfile !== null) {
+			const done = callback;
+			callback = (err, output) => {
+				if (output && output.profile) {
+					pool._onProfile(output.profile, {module: moduleName, fn: functionName});
+				}
+				done(err, output);
+			};
+		}
 		switch (this.state()) {
 			case ZygoteInterface.UNINITIALIZED:
 				this._zygotePool._allocateZygoteManager(this, (err) => {
-					if (err) { // Failure in ZygoteManager.startWorker()
+					if (err) { // Failure in ZygoteManager.startWorker() or deadline passed
 						callback(err);
 					} else {
 						this._zygoteManager.call(moduleName, functionName, arg, options, callback);
 					}
-				});
+				}, moduleName, options);
 				break;
 			case ZygoteInterface.INITIALIZED:
 				this._zygoteManager.call(moduleName, functionName, arg, options, callback);
@@ -328,14 +1107,50 @@ class ZygoteInterface {
 		}
 	}
 
+	/**
+	 * Run several functions in one request (See ZygoteManager.callBatch()).
+	 * @param {Array} calls Array of {module, fn, args, options}
+	 * @param {Object} options Include optional timeout, threadData and stopOnError.
+	 * @param {function(Error, Array)} callback Called with an array of
+	 *      {err, output} for each call which was run, or any error. If not
+	 *      specified, a Promise of the array is returned.
+	 */
+	callBatch(calls, options, callback) {
+		return callbackOrPromise(callback, (callback) => {
+			this._callBatch(calls, options, callback);
+		});
+	}
+
+	_callBatch(calls, options, callback) {
+		switch (this.state()) {
+			case ZygoteInterface.UNINITIALIZED:
+				this._zygotePool._allocateZygoteManager(this, (err) => {
+					if (err) {
+						callback(err);
+					} else {
+						this._zygoteManager.callBatch(calls, options, callback);
+					}
+				}, calls.length ? calls[0].module : null, calls.length ? calls[0].options : null);
+				break;
+			case ZygoteInterface.INITIALIZED:
+				this._zygoteManager.callBatch(calls, options, callback);
+				break;
+			case ZygoteInterface.FINALIZED:
+				callback(new InvalidOperationError("Calling callBatch() after done() on ZygoteInterface"));
+				break;
+			default:
+				assert(false, "Bad state of ZygoteInterface: " + this.state());
+		}
+	}
+
 	/**
 	 * Call the registered done function. Must be called after finishing using
 	 * this zygote, except that any error happens in use.
 	 * @param {function(Error)} callback Called after the zygote is released
-	 *      or error happens. If not specified, errors will be throwed.
+	 *      or error happens. If not specified, a Promise is returned.
 	 */
-	done(callback = DEFAULT_CALLBACK) {
-		this._done(callback);
+	done(callback) {
+		return callbackOrPromise(callback, (callback) => this._done(callback));
 	}
 }
 ZygoteInterface.UNINITIALIZED = 0;
@@ -343,7 +1158,164 @@ ZygoteInterface.INITIALIZED = 1;
 ZygoteInterface.FINALIZED = 2;
 
 
+/**
+ * Manages a ZygotePool per named profile, e.g. a python interpreter and the
+ * modules its zygotes preload, and routes requests to them by profile. Light
+ * questions then do not pay for the memory and startup of a heavy stack.
+ */
+class ProfilePool {
+	/**
+	 * Create the pools of every profile.
+	 * @param {Object} profiles Maps profile names to {size, options}, where size
+	 *      is the number of zygotes and options are the options of its
+	 *      ZygotePool, e.g.
+	 *      {light: {size: 4, options: {}},
+	 *       heavy: {size: 2, options: {type: 'python3.8', preload: ['numpy', 'sympy']}}}
+	 * @param {function(Error)} callback Called after every pool is initialized,
+	 *      if not specified, errors will be throwed.
+	 * @param {Object} options Include optional defaultProfile (used by requests
+	 *      without a profile, defaults to the first profile). Other options are
+	 *      defaults for the options of every profile.
+	 */
+	constructor(profiles, callback = DEFAULT_CALLBACK, options={}) {
+		const names = Object.keys(profiles);
+		if (names.length == 0) {
+			throw new InvalidOperationError('no profiles given to ProfilePool');
+		}
+		this._defaultProfile = options['defaultProfile'] || names[0];
+		if (!(this._defaultProfile in profiles)) {
+			throw new InvalidOperationError('unknown default profile "' + this._defaultProfile + '"');
+		}
+		const commonOptions = _.omit(options, ['defaultProfile']);
+		this._pools = new Map(); // profile name => ZygotePool
+		const jobs = names.map((name) => new Promise((resolve) => {
+			const profile = profiles[name];
+			const poolOptions = _.defaults({}, profile.options, commonOptions);
+			this._pools.set(name, new ZygotePool(profile.size, (err) => resolve(err || null), poolOptions));
+		}));
+		Promise.all(jobs).then((errs) => {
+			_.pull(errs, null);
+			callback(errs.length == 0 ? null : _.flatten(errs));
+		});
+	}
+
+	/**
+	 * Create the pools of every profile, see the constructor.
+	 * @param {Object} profiles See the constructor
+	 * @param {Object} options See the constructor
+	 * @return {Promise} Resolved with the ProfilePool after initialization
+	 */
+	static create(profiles, options={}) {
+		return new Promise((resolve, reject) => {
+			const profilePool = new ProfilePool(profiles, (err) => {
+				if (err) {
+					reject(err);
+				} else {
+					resolve(profilePool);
+				}
+			}, options);
+		});
+	}
+
+	/**
+	 * Get the names of the profiles.
+	 * @return {Array}
+	 */
+	profiles() {
+		return Array.from(this._pools.keys());
+	}
+
+	/**
+	 * Get the pool of a profile, e.g. to resize it or read its metrics.
+	 * @param {String} profile The profile, defaults to the default profile
+	 * @return {ZygotePool}
+	 */
+	pool(profile=this._defaultProfile) {
+		const zygotePool = this._pools.get(profile);
+		if (zygotePool === undefined) {
+			throw new InvalidOperationError('unknown profile "' + profile + '"');
+		}
+		return zygotePool;
+	}
+
+	/**
+	 * Request a ZygoteInterface from the pool of a profile.
+	 * @param {Object} options Include optional profile, and the options of
+	 *      ZygotePool.request()
+	 * @return {ZygoteInterface}
+	 */
+	request(options={}) {
+		return this.pool(options.profile).request(options);
+	}
+
+	/**
+	 * Run many independent calls in the pool of a profile, see ZygotePool.map().
+	 * @param {Iterable} tasks {module, fn, args, options} for each call
+	 * @param {Object} options Options of ZygotePool.map(), where
+	 *      options.request.profile selects the profile
+	 * @return {Promise}
+	 */
+	map(tasks, options={}) {
+		return this.pool(options.request && options.request.profile).map(tasks, options);
+	}
+
+	/**
+	 * Run many independent calls in the pool of a profile, see ZygotePool.iterate().
+	 * @param {Iterable} tasks {module, fn, args, options} for each call
+	 * @param {Object} options Options of ZygotePool.iterate(), where
+	 *      options.request.profile selects the profile
+	 * @return {AsyncIterator}
+	 */
+	iterate(tasks, options={}) {
+		return this.pool(options.request && options.request.profile).iterate(tasks, options);
+	}
+
+	/**
+	 * Get total number of zygotes of all profiles.
+	 * @return {number}
+	 */
+	totalZygoteNum() {
+		return _.sumBy(Array.from(this._pools.values()), (zygotePool) => zygotePool.totalZygoteNum());
+	}
+
+	/**
+	 * Measure the memory of the zygotes of every profile.
+	 * @param {function(Error, Object)} callback Called with an object mapping
+	 *      profile names to the stats of ZygotePool.memoryStats(), or an error.
+	 *      If not specified, a Promise is returned.
+	 */
+	memoryStats(callback) {
+		return callbackOrPromise(callback, (callback) => {
+			const names = this.profiles();
+			Promise.all(names.map((name) => this._pools.get(name).memoryStats()))
+				.then((stats) => callback(null, _.zipObject(names, stats)), callback);
+		});
+	}
+
+	/**
+	 * Shutdown the pools of every profile, see ZygotePool.shutdown().
+	 * @param {function(Error)} callback Called after all zygotes are shutdown.
+	 *      If not specified, a Promise is returned.
+	 */
+	shutdown(callback) {
+		return callbackOrPromise(callback, (callback) => {
+			Promise.all(Array.from(this._pools.values(), (zygotePool) => zygotePool.shutdown()))
+				.then(() => callback(null), callback);
+		});
+	}
+
+	/**
+	 * Check if the pools have been shutdown
+	 * @return {boolean}
+	 */
+	isShutdown() {
+		return Array.from(this._pools.values()).every((zygotePool) => zygotePool.isShutdown());
+	}
+}
+
 module.exports.ZygotePool = ZygotePool;
+module.exports.ProfilePool = ProfilePool;
+module.exports.ResultCache = ResultCache;
 module.exports.ZygoteInterface = ZygoteInterface;
 
 module.exports.ZyspawnError = ZyspawnError
@@ -352,3 +1324,5 @@ module.exports.FileMissingError = FileMissingError;
 module.exports.FunctionMissingError = FunctionMissingError;
 module.exports.InvalidOperationError = InvalidOperationError;
 module.exports.TimeoutError = TimeoutError;
+module.exports.ResourceLimitError = ResourceLimitError;
+module.exports.WorkerDiedError = WorkerDiedError;
@@ -4,7 +4,10 @@
 
 
 import signal, traceback
-import sys, os, json, importlib, copy, base64, io, matplotlib
+import sys, os, json, importlib, importlib.machinery, copy, base64, io
+import time, struct, collections, contextlib, errno, math, random
+import resource, gc, cProfile
+import matplotlib
 matplotlib.use('PDF')
 
 #   The actual zygote off of which process will fork of off.
@@ -17,21 +20,68 @@ matplotlib.use('PDF')
 #   4 is a pipe used by Zygote to get actions from zygote-manager.js
 #   5 is a pipe used by Zygote to respond to zygote-manager.js
 #   6 is a pipe used by Zygote to send exit info about the worker to zygote-manager.js
+#
+#   With the workerSlots option the zygote runs several workers at once, one
+#   per slot. Slot 0 uses pipes 0-3, every further slot four pipes after 6
+#   (see slotFds), which a worker of that slot moves to 0-3.
+#
+#   A zygote can also fork another zygote ("fork zygote" action), which gets
+#   the same pipes as FIFOs that zygote-manager.js opens (see forkZygote).
+#
+#   Messages on pipes 0, 3, 4 and 5 are wrapped in envelopes, one per line:
+#   {"id": <id>, "msg": <message>}
+#   The response to a message carries the id of the message, so that
+#   pipe-util.js can match responses to requests. A null id means that
+#   no response is expected.
+#   With the binaryResults option, pipe 3 carries length-prefixed frames
+#   instead of lines (see writeResult), so that file() results can be sent
+#   as raw bytes rather than base64.
 
-childPid = -1
 exitInfoPipe = open(6, 'w', encoding='utf-8')
 isWorker = False
 
-#   Returns the pid of the current childPid
-#   If no Child exists, returns -1
-def getChildPid():
-	global childPid
-	return childPid
+#   Configuration passed by zygote-manager.js as a JSON string in argv[1]
+#   {"preload": [<module name or absolute path>, ...], "preloadCompile": <bool>,
+#    "binaryResults": <bool>, "warmModuleLimit": <number>, "gcFreeze": <bool>,
+#    "workerGc": "enable" | "disable" | [<threshold0>, <threshold1>, <threshold2>],
+#    "codeCacheSize": <bytes of source>, "shmThreshold": <bytes>,
+#    "shmDir": <path>, "serializer": "json" | "msgpack", "workerSlots": <number>}
+zygoteConfig = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+preloadInfo = []
+workerSlots = zygoteConfig.get("workerSlots", 1)
+
+#   Pids of the running workers by slot
+workers = {}
+#   Pids of workers killed by "kill worker" which have not been reaped yet,
+#   by slot
+killedWorkers = {}
+#   Pids of the zygotes forked by "fork zygote", reaped without an exit info
+forkedZygotes = set()
+forkCounter = 0
+
+#   Calls and results larger than shmThreshold bytes are passed through files
+#   in shmDir (shared memory segments, see readMessage()), encoded with JSON
+#   or, with the serializer option, msgpack.
+#   If msgpack is missing, the zygote reports it in its status (see
+#   configError) rather than failing to start.
+msgpack = None
+configError = None
+if zygoteConfig.get("serializer") == "msgpack":
+	try:
+		msgpack = importlib.import_module("msgpack")
+	except ImportError as e:
+		configError = "The msgpack serializer needs the msgpack package: %s" % (e)
+segmentCounter = 0
+
+#   Question modules imported by the zygote on "warm" actions, so that workers
+#   do not import them again. Maps (cwd, paths, file) to the module, in least
+#   recently used order.
+warmModules = collections.OrderedDict()
 
-#   Stores the child's pid in the golbal variable childPid
-def setChildPid(pid):
-	global childPid
-	childPid = pid
+#   Returns the pid of the worker of a slot
+#   If no Child exists, returns -1
+def getChildPid(slot=0):
+	return workers.get(slot, -1)
 
 #   Returns if this is a worker
 def getIsWorker():
@@ -43,59 +93,534 @@ def setIsWorker():
 	global isWorker # Once your a worker, you can never go back
 	isWorker = True
 
-#   This function waits for it's child to complete it's assigned task.
-#   Returns zero upon successful completion by the child
-#   Returns -1 otherwise
+#   Returns the file descriptors of the pipes of a slot: input, stdout,
+#   stderr and output
+def slotFds(slot):
+	if slot == 0:
+		return [0, 1, 2, 3]
+	base = 7 + 4 * (slot - 1)
+	return [base, base + 1, base + 2, base + 3]
+
+#   In a new worker: moves the pipes of its slot to 0-3 and closes those of
+#   the other slots, so that a worker cannot read or write another slot
+#   The command pipes 4 and 5 are replaced by /dev/null, so that they are
+#   closed once the zygote exits, even if the worker does not.
+def useSlot(slot):
+	for other in range(1, workerSlots):
+		if other != slot:
+			for fd in slotFds(other):
+				os.close(fd)
+	if slot != 0:
+		for target, fd in enumerate(slotFds(slot)):
+			os.dup2(fd, target)
+			os.close(fd)
+	devnull = os.open(os.devnull, os.O_RDWR)
+	os.dup2(devnull, 4)
+	os.dup2(devnull, 5)
+	os.close(devnull)
+
+#   Number of pipes of a zygote: 0-6 and those of further slots
+def pipeCount():
+	return 7 + 4 * (workerSlots - 1)
+
+#   Raised in a zygote forked by forkZygote to leave the command loop of its
+#   parent, which then continues with the FIFOs
+class ForkedZygote(Exception):
+	def __init__(self, fds):
+		Exception.__init__(self, "forked zygote")
+		self.fds = fds
 
-def waitForChild(signum, frame):
-	global exitInfoPipe
-	pid = getChildPid()
+#   Forks a new zygote, which inherits the imported and preloaded modules and
+#   the code cache instead of starting python again. Its pipes are FIFOs in a
+#   new directory in shmDir named by the pipe number; the new zygote opens
+#   them (blocking until zygote-manager.js opens the other ends) and removes
+#   them. It opens the pipes it reads last, so that zygote-manager.js, which
+#   waits for those, never reads a pipe before it has a writer.
+#   Returns (pid, directory) in the parent; raises ForkedZygote in the new
+#   zygote.
+def forkZygote():
+	global forkCounter
+	forkCounter += 1
+	fifoDir = os.path.join(zygoteConfig.get("shmDir", "/dev/shm"), "zyspawn-fork-%d-%d" % (os.getpid(), forkCounter))
+	os.mkdir(fifoDir, 0o700)
+	for fd in range(pipeCount()):
+		os.mkfifo(os.path.join(fifoDir, str(fd)), 0o600)
+	sys.stdout.flush()
+	sys.stderr.flush()
+	# reapWorkers only waits for the new zygote once it is in forkedZygotes
+	signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+	pid = os.fork()
+	if pid != 0:
+		forkedZygotes.add(pid)
+		signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+		return pid, fifoDir
+	workers.clear()
+	killedWorkers.clear()
+	forkedZygotes.clear()
+	signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+	inputs = [0, 4] + [slotFds(slot)[0] for slot in range(1, workerSlots)]
+	outputs = [fd for fd in range(pipeCount()) if fd not in inputs]
+	fds = [None] * pipeCount()
+	try:
+		for fd in outputs + inputs:
+			path = os.path.join(fifoDir, str(fd))
+			fds[fd] = os.open(path, os.O_RDONLY if fd in inputs else os.O_WRONLY)
+			os.unlink(path)
+		os.rmdir(fifoDir)
+	except Exception:
+		os._exit(1)
+	raise ForkedZygote(fds)
+
+#   SIGCHLD handler: reaps every worker which has exited and sends its exit
+#   info to zygote-manager.js. Workers killed by a "kill worker" action are
+#   no longer in workers and reported with a null slot. Forked zygotes are
+#   reaped without an exit info, zygote-manager.js notices their exit on
+#   their pipes.
+def reapWorkers(signum, frame):
+	#   Only wait for known pids, a subprocess started by a preloaded module
+	#   must keep its exit status for whoever waits on it
+	for slots, isWorker in ((workers, True), (killedWorkers, False)):
+		for s, p in list(slots.items()):
+			try:
+				pid, status = os.waitpid(p, os.WNOHANG)
+			except ChildProcessError:
+				del slots[s]
+				continue
+			if pid != 0:
+				del slots[s]
+				reportExit(s if isWorker else None, pid, status)
+	for p in list(forkedZygotes):
+		try:
+			pid, status = os.waitpid(p, os.WNOHANG)
+		except ChildProcessError:
+			pid = p
+		if pid != 0:
+			forkedZygotes.discard(p)
+
+#   Sends the exit info of a worker to zygote-manager.js
+def reportExit(slot, pid, status):
 	jsonDict = {}
-	# Need to discuss need for this precation
-	# if(pid == -1):
-	#     jsonDict["type"] = 'no child in progress'
-	#     jsonDict["code"] = 'no_child_err'
-	#     jsonDict["signal"] = 'Unkown'
-
-
-	# This indicates the successful completion of the child
-	# with the natural exit with no interuptions.
-	if (signum == signal.SIGCHLD):
-		jsonDict["type"] = 'exit'
-		jsonDict["code"] = signum
-		jsonDict["signal"] = "SIGCHLD"
-		if getChildPid() != -1:
-			setChildPid(-1)
-
-	# Message when the child is interupted!
-	else:
-		jsonDict["type"] = 'exit'
-		jsonDict["code"] = signum
-		jsonDict["signal"] = 'sig: ' + str(signum)
-		value_place = -1
-	jsonStr = json.dumps(jsonDict)
-	# sys.stderr.write("Child has died")
-	exitInfoPipe.write(jsonStr + '\n')
+	jsonDict["type"] = 'exit'
+	jsonDict["slot"] = slot
+	jsonDict["pid"] = pid
+	jsonDict["code"] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else None
+	jsonDict["signal"] = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+	exitInfoPipe.write(json.dumps(jsonDict) + '\n')
 	exitInfoPipe.flush()
-	# sys.stderr.write("[Zygote] child died")
 
 
 # Function name is self explanitory
 # This function is called from the parseInput function
 
 def int_handler(signum, frame):
-	if(getChildPid() == -1):
-		sys.exit(0)
-	else:
-		pid = getChildPid()
-		setChildPid(-1)
+	exitZygote()
+
+#   Kills the workers (if any) and exits
+def exitZygote():
+	for slot, pid in list(workers.items()):
+		del workers[slot]
 		os.kill(pid, signal.SIGKILL)
-		sys.exit(0)
+	sys.exit(0)
+
+#   Reads one envelope from a file, returns (id, message)
+#   Returns (None, None) on empty lines
+#   Exits when the file is closed by the other side (zygote-manager.js has
+#   exited), instead of reading empty lines forever
+#   An envelope {"id", "shm": <path>} holds the path of a shared memory
+#   segment with the message instead of the message; the segment is removed
+#   once read.
+def readMessage(f):
+	line = f.readline()
+	if (line == ""):
+		exitZygote()
+	line = line.strip()
+	if (line == ""):
+		return None, None
+	envelope = json.loads(line)
+	if "shm" in envelope:
+		return envelope.get("id"), readSegment(envelope["shm"])
+	return envelope.get("id"), envelope["msg"]
+
+def readSegment(path):
+	try:
+		with open(path, 'rb') as f:
+			data = f.read()
+	finally:
+		os.unlink(path)
+	if msgpack is not None:
+		return msgpack.unpackb(data, raw=False)
+	return json.loads(data)
+
+#   Writes data to a new shared memory segment, returns its path
+def writeSegment(data):
+	global segmentCounter
+	segmentCounter += 1
+	path = os.path.join(zygoteConfig.get("shmDir", "/dev/shm"), "zyspawn-%d-%d" % (os.getpid(), segmentCounter))
+	with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+		f.write(data)
+	return path
+
+#   Returns the JSON envelope of a message, with the message written to a
+#   shared memory segment if it is larger than shmThreshold
+def encodeEnvelope(msgId, msg):
+	threshold = zygoteConfig.get("shmThreshold", 0)
+	json_msg = None
+	if threshold > 0:
+		if msgpack is not None:
+			data = msgpack.packb(msg, use_bin_type=True)
+		else:
+			# the JSON is reused for the envelope of a small message
+			json_msg = json.dumps(msg)
+			data = json_msg.encode('utf-8')
+		if len(data) > threshold:
+			return '{"id": %s, "shm": %s}' % (json.dumps(msgId), json.dumps(writeSegment(data)))
+	if json_msg is None:
+		json_msg = json.dumps(msg)
+	return '{"id": %s, "msg": %s}' % (json.dumps(msgId), json_msg)
+
+#   Writes an already JSON encoded message in an envelope with the given id
+def writeMessage(f, msgId, json_msg):
+	if msgId is None:
+		return
+	f.write('{"id": %s, "msg": %s}\n' % (json.dumps(msgId), json_msg))
+	f.flush()
+
+#   Writes the result of a call to the worker's output pipe (3). Without the
+#   binaryResults option this is a line like writeMessage. Otherwise a frame
+#   is written:
+#   <header length: uint32 BE><payload length: uint32 BE><header><payload>
+#   where the header is the JSON envelope and the payload is raw bytes.
+def writeResult(f, msgId, output, payload=b''):
+	if not zygoteConfig.get("binaryResults", False):
+		if msgId is not None:
+			f.write(encodeEnvelope(msgId, output) + '\n')
+			f.flush()
+		return
+	header = encodeEnvelope(msgId, output).encode('utf-8')
+	f.write(struct.pack('>II', len(header), len(payload)))
+	f.write(header)
+	f.write(payload)
+	f.flush()
+
+#   Raised by the SIGXCPU handler when a call runs out of CPU time. Like
+#   KeyboardInterrupt it is not an Exception, so that question code catching
+#   every Exception does not keep running past the limit.
+class CpuLimitExceeded(BaseException):
+	pass
+
+#   Whether a call with resource limits is running, so that a late SIGXCPU
+#   does not raise outside of it
+inLimitedCall = False
+
+def cpuLimitHandler(signum, frame):
+	if inLimitedCall:
+		raise CpuLimitExceeded("CPU time limit exceeded")
+
+#   Resource limits of a call: {"cpu": <seconds>, "memory": <bytes of address
+#   space>, "files": <number of open files>}
+limitResources = {
+	"cpu": resource.RLIMIT_CPU,
+	"memory": resource.RLIMIT_AS,
+	"files": resource.RLIMIT_NOFILE,
+}
+
+#   Lowers the soft limits for a call, returns the previous soft limits.
+#   The CPU limit counts from the CPU time the worker has already used.
+def applyLimits(limits):
+	global inLimitedCall
+	saved = {}
+	for name, value in limits.items():
+		if value is None:
+			continue
+		res = limitResources[name]
+		soft, hard = resource.getrlimit(res)
+		if name == "cpu":
+			usage = resource.getrusage(resource.RUSAGE_SELF)
+			value = int(math.ceil(usage.ru_utime + usage.ru_stime + value))
+		if hard != resource.RLIM_INFINITY:
+			value = min(value, hard)
+		saved[res] = soft
+		resource.setrlimit(res, (value, hard))
+	inLimitedCall = len(saved) > 0
+	return saved
+
+def restoreLimits(saved):
+	global inLimitedCall
+	inLimitedCall = False
+	for res, soft in saved.items():
+		resource.setrlimit(res, (soft, resource.getrlimit(res)[1]))
+
+#   Returns the name of the limit which caused the exception, or None
+def exceededLimit(e, limits):
+	if isinstance(e, CpuLimitExceeded):
+		return "cpu"
+	if isinstance(e, MemoryError) and limits.get("memory") is not None:
+		return "memory"
+	if isinstance(e, OSError) and e.errno == errno.EMFILE and limits.get("files") is not None:
+		return "files"
+	return None
+
+def limitOutput(limit, error):
+	return {"present": False, "error": "Resource limit exceeded", "limit": limit, "message": error}
+
+#   Runs a single call in the worker under its resource limits.
+#   Returns (output, payload) where output is the dict sent back as JSON and
+#   payload the raw bytes of a file() result (only with binaryResults).
+#   output["usage"] reports the CPU time (ms) used by the call, the peak RSS
+#   (bytes) of the worker so far and the wall time (ms) of import and execution.
+def runCall(inp):
+	limits = inp.get("limits") or {}
+	usage = {"importTime": 0, "execTime": 0}
+	phases = {}
+	profile = inp.get("profile")
+	if profile is True:
+		profile = {}
+	elif not isinstance(profile, dict):
+		profile = None
+	profiler = cProfile.Profile() if profile is not None else None
+	before = resource.getrusage(resource.RUSAGE_SELF)
+	saved = applyLimits(limits)
+	if profiler is not None:
+		profiler.enable()
+	try:
+		output, payload = callFunction(inp, limits, usage, phases)
+	except CpuLimitExceeded:
+		output, payload = limitOutput("cpu", traceback.format_exc()), b''
+	finally:
+		if profiler is not None:
+			profiler.disable()
+		restoreLimits(saved)
+	after = resource.getrusage(resource.RUSAGE_SELF)
+	usage["userCpu"] = (after.ru_utime - before.ru_utime) * 1000
+	usage["systemCpu"] = (after.ru_stime - before.ru_stime) * 1000
+	usage["maxRss"] = after.ru_maxrss * 1024
+	output["usage"] = usage
+	if profiler is not None:
+		phases["import"] = usage["importTime"]
+		phases["call"] = usage["execTime"]
+		# writeResult encodes the output again, this is only to time it
+		start = time.perf_counter()
+		json.dumps(output)
+		phases["serialize"] = (time.perf_counter() - start) * 1000
+		output["profile"] = {
+			"phases": phases,
+			"functions": profileSummary(profiler, profile.get("top", 20), profile.get("sort", "cumulative")),
+		}
+	return output, payload
+
+#   Summarizes what a cProfile.Profile recorded: the top functions sorted by
+#   cumulative time (including the functions they call) or, with sort
+#   "total", by the time spent in the function itself. Returns
+#   [{"function": <file:line(name)>, "calls", "primitiveCalls",
+#     "totalTime", "cumulativeTime"}, ...] with times in ms.
+def profileSummary(profiler, top, sort):
+	functions = []
+	for entry in profiler.getstats():
+		code = entry.code
+		if isinstance(code, str):
+			name = code # built-in function
+		else:
+			name = "%s:%d(%s)" % (code.co_filename, code.co_firstlineno, code.co_name)
+		functions.append({
+			"function": name,
+			"calls": entry.callcount,
+			"primitiveCalls": entry.callcount - entry.reccallcount,
+			"totalTime": entry.inlinetime * 1000,
+			"cumulativeTime": entry.totaltime * 1000,
+		})
+	key = "totalTime" if sort == "total" else "cumulativeTime"
+	functions.sort(key=lambda function: function[key], reverse=True)
+	return functions[:top]
+
+#   Runs a call, recording its time in usage and the time of setting up
+#   sys.path and changing the directory in phases (in ms)
+def callFunction(inp, limits, usage, phases=None):
+	if phases is None:
+		phases = {}
+	binaryResults = zygoteConfig.get("binaryResults", False)
+	payload = b''
+
+	# Unpack the input and assign variables
+	file = inp['file']
+	fcn = inp['fcn']
+	args = inp['args']
+	cwd = inp['cwd']
+	paths = inp['paths']
+	returnByArg = inp['returnByArg'] or False
+
+	# If no args are given, make the argument list empty
+	if args is None:
+		args = []
+
+	# reset and then set up the path
+	start = time.perf_counter()
+	sys.path = copy.copy(saved_path)
+	for path in reversed(paths):
+		sys.path.insert(0, path)
+	sys.path.insert(0, cwd)
+	questionDirs.update([cwd] + paths)
+	addCachedDirs([cwd] + paths)
+	phases["path"] = (time.perf_counter() - start) * 1000
+
+	# change to the desired working directory
+	start = time.perf_counter()
+	try:
+		os.chdir(cwd)
+		phases["chdir"] = (time.perf_counter() - start) * 1000
+	except Exception as e:
+		# Directory is invalid
+		output = {}
+		output["present"] = False
+		output["message"] = str(e)
+		output["error"] = "File path invalid"
+		return output, payload
+
+	start = time.perf_counter()
+	try:
+		mod = warmModules.get((cwd, tuple(paths), file))
+		if mod is None:
+			mod = importlib.import_module(file)
+	except Exception as e:
+		usage["importTime"] = (time.perf_counter() - start) * 1000
+		limit = exceededLimit(e, limits)
+		if limit is not None:
+			return limitOutput(limit, traceback.format_exc()), payload
+		# File nonexstant
+		output = {}
+		output["present"] = False
+		output["message"] = str(e)
+		output["error"] = "File not present in the current directory"
+		return output, payload
+	usage["importTime"] = (time.perf_counter() - start) * 1000
+
+	# Check if we have the required fcn in the module
+	if hasattr(mod, fcn):
+		# Call the desired function in the loaded module
+		method = getattr(mod, fcn)
+		start = time.perf_counter()
+		try:
+			val = method(*args)
+		except (Exception, CpuLimitExceeded):
+			usage["execTime"] = (time.perf_counter() - start) * 1000
+			error = traceback.format_exc()
+			limit = exceededLimit(sys.exc_info()[1], limits)
+			if limit is not None:
+				return limitOutput(limit, error), payload
+			sys.stderr.write("method call failed: " + error)
+			output = {}
+			output["present"] = False
+			output["error"] = error
+		else:
+			usage["execTime"] = (time.perf_counter() - start) * 1000
+			if fcn=="file":
+				# if val is None, replace it with empty string
+				if val is None:
+					val = ''
+				# if val is a file-like object, read whatever is inside
+				if isinstance(val,io.IOBase):
+					val.seek(0)
+					val = val.read()
+				# if val is a string, treat it as utf-8
+				if isinstance(val,str):
+					val = bytes(val,'utf-8')
+				if binaryResults:
+					# send the bytes as they are, after the JSON header
+					payload = bytes(val)
+				else:
+					# if this next call does not work, it will throw an error, because
+					# the thing returned by file() does not have the correct format
+					val = base64.b64encode(val).decode()
+
+			if fcn=="file" and binaryResults:
+				output = {"present": True, "binary": True}
+			# Any function that is returned by arg will modify 'data' and
+			# should not be returning anything (because 'data' is mutable).
+			elif returnByArg:
+				if val is None or val is args[-1]:
+					# 'data' was returned as it is, nothing to compare
+					output = {"present": True, "val": args[-1]}
+				else:
+					json_outp_passed = json.dumps({"present": True, "val": args[-1]}, sort_keys=True)
+					json_outp = json.dumps({"present": True, "val": val}, sort_keys=True)
+					if json_outp_passed != json_outp:
+						sys.stderr.write('WARNING: Passed and returned value of "data" differ in the function ' + str(fcn) + '() in the file ' + str(cwd) + '/' + str(file) + '.py.\n\n passed:\n  ' + str(args[-1]) + '\n\n returned:\n  ' + str(val) + '\n\nThere is no need to be returning "data" at all (it is mutable, i.e., passed by reference). In future, this code will throw a fatal error. For now, the returned value of "data" was used and the passed value was discarded.')
+					output = {"present": True, "val": val}
+			else:
+				output = {"present": True, "val": val}
+	else:
+		# the function wasn't present, so report this
+		output = {}
+		output["present"] = False
+		output["error"] = "Function not present"
+
+	return output, payload
+
+#   Runs several calls in one request:
+#   {"batch": [<call>, ...], "threadData": <bool>, "stopOnError": <bool>}
+#   The stdout and stderr of each call are captured separately. With
+#   threadData, the 'data' (last argument) returned by a returnByArg call is
+#   passed as the last argument of the next returnByArg call. With stopOnError,
+#   calls after a failed one are not run.
+#   Returns (output, payload) like runCall, where output["batch"] holds the
+#   output of each call that was run. Payloads of file() calls are
+#   concatenated and located by "offset" and "length".
+def runBatch(inp):
+	results = []
+	payloads = []
+	offset = 0
+	data = None
+	for call in inp["batch"]:
+		if inp.get("threadData", False) and data is not None and call.get("returnByArg") and call.get("args"):
+			call["args"][-1] = data
+		stdout, stderr = io.StringIO(), io.StringIO()
+		with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+			output, payload = runCall(call)
+		output["stdout"] = stdout.getvalue()
+		output["stderr"] = stderr.getvalue()
+		if output.get("binary"):
+			output["offset"] = offset
+			output["length"] = len(payload)
+			offset += len(payload)
+			payloads.append(payload)
+		results.append(output)
+		if output["present"] and call.get("returnByArg"):
+			data = output["val"]
+		if not output["present"] and inp.get("stopOnError", True):
+			break
+	return {"present": True, "batch": results}, b''.join(payloads)
+
+#   Directories of the question modules run by this worker, whose modules
+#   are removed by resetWorker
+questionDirs = set()
+
+#   Resets the state left behind by calls, so that the worker can be reused
+#   for another request: sys.path, cwd, question modules in sys.modules and
+#   warmModules, matplotlib figures and random seeds. The question modules
+#   warmed by the zygote are imported again by the next call that uses them.
+def resetWorker():
+	sys.path = copy.copy(saved_path)
+	os.chdir(saved_cwd)
+	dirs = tuple(os.path.join(os.path.abspath(d), '') for d in questionDirs)
+	for name, mod in list(sys.modules.items()):
+		modFile = getattr(mod, '__file__', None)
+		if dirs and modFile is not None and os.path.abspath(modFile).startswith(dirs):
+			del sys.modules[name]
+	questionDirs.clear()
+	warmModules.clear()
+	importlib.invalidate_caches()
+	if 'matplotlib.pyplot' in sys.modules:
+		sys.modules['matplotlib.pyplot'].close('all')
+	random.seed()
+	if 'numpy' in sys.modules:
+		sys.modules['numpy'].random.seed()
+	return {"present": True, "reset": True}
 
 def runWorker():
 	# The output file descriptor.
 	setIsWorker()
-	with open(3, 'w', encoding='utf-8') as outf:
+	signal.signal(signal.SIGXCPU, cpuLimitHandler)
+	binaryResults = zygoteConfig.get("binaryResults", False)
+	with (open(3, 'wb') if binaryResults else open(3, 'w', encoding='utf-8')) as outf:
 
 		# Infinite loop
 		# Wait for the input commands through pipie 0 (aka stdin)
@@ -105,131 +630,246 @@ def runWorker():
 		while True:
 
 			# Waiting for instructions
-			json_inp = sys.stdin.readline().strip()
-			if(json_inp is None or json_inp == ""):
+			msgId, inp = readMessage(sys.stdin)
+			if (inp is None):
 				continue
 
-			# Unpack the input as JSON and assign variables
-			inp = json.loads(json_inp)
-			file = inp['file']
-			fcn = inp['fcn']
-			args = inp['args']
-			cwd = inp['cwd']
-			paths = inp['paths']
-			returnByArg = inp['returnByArg'] or False
-
-			# If no args are given, make the argument list empty
-			if args is None:
-				args = []
-
-			# reset and then set up the path
-			sys.path = copy.copy(saved_path)
-			for path in reversed(paths):
-				sys.path.insert(0, path)
-			sys.path.insert(0, cwd)
-
-			# change to the desired working directory
-			try:
-				os.chdir(cwd)
-			except Exception as e:
-				# Directory is invalid
-				output = {}
-				output["present"] = False
-				output["message"] = str(e)
-				output["error"] = "File path invalid"
-				json_output = json.dumps(output)
-				outf.write(json_output)
-				outf.write("\n")
-				outf.flush()
-				continue
-
-			try:
-				mod = importlib.import_module(file)
-			except Exception as e:
-				# File nonexstant
-				output = {}
-				output["present"] = False
-				output["message"] = str(e)
-				output["error"] = "File not present in the current directory"
-				json_output = json.dumps(output)
-				outf.write(json_output)
-				outf.write("\n")
-				outf.flush()
-				continue
-
-
-			# Check if we have the required fcn in the module
-			if hasattr(mod, fcn):
-				# Call the desired function in the loaded module
-				method = getattr(mod, fcn)
-				try:
-					val = method(*args)
-				except:
-					error = traceback.format_exc()
-					sys.stderr.write("method call failed: " + error)
-					output = {}
-					output["present"] = False
-					output["error"] = error
-					json_outp = json.dumps(output)
-				else:
-					if fcn=="file":
-						# if val is None, replace it with empty string
-						if val is None:
-							val = ''
-						# if val is a file-like object, read whatever is inside
-						if isinstance(val,io.IOBase):
-							val.seek(0)
-							val = val.read()
-						# if val is a string, treat it as utf-8
-						if isinstance(val,str):
-							val = bytes(val,'utf-8')
-						# if this next call does not work, it will throw an error, because
-						# the thing returned by file() does not have the correct format
-						val = base64.b64encode(val).decode()
-
-					# Any function that is returned by arg will modify 'data' and
-					# should not be returning anything (because 'data' is mutable).
-					if returnByArg:
-						if val is None:
-							json_outp = json.dumps({"present": True, "val": args[-1]})
-						else:
-							json_outp_passed = json.dumps({"present": True, "val": args[-1]}, sort_keys=True)
-							json_outp = json.dumps({"present": True, "val": val}, sort_keys=True)
-							if json_outp_passed != json_outp:
-								sys.stderr.write('WARNING: Passed and returned value of "data" differ in the function ' + str(fcn) + '() in the file ' + str(cwd) + '/' + str(file) + '.py.\n\n passed:\n  ' + str(args[-1]) + '\n\n returned:\n  ' + str(val) + '\n\nThere is no need to be returning "data" at all (it is mutable, i.e., passed by reference). In future, this code will throw a fatal error. For now, the returned value of "data" was used and the passed value was discarded.')
-					else:
-						json_outp = json.dumps({"present": True, "val": val})
+			if inp.get("reset"):
+				output, payload = resetWorker(), b''
+			elif "batch" in inp:
+				output, payload = runBatch(inp)
 			else:
-				# the function wasn't present, so report this
-				output = {}
-				output["present"] = False
-				output["error"] = "Function not present"
-				json_outp = json.dumps(output)
+				output, payload = runCall(inp)
 
 			# make sure all output streams are flushed
 			sys.stderr.flush()
 			sys.stdout.flush()
 
-			# write the return value (JSON on a single line)
-			outf.write(json_outp)
-			outf.write("\n")
-			outf.flush()
+			# write the return value (JSON on a single line, or a frame)
+			writeResult(outf, msgId, output, payload)
 
 saved_path = copy.copy(sys.path)
+saved_cwd = os.getcwd()
+
+#   Code objects of compiled python files, so that workers (which inherit the
+#   cache from the zygote) do not compile question and library files again.
+#   Zygotes run with -B, so no .pyc files are written to course directories.
+#   Maps path to (mtime_ns, size, code) in least recently used order; the
+#   total size of the source files is kept under codeCacheSize.
+codeCache = collections.OrderedDict()
+codeCacheBytes = 0
+
+#   Returns the code object of a python file, from codeCache if the file has
+#   not changed since it was compiled.
+def compileFile(path):
+	global codeCacheBytes
+	st = os.stat(path)
+	entry = codeCache.get(path)
+	if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+		codeCache.move_to_end(path)
+		return entry[2]
+	with open(path, 'rb') as f:
+		source = f.read()
+	code = compile(source, path, 'exec', dont_inherit=True)
+	if entry is not None:
+		del codeCache[path]
+		codeCacheBytes -= entry[1]
+	codeCache[path] = (st.st_mtime_ns, st.st_size, code)
+	codeCacheBytes += st.st_size
+	while codeCacheBytes > zygoteConfig.get("codeCacheSize", 0) and codeCache:
+		codeCacheBytes -= codeCache.popitem(last=False)[1][1]
+	return code
+
+#   Compiles a python file, or every python file under a directory, into
+#   codeCache. Returns a list of errors.
+def compilePath(path):
+	addCachedDirs([path if os.path.isdir(path) else os.path.dirname(path)])
+	if not os.path.isdir(path):
+		paths = [path]
+	else:
+		paths = [os.path.join(root, name) for root, dirs, names in os.walk(path)
+			for name in names if name.endswith('.py')]
+	errors = []
+	for p in paths:
+		try:
+			compileFile(p)
+		except Exception as e:
+			errors.append("%s: %s" % (p, e))
+	return errors
+
+def codeCacheInfo():
+	return {"entries": len(codeCache), "bytes": codeCacheBytes}
+
+#   Directories (with a trailing separator) whose python files are loaded
+#   through codeCache: those of question modules (cwd and paths of calls and
+#   warm actions), of absolute preload entries and of compile actions. Files
+#   elsewhere, e.g. the standard library and site-packages, are loaded as
+#   usual from their .pyc files.
+cachedDirs = set()
+
+def isCachedPath(path):
+	path = os.path.join(os.path.abspath(path), '')
+	return any(path.startswith(d) for d in cachedDirs)
+
+def addCachedDirs(dirs):
+	for d in dirs:
+		d = os.path.join(os.path.abspath(d), '')
+		if d in cachedDirs:
+			continue
+		cachedDirs.add(d)
+		# finders created before do not use the code cache
+		for entry in list(sys.path_importer_cache):
+			if os.path.join(os.path.abspath(entry), '').startswith(d):
+				del sys.path_importer_cache[entry]
+
+#   Loads source files of cachedDirs through codeCache
+class CachingSourceFileLoader(importlib.machinery.SourceFileLoader):
+	def get_code(self, fullname):
+		path = self.get_filename(fullname)
+		if not isCachedPath(path):
+			return super().get_code(fullname)
+		return compileFile(path)
+
+#   Makes imports from cachedDirs use CachingSourceFileLoader for source files
+def installCodeCache():
+	finderHook = importlib.machinery.FileFinder.path_hook(
+		(importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES),
+		(CachingSourceFileLoader, importlib.machinery.SOURCE_SUFFIXES),
+		(importlib.machinery.SourcelessFileLoader, importlib.machinery.BYTECODE_SUFFIXES),
+	)
+	def codeCachePathHook(path):
+		if not isCachedPath(path):
+			# left to the default path hooks
+			raise ImportError("not a directory of the code cache")
+		return finderHook(path)
+	sys.path_hooks.insert(0, codeCachePathHook)
+	sys.path_importer_cache.clear()
+
+if zygoteConfig.get("codeCacheSize", 0) > 0:
+	installCodeCache()
+
+#   Imports a module once in the zygote so that every worker inherits it.
+#   An entry is either a module name (e.g. "numpy") or an absolute path to a
+#   python file or package directory, which is imported under its basename.
+#   Returns a dict describing the outcome and the time spent (in ms).
+def preloadModule(entry, compile):
+	info = {"name": entry}
+	start = time.perf_counter()
+	try:
+		if os.path.isabs(entry):
+			directory, name = os.path.split(entry.rstrip(os.sep))
+			if name.endswith('.py'):
+				name = name[:-3]
+			addCachedDirs([entry if os.path.isdir(entry) else directory])
+			if compile:
+				# compile every file, also those not imported by the entry
+				errors = compilePath(entry)
+				if errors:
+					info["compileErrors"] = errors
+			sys.path.insert(0, directory)
+			try:
+				importlib.import_module(name)
+			finally:
+				sys.path.remove(directory)
+		else:
+			importlib.import_module(entry)
+		info["success"] = True
+	except Exception as e:
+		info["success"] = False
+		info["error"] = str(e)
+	info["time"] = (time.perf_counter() - start) * 1000
+	return info
+
+for entry in zygoteConfig.get("preload", []):
+	preloadInfo.append(preloadModule(entry, zygoteConfig.get("preloadCompile", False)))
+
+#   Moves every object of the zygote into the permanent generation of the
+#   garbage collector before forking, so that collections in the worker do not
+#   write to (and thereby copy) the pages it shares with the zygote.
+def freezeHeap():
+	if zygoteConfig.get("gcFreeze", False):
+		gc.collect()
+		gc.freeze()
+
+#   Applies the workerGc option in a newly forked worker
+def configureWorkerGc():
+	workerGc = zygoteConfig.get("workerGc", "enable")
+	if workerGc == "disable":
+		gc.disable()
+	elif isinstance(workerGc, list):
+		gc.set_threshold(*workerGc)
+
+#   Reads the memory of a process from /proc/<pid>/smaps_rollup, in bytes:
+#   rss, pss (proportional share), uss (private to the process) and shared.
+#   Returns None if it cannot be read.
+def memoryInfo(pid):
+	fields = {}
+	try:
+		with open('/proc/%d/smaps_rollup' % pid) as f:
+			for line in f:
+				parts = line.split()
+				if len(parts) == 3 and parts[2] == 'kB':
+					fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+	except (OSError, ValueError):
+		return None
+	return {
+		"rss": fields.get("Rss", 0),
+		"pss": fields.get("Pss", 0),
+		"uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+		"shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+	}
+
+freezeHeap()
+
+#   Imports a question module in the zygote, the same way a worker would, and
+#   keeps it in warmModules. Modules from the question directories are removed
+#   from sys.modules afterwards: questions of other directories may use the
+#   same module names. Evicts the least recently used module over the limit.
+def warmModule(file, cwd, paths):
+	key = (cwd, tuple(paths), file)
+	if key in warmModules:
+		warmModules.move_to_end(key)
+		return
+	dirs = [os.path.join(os.path.abspath(d), '') for d in [cwd] + paths]
+	addCachedDirs([cwd] + paths)
+	before = set(sys.modules)
+	old_cwd = os.getcwd()
+	sys.path = [cwd] + paths + saved_path
+	try:
+		os.chdir(cwd)
+		warmModules[key] = importlib.import_module(file)
+	finally:
+		sys.path = copy.copy(saved_path)
+		os.chdir(old_cwd)
+		for name in set(sys.modules) - before:
+			modFile = getattr(sys.modules[name], '__file__', None) or ''
+			if any(modFile.startswith(d) for d in dirs):
+				del sys.modules[name]
+	while len(warmModules) > zygoteConfig.get("warmModuleLimit", 16):
+		warmModules.popitem(last=False)
 
 '''
-Valid messages that could be sent to zygote
-{"action":"create worker"}
-{"action":"kill worker"}
+Valid messages that could be sent to zygote (inside envelopes, see above)
+{"action":"create worker", "slot":<slot, defaults to 0>, "sync":<marker written first by the worker, optional>}
+{"action":"kill worker", "slot":<slot>}
 {"action":"status"}
-{"action":"getChildPid"}
+{"action":"workerPid", "slot":<slot>}
+{"action":"warm", "file":<module>, "cwd":<dir>, "paths":[<dir>, ...]}
+{"action":"memory", "slot":<slot>}
+{"action":"compile", "paths":[<file or dir>, ...]}
+{"action":"fork zygote"}
 Messages that could be sent from zygote
 {
 "success":true,
 }
 {
 "success":true,
-"message":"The current status of my child is <status>"
+"pid":<pid of the new worker>
+}
+{
+"success":true,
+"message":"The current status of my child is <status>",
+"workers":{<slot>:<pid>, ...}
 }
 {
 "success":False,
@@ -247,6 +887,25 @@ Messages that could be sent from zygote
 "success":True
 "message":"<pid_child>"
 }
+{
+"success":True,
+"warm":[[<cwd>, [<path>, ...], <module>], ...]
+}
+{
+"success":True,
+"zygote":{"rss":<bytes>, "pss":<bytes>, "uss":<bytes>, "shared":<bytes>},
+"worker":<same as zygote, or null>
+}
+{
+"success":<true if there were no errors>,
+"errors":[<message>, ...],
+"codeCache":{"entries":<number>, "bytes":<bytes of source>}
+}
+{
+"success":True,
+"pid":<pid of the new zygote>,
+"dir":<directory of its FIFOs>
+}
 '''
 
 # Takes in a json object for a command to execute, returns message
@@ -262,46 +921,103 @@ def parseInput(command_input):
 		return message
 
 	action = command_input["action"]
+	slot = command_input.get("slot", 0)
+	if (action in ("create worker", "kill worker") and not 0 <= slot < workerSlots):
+		message["success"] = False
+		message["message"] = "no worker slot %s" % slot
+		return message
 	if (action == "create worker"):
-		if (getChildPid() != -1):
+		if (getChildPid(slot) != -1):
 			# we already have a child
 			message["success"] = False
 			message["message"] = "zygote already contains worker"
 			return message
-		setChildPid(os.fork())
-		if (getChildPid() == 0):
+		freezeHeap()
+		sys.stdout.flush()
+		sys.stderr.flush()
+		# a worker which exits right away must only be reaped once it is in
+		# workers, or its slot would keep its pid
+		signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+		# the last worker of the slot must not write to its pipes any more
+		# once the new one starts (see sync below)
+		killed = killedWorkers.pop(slot, None)
+		if killed is not None:
+			reportExit(None, killed, os.waitpid(killed, 0)[1])
+		pid = os.fork()
+		if (pid == 0):
 			# We are child
-			setChildPid(-1)
+			workers.clear()
+			killedWorkers.clear()
+			forkedZygotes.clear()
+			signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+			signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+			useSlot(slot)
+			# the results of the last worker of the slot may end in a partial
+			# message, zygote-manager.js drops everything up to this marker
+			if command_input.get("sync"):
+				os.write(3, command_input["sync"].encode('utf-8'))
+			configureWorkerGc()
 			try:
 				runWorker()
-			except:
+			except Exception:
 				sys.stderr.write("run worker failed: " + traceback.format_exc())
 			sys.exit(1) # exit with error code if child exits runWorker
-		else:
-			# Set signal handler for when child dies
-			signal.signal(signal.SIGCHLD, waitForChild)
+		workers[slot] = pid
+		signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
 		message["success"] = True
+		message["pid"] = pid
 	elif (action == "kill worker"):
-		if (getChildPid() == -1):
+		if (getChildPid(slot) == -1):
 			message["success"] = False
 			message["message"] = "no current worker"
 			return message
-		pid = getChildPid()
-		setChildPid(-1)
-		os.kill(pid, signal.SIGKILL)
+		# reapWorkers reaps the worker once it has exited, so that other
+		# commands do not wait for that
+		killedWorkers[slot] = workers.pop(slot)
+		os.kill(killedWorkers[slot], signal.SIGKILL)
 		message["success"] = True
-		os.waitpid(pid, 0)
 	elif (action == "kill self"):
 		# TODO ADD ADDITIONAL LOGIC
 		sys.exit(0)
 	elif (action == "status"):
+		if configError is not None:
+			message["success"] = False
+			message["message"] = configError
+			return message
 		message["success"] = True
-		status =  "not created" if (getChildPid()==-1) else "created"
+		status =  "not created" if (getChildPid(slot)==-1) else "created"
 		message["message"] = "The current status of my child is <%s>"%(status)
+		message["workers"] = workers
+		message["preload"] = preloadInfo
+		message["codeCache"] = codeCacheInfo()
 	elif (action == "workerPid"):
 		message["success"] = True
-		pid_child = getChildPid()
+		pid_child = getChildPid(slot)
 		message["message"] = "%d"%(pid_child)
+	elif (action == "warm"):
+		try:
+			warmModule(command_input["file"], command_input["cwd"], command_input["paths"])
+			message["success"] = True
+		except Exception as e:
+			message["success"] = False
+			message["message"] = str(e)
+		message["warm"] = [[cwd, list(paths), file] for (cwd, paths, file) in warmModules]
+	elif (action == "compile"):
+		errors = []
+		for path in command_input["paths"]:
+			errors += compilePath(path)
+		message["success"] = len(errors) == 0
+		message["errors"] = errors
+		message["codeCache"] = codeCacheInfo()
+	elif (action == "fork zygote"):
+		pid, fifoDir = forkZygote()
+		message["success"] = True
+		message["pid"] = pid
+		message["dir"] = fifoDir
+	elif (action == "memory"):
+		message["success"] = True
+		message["zygote"] = memoryInfo(os.getpid())
+		message["worker"] = memoryInfo(getChildPid(slot)) if getChildPid(slot) != -1 else None
 	else:
 		# DEBUG: Unkown Input
 		message["success"] = False
@@ -310,21 +1026,21 @@ def parseInput(command_input):
 
 # File input 4 is for zygote commands from the manager
 # File input 5 is for messegages returned for the commands passed through file input 4
-try:
+def serveCommands():
 	with open(4, 'r', encoding='utf-8') as inZygote, open(5, 'w', encoding='utf-8') as outZygote:
 		# infinite loop for Zygote to recieve commands
 		# Zygote will not exit on its own
 		# Unless it recieves a SIGTERM or SIGKILL
-		signal.signal(signal.SIGTERM, int_handler)
 		while True:
 			# wait for a single line of input from command pipe
-			json_inp = inZygote.readline().strip()
-			if (json_inp is None or json_inp == ""):
+			# and unpack it as JSON
+			msgId, input = readMessage(inZygote)
+			if (input is None):
 				continue
-			# unpack the input line as JSON
-			input = json.loads(json_inp)
 			try:
 				output = parseInput(input)
+			except ForkedZygote:
+				raise
 			except Exception as e:
 				sys.stderr.write("Error on parse input: " + traceback.format_exc())
 				sys.stderr.flush()
@@ -333,10 +1049,22 @@ try:
 				output["message"] = str(e)
 			json_output = json.dumps(output)
 			# sys.stderr.write("[" + json_output + "]")
-			outZygote.write(json_output + '\n')
-			outZygote.flush()
+			writeMessage(outZygote, msgId, json_output)
 		sys.stderr.write("Wierd issue found: " + str(getChildPid()) + ", " + str(getIsWorker()))
 		sys.stderr.flush()
+
+try:
+	signal.signal(signal.SIGTERM, int_handler)
+	signal.signal(signal.SIGCHLD, reapWorkers)
+	while True:
+		try:
+			serveCommands()
+		except ForkedZygote as forked:
+			# a new zygote: the pipes of the parent (4 and 5 are closed by
+			# now) are replaced by the FIFOs
+			for fd, fifo in enumerate(forked.fds):
+				os.dup2(fifo, fd)
+				os.close(fifo)
 except Exception as e:
 	jsonDict = {}
 	jsonDict["type"] = 'exit'